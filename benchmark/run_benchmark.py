@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark for the job pipeline on synthetic data.
+
+Generates synthetic job listings at a configurable scale, as raw CSVs in the
+scrapers' source=<id>/date=<day> layout and as saved listing-page HTML
+fixtures, then runs every stage the way production runs it against a local
+MySQL/MariaDB instance:
+
+    scraper_parse      parse_cards() of each scraper over the HTML fixtures
+                       (needs Selenium and --driver, skipped otherwise)
+    staging_load       staging_loader.py, per source and day
+    staging_transform  staging_transformer_v2.py, per source and day
+    staging_dedup      staging_dedup.py, per day
+    warehouse_dump     the mysqldump | sed step of LoadToWH, per day
+    warehouse_merge    load_to_wh.sh (local mode, no scp/ssh), per day
+    datamart           load_to_dm.py, per day (first run is a full build)
+
+Each stage is reported with rows, rows/sec, per-run latency (p50/p95/max)
+and peak RSS of its process into a JSON report; --compare checks the report
+against an earlier one and exits 1 on a rows/sec regression.
+
+Point it at a throwaway server: db_control, db_staging, db_warehouse and
+db_datamart are dropped and recreated from the repo's SQL scripts.
+
+    python3 run_benchmark.py --user root --jobs 5000 --days 3 --report base.json
+    python3 run_benchmark.py --user root --jobs 5000 --days 3 --report new.json --compare base.json
+"""
+
+from datetime import datetime, timedelta
+import xml.etree.ElementTree as ET
+import argparse
+import csv
+import html
+import importlib.util
+import json
+import os
+import platform
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mysql.connector
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Stage scripts import dw_metrics.py from the repo root, as the launchers do from /opt/dw/staging
+os.environ["PYTHONPATH"] = os.pathsep.join(p for p in (REPO_DIR, os.environ.get("PYTHONPATH")) if p)
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# Schema scripts in the order an install runs them
+SETUP_SCRIPTS = [
+    "extract/create_control_db_v5.sql",
+    "staging/init_staging_db_v2.sql",
+    "loadtowh/create_warehouse_db.sql",
+    "loadtowh/create_config_loadtowh.sql",
+]
+DATE_DIM_CSV = "staging/date_dim_without_quarter.csv"
+
+# Scraper module and card markup per source
+SCRAPERS = {
+    "topcv_jobs": "extract/topcv_scraper_v5.py",
+    "jobsgo_jobs": "extract/jobsgo_scraper_v1.py",
+}
+CSV_COLUMNS = ['source_id', 'job_id', 'job_title', 'company_name', 'salary', 'location', 'experience_required',
+               'posted_time', 'tags', 'job_url', 'company_logo', 'extracted_date', 'extracted_timestamp']
+
+STAGES = ["generate", "scraper_parse", "staging_load", "staging_transform", "staging_dedup",
+          "warehouse_dump", "warehouse_merge", "datamart"]
+
+LEVELS = ["Intern", "Junior", "Middle", "Senior", "Lead", "Principal"]
+ROLES = ["Python Developer", "Java Developer", "Frontend Engineer", "Backend Engineer", "Data Engineer",
+         "DevOps Engineer", "QA Engineer", "Mobile Developer", "Business Analyst", "Data Analyst",
+         "Fullstack Developer", "Solution Architect", "Product Owner", "Tester", "AI Engineer"]
+COMPANY_WORDS = ["Phần mềm", "Công nghệ", "Giải pháp số", "Dữ liệu", "Fintech", "Thương mại điện tử",
+                 "Viễn thông", "Tư vấn CNTT", "Game", "Bảo mật"]
+COMPANY_FORMS = ["Công ty TNHH {}", "Công ty Cổ phần {}", "{} JSC", "{} Co., Ltd", "Tập đoàn {}"]
+LOCATIONS = ["Hà Nội", "Hồ Chí Minh", "Đà Nẵng", "Cần Thơ", "Hải Phòng", "Bình Dương", "Huế"]
+EXPERIENCE = ["Không yêu cầu", "Dưới 1 năm", "1 năm", "2 năm", "3 năm", "5 năm"]
+POSTED = ["Hôm nay", "Hôm qua", "2 ngày trước", "5 ngày trước", "1 tuần trước", "2 tuần trước"]
+TAGS = ["Python", "Java", "SQL", "AWS", "Docker", "React", "Go", "Kubernetes", "Spark", "Node.js"]
+TITLE_NOISE = ["", "", "", "Tuyển gấp ", "[HOT] ", "Urgent - "]
+
+
+# =========================
+# Synthetic data
+# =========================
+
+def salary_text(rng):
+    low = rng.randint(5, 40)
+    return rng.choice([f"{low} - {low + rng.randint(2, 20)} triệu", "Thỏa thuận",
+                       f"Tới {low + 10} triệu", f"Trên {low} triệu"])
+
+
+def new_job(rng, n):
+    company = rng.choice(COMPANY_FORMS).format(f"{rng.choice(COMPANY_WORDS)} {n % 997}")
+    return {
+        'job_title': f"{rng.choice(LEVELS)} {rng.choice(ROLES)}",
+        'company_name': company,
+        'salary': salary_text(rng),
+        'location': rng.choice(LOCATIONS),
+        'experience_required': rng.choice(EXPERIENCE),
+        'tags': ", ".join(rng.sample(TAGS, 3)),
+    }
+
+
+def generate_days(rng, sources, jobs, days, start):
+    """Listings per (source, day). Day to day a share of jobs is removed, added or changed,
+    and part of each later source's jobs repost the first source's with a reworded title,
+    so SCD2, soft delete and cross-source dedup all get work"""
+    listings = {}
+    next_id = 1
+    pool = {source: [] for source in sources}
+    for day_index in range(days):
+        day = (start + timedelta(days=day_index)).isoformat()
+        for s_index, source in enumerate(sources):
+            current = [job for job in pool[source] if rng.random() > 0.03]
+            for job in current:
+                if rng.random() < 0.05:
+                    job['salary'] = salary_text(rng)
+            while len(current) < jobs:
+                if s_index and pool[sources[0]] and rng.random() < 0.3:
+                    job = dict(rng.choice(pool[sources[0]]))
+                    job['job_title'] = rng.choice(TITLE_NOISE) + job['job_title']
+                else:
+                    job = new_job(rng, next_id)
+                job['job_id'] = f"{source.split('_')[0][:2]}{next_id}"
+                job['job_url'] = f"https://example.invalid/{source}/{next_id}"
+                current.append(job)
+                next_id += 1
+            pool[source] = current
+            listings[(source, day)] = [dict(job, posted_time=rng.choice(POSTED)) for job in current]
+    return listings
+
+
+def write_csvs(raw_path, listings):
+    rows = 0
+    stamp = datetime.now().strftime('%H%M%S')
+    for (source, day), jobs in listings.items():
+        out_dir = os.path.join(raw_path, f"source={source}", f"date={day}")
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, f"{source}_{stamp}.csv"), 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            for job in jobs:
+                writer.writerow(dict(job, source_id=source, company_logo="", extracted_date=day,
+                                     extracted_timestamp=f"{day} 08:00:00"))
+                rows += 1
+    return rows
+
+
+def topcv_card(job):
+    e = {k: html.escape(str(v)) for k, v in job.items()}
+    tags = "".join(f'<span class="item-tag">{html.escape(t)}</span>' for t in job['tags'].split(", "))
+    return f"""<div class="job-item-search-result" data-job-id="{e['job_id']}">
+  <div class="avatar"><img src="logo.png"></div>
+  <h3 class="title"><a href="{e['job_url']}"><span>{e['job_title']}</span></a></h3>
+  <label class="title-salary">{e['salary']}</label>
+  <div class="company"><a class="company-name" href="#">{e['company_name']}</a></div>
+  <div class="address"><span class="city-text">{e['location']}</span></div>
+  <label class="exp">{e['experience_required']}</label>
+  <label class="label-update">Đăng {e['posted_time']}</label>
+  <div class="tag">{tags}</div>
+</div>"""
+
+
+def jobsgo_card(job):
+    e = {k: html.escape(str(v)) for k, v in job.items()}
+    return f"""<div class="job-card" data-id="{e['job_id']}">
+  <a href="{e['job_url']}"><div class="image-wrapper"><img src="logo.png"></div>
+  <h3 class="job-title">{e['job_title']}</h3></a>
+  <div class="company-title">{e['company_name']}</div>
+  <div class="text-primary d-flex"><span>{e['salary']}</span><span>-</span><span>{e['location']}</span></div>
+  <span class="badge" title="Yêu cầu kinh nghiệm">{e['experience_required']}</span>
+  <span class="badge" title="Loại hình">Toàn thời gian</span>
+  <span class="badge" title="Thời gian cập nhật">{e['posted_time']}</span>
+</div>"""
+
+
+CARD_RENDERERS = {"topcv_jobs": topcv_card, "jobsgo_jobs": jobsgo_card}
+
+
+def write_fixtures(fixture_path, listings, day, pages, per_page):
+    """Listing pages of the first day, one directory per source; returns cards written per source"""
+    written = {}
+    for (source, list_day), jobs in listings.items():
+        if list_day != day or source not in CARD_RENDERERS:
+            continue
+        out_dir = os.path.join(fixture_path, f"source={source}")
+        os.makedirs(out_dir, exist_ok=True)
+        written[source] = 0
+        for page in range(pages):
+            cards = jobs[page * per_page:(page + 1) * per_page]
+            if not cards:
+                break
+            body = "\n".join(CARD_RENDERERS[source](job) for job in cards)
+            with open(os.path.join(out_dir, f"page_{page + 1}.html"), 'w', encoding='utf-8') as f:
+                f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head><body>\n{body}\n</body></html>\n')
+            written[source] += len(cards)
+    return written
+
+
+# =========================
+# Environment
+# =========================
+
+def write_config(path, args, work_dir):
+    """Repo config.xml with every database pointed at the benchmark server and every path under work_dir"""
+    tree = ET.parse(os.path.join(REPO_DIR, "config.xml"))
+    root = tree.getroot()
+    for node in root.find('./database'):
+        node.find('host').text = args.host
+        node.find('port').text = str(args.port)
+        node.find('user').text = args.user
+        node.find('password').text = args.password
+    paths = {
+        './extract/base_path': "extract", './extract/log_path': "extract/logs",
+        './extract/raw_data_path': "extract/raw", './extract/locks_path': "extract/locks",
+        './load/base_path': "load", './loadtowh/base_path': "loadtowh",
+        './loadtowh/dump_path': "loadtowh/ready_to_wh", './warehouse/base_path': "warehouse",
+    }
+    for xpath, relative in paths.items():
+        node = root.find(xpath)
+        if node is not None:
+            node.text = os.path.join(work_dir, relative)
+            os.makedirs(node.text, exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "load", "logs"), exist_ok=True)
+    if args.driver:
+        root.find('./extract/driver_path').text = args.driver
+    tree.write(path, encoding="utf-8", xml_declaration=True)
+
+
+def mysql_cli(args, *extra):
+    return ["mysql", f"-h{args.host}", f"-P{args.port}", f"-u{args.user}", *extra]
+
+
+def cli_env(args):
+    return dict(os.environ, MYSQL_PWD=args.password)
+
+
+def setup_schema(args, conn, log_path):
+    # The scripts use DELIMITER, so they go through the mysql client. --force keeps going past
+    # statements that only matter on a real install (GRANT to the app user)
+    for script in SETUP_SCRIPTS:
+        with open(os.path.join(REPO_DIR, script), 'rb') as f, open(log_path, 'ab') as log:
+            subprocess.run(mysql_cli(args, "--force"), stdin=f, stdout=log, stderr=log, env=cli_env(args))
+
+    cursor = conn.cursor()
+    # Setup inserts sample staging rows; the benchmark starts from empty tables
+    for table in ("db_staging.staging_topcv_jobs", "db_staging.staging_topcv_jobs_temp",
+                  "db_staging.job_dedup_signature", "db_staging.job_dedup_lsh", "db_staging.date_dim"):
+        cursor.execute(f"TRUNCATE TABLE {table}")
+
+    # Same column mapping as staging/import_date_dim.py
+    with open(os.path.join(REPO_DIR, DATE_DIM_CSV), encoding='utf-8') as f:
+        rows = [(r['date_sk'], r['full_date'], r['day_since_2005'], r['day_of_week'], r['calendar_month'],
+                 r['day_of_month'], r['day_of_year'], r['year_week_sunday'], r['holiday'], r['day_type'])
+                for r in csv.DictReader(f)]
+    cursor.executemany(
+        "INSERT INTO db_staging.date_dim (date_sk, full_date, day_since_month_start, day_of_week_calendar, "
+        "calendar_month_name, day_of_month, day_of_year, week_of_year, is_holiday, day_type) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows
+    )
+
+    # Datamart database and the log tables load_to_dm.py writes to
+    cursor.execute("DROP DATABASE IF EXISTS db_datamart")
+    cursor.execute("CREATE DATABASE db_datamart CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cursor.execute("CREATE TABLE IF NOT EXISTS db_control.load_to_dm_config "
+                   "(id INT AUTO_INCREMENT PRIMARY KEY, config_file VARCHAR(500), status VARCHAR(20), created_at DATETIME)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS db_control.load_to_dm_log "
+                   "(id INT AUTO_INCREMENT PRIMARY KEY, table_name VARCHAR(100), status VARCHAR(20), created_at DATETIME)")
+    conn.commit()
+    cursor.close()
+
+
+def scalar(conn, sql, params=()):
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return int(value or 0)
+
+
+# =========================
+# Measurement
+# =========================
+
+class StageStats:
+    """Runs of one stage: rows, wall seconds and peak RSS of each run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.runs = []
+        self.peak_rss_kb = 0
+        self.status = "ok"
+        self.detail = None
+        self.extra = {}
+
+    def add(self, seconds, rows, rss_kb=0):
+        self.runs.append((seconds, rows))
+        self.peak_rss_kb = max(self.peak_rss_kb, rss_kb)
+
+    def fail(self, detail):
+        self.status, self.detail = "failed", detail
+
+    def skip(self, reason):
+        self.status, self.detail = "skipped", reason
+
+    def report(self):
+        seconds = sum(s for s, _ in self.runs)
+        rows = sum(r for _, r in self.runs)
+        latencies = sorted(s * 1000 for s, _ in self.runs)
+        result = {
+            "status": self.status,
+            "runs": len(self.runs),
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 1),
+                "p95": round(percentile(latencies, 95), 1),
+                "max": round(latencies[-1], 1) if latencies else 0.0,
+            },
+            "peak_rss_kb": self.peak_rss_kb or None,
+        }
+        if self.detail:
+            result["reason" if self.status == "skipped" else "error"] = self.detail
+        result.update(self.extra)
+        return result
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def run_process(cmd, log_path, env=None, label=None):
+    """Run one stage process, output appended to log_path; returns (exit code, seconds, peak RSS in KB).
+    The RSS is the process's own (and its waited-for children's), not the MySQL server's"""
+    with open(log_path, 'a') as log:
+        # Commands carry passwords, so only the label is logged
+        log.write(f"\n===== {label or os.path.basename(cmd[1] if len(cmd) > 1 else cmd[0])} =====\n")
+        log.flush()
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env, cwd=REPO_DIR)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, elapsed, usage.ru_maxrss
+
+
+# =========================
+# Scraper parse path
+# =========================
+
+def load_scraper(source):
+    spec = importlib.util.spec_from_file_location(f"scraper_{source}", os.path.join(REPO_DIR, SCRAPERS[source]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_worker(args):
+    """Child process of scraper_parse: load each fixture page in a local browser and run the
+    scraper's parse_cards on it, no network and no page sleep. Prints one JSON result"""
+    module = load_scraper(args.parse_worker)
+    fixture_dir = os.path.join(args.fixtures, f"source={args.parse_worker}")
+    driver = module.setup_driver(args.driver, True)
+    pages = []
+    try:
+        for name in sorted(os.listdir(fixture_dir), key=lambda n: int(n.split("_")[1].split(".")[0])):
+            started = time.perf_counter()
+            driver.get("file://" + os.path.join(fixture_dir, name))
+            fetched = time.perf_counter()
+            cards = driver.find_elements(module.By.CSS_SELECTOR, module.CARD_SELECTOR)
+            jobs = module.parse_cards(cards, args.parse_worker, args.start)
+            pages.append((fetched - started, time.perf_counter() - fetched, len(jobs)))
+    finally:
+        driver.quit()
+    print(json.dumps({"pages": pages}))
+
+
+def run_parse_stage(stats, args, fixture_path, expected, log_path):
+    if not args.driver:
+        return stats.skip("no --driver given (needs Selenium and msedgedriver)")
+    missing = [m for m in ("selenium", "pandas") if importlib.util.find_spec(m) is None]
+    if missing:
+        return stats.skip(f"not installed: {', '.join(missing)}")
+
+    fetch_ms, parse_ms = [], []
+    for source in expected:
+        out_path = os.path.join(os.path.dirname(log_path), f"parse_{source}.json")
+        with open(out_path, 'w') as out, open(log_path, 'a') as log:
+            started = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--parse-worker", source,
+                                     "--fixtures", fixture_path, "--driver", args.driver,
+                                     "--start", args.start],
+                                    stdout=out, stderr=log, cwd=REPO_DIR)
+            _, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode:
+            return stats.fail(f"parse worker for {source} exited with {proc.returncode}, see {log_path}")
+        with open(out_path) as f:
+            result = json.load(f)
+        parsed = sum(rows for _, _, rows in result["pages"])
+        if parsed != expected[source]:
+            return stats.fail(f"{source}: parsed {parsed} of {expected[source]} cards")
+        # Latency is per page; the browser start-up is not part of it
+        for fetch, parse, rows in result["pages"]:
+            stats.add(fetch + parse, rows)
+            fetch_ms.append(fetch * 1000)
+            parse_ms.append(parse * 1000)
+        stats.peak_rss_kb = max(stats.peak_rss_kb, usage.ru_maxrss)
+        stats.extra.setdefault("process_seconds", {})[source] = round(elapsed, 3)
+    fetch_ms.sort()
+    parse_ms.sort()
+    stats.extra["page_fetch_ms_p50"] = round(percentile(fetch_ms, 50), 1)
+    stats.extra["page_parse_ms_p50"] = round(percentile(parse_ms, 50), 1)
+
+
+# =========================
+# Pipeline stages
+# =========================
+
+def run_pipeline(args, stats, config_path, work_dir, listings, days, conn, log_path):
+    python = sys.executable
+    dump_dir = os.path.join(work_dir, "loadtowh", "ready_to_wh")
+    remote_dir = os.path.join(work_dir, "warehouse", "import")
+    dm_log = os.path.join(work_dir, "datamart.log")
+
+    def step(stage, label, cmd, rows, env=None):
+        code, seconds, rss = run_process(cmd, log_path, env=env, label=f"{stage} {label}")
+        if code:
+            stats[stage].fail(f"exit code {code} on {label}, see {log_path}")
+            return False
+        stats[stage].add(seconds, rows, rss)
+        return True
+
+    for day in days:
+        # 1. Staging: load and transform each source's file for the day (the loader truncates the temp table)
+        for source in args.sources:
+            label = f"{source} {day}"
+            rows = len(listings[(source, day)])
+            if not step("staging_load", label, [python, "staging/staging_loader.py", "--config", config_path,
+                                         "--source_id", source, "--date", day], rows):
+                return "staging_load"
+            if not step("staging_transform", label, [python, "staging/staging_transformer_v2.py",
+                                              "--config", config_path], rows):
+                return "staging_transform"
+
+        new_jobs = scalar(conn, "SELECT COUNT(*) FROM db_staging.staging_topcv_jobs WHERE cluster_id IS NULL")
+        if not step("staging_dedup", day, [python, "staging/staging_dedup.py", "--config", config_path], new_jobs):
+            return "staging_dedup"
+
+        # 2. Warehouse: the dump LoadToWH takes for one day, then the load_to_wh.sh merge
+        dump_file = os.path.join(dump_dir, f"staging_{day}.sql")
+        day_rows = scalar(conn, "SELECT COUNT(*) FROM db_staging.staging_topcv_jobs WHERE last_seen_date >= %s",
+                          (day,))
+        dump = (f"mysqldump -h{args.host} -P{args.port} -u{shlex.quote(args.user)} db_staging staging_topcv_jobs "
+                f"--where=\"last_seen_date >= '{day}'\" --no-create-info --insert-ignore --complete-insert "
+                f"| sed 's/`staging_topcv_jobs`/`job_temp`/g' > {shlex.quote(dump_file)}")
+        if not step("warehouse_dump", day, ["bash", "-o", "pipefail", "-c", dump], day_rows, env=cli_env(args)):
+            return "warehouse_dump"
+        merge = ["bash", "loadtowh/load_to_wh.sh", config_path, day,
+                 "db_warehouse", args.user, args.password, args.host, str(args.port), "", remote_dir, dump_dir,
+                 "db_control", args.user, args.password, args.host, str(args.port), dump_file,
+                 str(int(time.time() * 1000))]
+        if not step("warehouse_merge", day, merge, day_rows):
+            return "warehouse_merge"
+
+        # 3. Datamart: incremental per day per config.xml (the first run builds every table)
+        wh_rows = scalar(conn, "SELECT COUNT(*) FROM db_warehouse.job")
+        if not step("datamart", day, [python, "datamart/load_to_dm.py", "--config", config_path,
+                                 "--log-file", dm_log], wh_rows):
+            return "datamart"
+    return None
+
+
+def build_report(args, stats, conn):
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                            capture_output=True, text=True).stdout.strip() or None
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "host": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "mysql": conn.get_server_info()},
+        "params": {"jobs": args.jobs, "days": args.days, "sources": args.sources, "start": args.start,
+                   "pages": args.pages, "cards_per_page": args.cards_per_page, "seed": args.seed},
+        "stages": {name: stats[name].report() for name in STAGES},
+    }
+
+
+def compare(report, baseline_path, tolerance):
+    """Rows/sec of each stage against a baseline report; True if any stage regressed past tolerance"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get("params") != report["params"]:
+        print(f"Warning: {baseline_path} was run with different parameters, rows/sec may not be comparable")
+    regressed = False
+    print(f"{'stage':<20} {'base rows/s':>12} {'rows/s':>12} {'change':>8} {'base p95 ms':>12} {'p95 ms':>10}")
+    for name in STAGES:
+        old, new = baseline.get("stages", {}).get(name), report["stages"][name]
+        if not old or not old.get("rows_per_sec") or not new.get("rows_per_sec"):
+            continue
+        change = new["rows_per_sec"] / old["rows_per_sec"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressed, flag = True, "  REGRESSION"
+        print(f"{name:<20} {old['rows_per_sec']:>12.1f} {new['rows_per_sec']:>12.1f} {change:>+8.1%} "
+              f"{old['latency_ms']['p95']:>12.1f} {new['latency_ms']['p95']:>10.1f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark on synthetic data')
+    parser.add_argument('--host', default='127.0.0.1', help='Benchmark MySQL/MariaDB server')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--allow-remote', action='store_true', help='Allow a non-local server (its databases are dropped)')
+    parser.add_argument('--jobs', type=int, default=2000, help='Listings per source per day')
+    parser.add_argument('--days', type=int, default=3, help='Days of data, loaded one day at a time')
+    parser.add_argument('--sources', default='topcv_jobs,jobsgo_jobs', help='Comma-separated source ids')
+    parser.add_argument('--start', default='2025-11-01', help='First data day (YYYY-MM-DD)')
+    parser.add_argument('--pages', type=int, default=5, help='HTML fixture pages per source')
+    parser.add_argument('--cards-per-page', type=int, default=50)
+    parser.add_argument('--driver', help='msedgedriver path for the scraper parse stage')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed of the synthetic data')
+    parser.add_argument('--work-dir', help='Directory for generated files (default: a temp dir, removed afterwards)')
+    parser.add_argument('--report', default='benchmark_report.json', help='JSON report path')
+    parser.add_argument('--compare', metavar='BASELINE', help='Earlier report to compare rows/sec against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed rows/sec drop before --compare fails')
+    parser.add_argument('--parse-worker', help=argparse.SUPPRESS)
+    parser.add_argument('--fixtures', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.parse_worker:
+        parse_worker(args)
+        return 0
+
+    args.sources = [s for s in args.sources.split(",") if s]
+    if args.host not in LOCAL_HOSTS and not args.allow_remote:
+        print(f"Refusing to run against {args.host}: the benchmark drops and recreates the pipeline databases. "
+              f"Use a local server or pass --allow-remote")
+        return 2
+    start = datetime.strptime(args.start, '%Y-%m-%d').date()
+    days = [(start + timedelta(days=i)).isoformat() for i in range(args.days)]
+
+    keep_dir = bool(args.work_dir)
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="dw_bench_"))
+    os.makedirs(work_dir, exist_ok=True)
+    log_path = os.path.join(work_dir, "benchmark.log")
+    config_path = os.path.join(work_dir, "config.xml")
+    stats = {name: StageStats(name) for name in STAGES}
+
+    try:
+        write_config(config_path, args, work_dir)
+        conn = mysql.connector.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                                       autocommit=True)
+        print(f"Setting up schemas on {args.host}:{args.port} (log: {log_path})")
+        setup_schema(args, conn, log_path)
+
+        print(f"Generating {args.jobs} listings x {len(args.sources)} sources x {args.days} days")
+        started = time.perf_counter()
+        listings = generate_days(random.Random(args.seed), args.sources, args.jobs, args.days, start)
+        rows = write_csvs(os.path.join(work_dir, "extract", "raw"), listings)
+        expected = write_fixtures(os.path.join(work_dir, "fixtures"), listings, days[0],
+                                  args.pages, args.cards_per_page)
+        stats["generate"].add(time.perf_counter() - started, rows)
+
+        print("Running scraper parse path...")
+        run_parse_stage(stats["scraper_parse"], args, os.path.join(work_dir, "fixtures"), expected, log_path)
+
+        print("Running staging -> warehouse -> datamart...")
+        failed = run_pipeline(args, stats, config_path, work_dir, listings, days, conn, log_path)
+        if failed:
+            for name in STAGES[STAGES.index(failed) + 1:]:
+                if stats[name].status == "ok" and not stats[name].runs:
+                    stats[name].skip(f"{failed} failed")
+
+        report = build_report(args, stats, conn)
+        conn.close()
+    finally:
+        if not keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"{'stage':<20} {'status':<8} {'runs':>5} {'rows':>9} {'rows/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'RSS MB':>8}")
+    for name, stage in report["stages"].items():
+        rate = f"{stage['rows_per_sec']:.1f}" if stage["rows_per_sec"] else "-"
+        rss = f"{stage['peak_rss_kb'] / 1024:.1f}" if stage["peak_rss_kb"] else "-"
+        print(f"{name:<20} {stage['status']:<8} {stage['runs']:>5} {stage['rows']:>9} {rate:>10} "
+              f"{stage['latency_ms']['p50']:>9.1f} {stage['latency_ms']['p95']:>9.1f} {rss:>8}")
+    print(f"Report written to {args.report}")
+
+    status = 1 if any(s["status"] == "failed" for s in report["stages"].values()) else 0
+    if args.compare and compare(report, args.compare, args.tolerance):
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
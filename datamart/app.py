@@ -1,26 +1,128 @@
-from flask import Flask, render_template_string
-import mysql.connector
-import pandas as pd
-import plotly.express as px
-import plotly.io as pio
+from flask import Flask, Response, abort, render_template_string, request
+from mysql.connector import pooling
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+import xml.etree.ElementTree as ET
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
 
 app = Flask(__name__)
 
-# Template HTML nhúng tất cả biểu đồ
+# Đọc cấu hình kết nối từ config.xml (giống load_to_dm.py) thay vì hardcode
+CONFIG_FILE = "/opt/dw/staging/config.xml"
+
+def load_db(root, path):
+    node = root.find(path)
+    return {
+        'host': node.find('host').text,
+        'port': int(node.find('port').text),
+        'user': node.find('user').text,
+        'password': node.find('password').text,
+        'database': node.find('database').text
+    }
+
+config_root = ET.parse(CONFIG_FILE).getroot()
+DATAMART_DB_CONFIG = load_db(config_root, './database/datamart')
+CONTROL_DB_CONFIG = load_db(config_root, './database/control')
+
+# Pool kết nối dùng chung giữa các request; semaphore giữ request chờ khi pool đã hết kết nối.
+# Khi chạy bằng gunicorn (wsgi.py) module được import sau khi fork nên mỗi worker có pool riêng.
+DASHBOARD_POOL_SIZE = int(config_root.findtext('./settings/dashboardPoolSize', '8'))
+datamart_pool = pooling.MySQLConnectionPool(pool_name="dashboard_datamart", pool_size=DASHBOARD_POOL_SIZE,
+                                            **DATAMART_DB_CONFIG)
+control_pool = pooling.MySQLConnectionPool(pool_name="dashboard_control", pool_size=2, **CONTROL_DB_CONFIG)
+pool_slots = {datamart_pool: threading.BoundedSemaphore(DASHBOARD_POOL_SIZE),
+              control_pool: threading.BoundedSemaphore(2)}
+
+# Các query aggregate trong 1 request chạy song song, mỗi query bị giới hạn thời gian
+# (MAX_EXECUTION_TIME trên MySQL + thời gian chờ phía app), bảng chậm chỉ làm hỏng biểu đồ của nó.
+# Thời gian chờ phía app tính từ lúc query bắt đầu chạy: executor dùng chung giữa các request nên
+# thời gian xếp hàng sau query của request khác không bị tính, chỉ bị giới hạn bởi REQUEST_TIMEOUT_MS
+QUERY_TIMEOUT_MS = int(config_root.findtext('./settings/dashboardQueryTimeoutMs', '2000'))
+REQUEST_TIMEOUT_MS = int(config_root.findtext('./settings/dashboardRequestTimeoutMs', '10000'))
+query_executor = ThreadPoolExecutor(max_workers=DASHBOARD_POOL_SIZE, thread_name_prefix="dashboard_query")
+
+@contextmanager
+def pooled_connection(pool):
+    with pool_slots[pool]:
+        conn = pool.get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+# Template HTML: chỉ chứa khung biểu đồ, dữ liệu được tải qua /api/agg/<name> và vẽ phía trình duyệt
+# bằng 1 bundle plotly.js dùng chung (bản cố định để trình duyệt cache lâu dài)
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>Data Mart Dashboard</title>
-    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+    <script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>
 </head>
 <body>
     <h1>Data Mart Dashboard</h1>
-    {% for title, plot in plots %}
-        <h2>{{ title }}</h2>
-        <div>{{ plot|safe }}</div>
+    <form method="get">
+        From <input type="date" name="start" value="{{ start }}">
+        to <input type="date" name="end" value="{{ end }}">
+        <button type="submit">Apply</button>
+    </form>
+    {% for table in tables %}
+        <h2>{{ table.title }}</h2>
+        <div class="chart" id="{{ table.name }}" data-name="{{ table.name }}" data-title="{{ table.title }}"
+             data-offset="0" {% if table.date_col %}data-dated="1"{% endif %}></div>
+        <button onclick="page('{{ table.name }}', -1)">Prev</button>
+        <button onclick="page('{{ table.name }}', 1)">Next</button>
         <hr>
     {% endfor %}
+    <script>
+        const START = "{{ start }}", END = "{{ end }}", TOP = {{ top }};
+
+        function drawChart(div, data) {
+            if (!data || data.error) {
+                div.textContent = `Error loading ${div.dataset.name}: ${data ? data.error : "missing"}`;
+                return;
+            }
+            Plotly.react(div, [{type: "bar", x: data.x, y: data.y}], {
+                title: div.dataset.title,
+                xaxis: {title: data.group_col},
+                yaxis: {title: data.value_col}
+            });
+        }
+
+        async function loadChart(div) {
+            const params = new URLSearchParams({top: TOP, offset: div.dataset.offset});
+            if (div.dataset.dated) {
+                params.set("start", START);
+                params.set("end", END);
+            }
+            const resp = await fetch(`/api/agg/${div.dataset.name}?${params}`);
+            drawChart(div, resp.ok ? await resp.json() : {error: resp.statusText});
+        }
+
+        async function loadAll() {
+            // Trang đầu của mọi biểu đồ trong 1 request, server query các bảng song song
+            const params = new URLSearchParams({top: TOP, start: START, end: END});
+            const resp = await fetch(`/api/aggs?${params}`);
+            const data = resp.ok ? await resp.json() : {};
+            document.querySelectorAll(".chart").forEach(div => drawChart(div, data[div.dataset.name]));
+        }
+
+        function page(name, step) {
+            const div = document.getElementById(name);
+            div.dataset.offset = Math.max(0, Number(div.dataset.offset) + step * TOP);
+            loadChart(div);
+        }
+
+        loadAll();
+    </script>
 </body>
 </html>
 """
@@ -30,41 +132,253 @@ AGG_TABLES = [
     {"name": "agg_job_by_company", "group_col": "company_name", "value_col": "total_jobs", "title": "Jobs by Company"},
     {"name": "agg_job_by_location", "group_col": "location", "value_col": "total_jobs", "title": "Jobs by Location"},
     {"name": "agg_job_by_salary", "group_col": "salary", "value_col": "total_jobs", "title": "Jobs by Salary"},
-    {"name": "agg_job_by_experience", "group_col": "experience_required", "value_col": "total_jobs", "title": "Jobs by Experience"}
+    {"name": "agg_job_by_experience", "group_col": "experience_required", "value_col": "total_jobs", "title": "Jobs by Experience"},
+    # Số tin không trùng giữa các nguồn (COUNT DISTINCT cluster_id)
+    {"name": "agg_unique_job_by_location", "group_col": "location", "value_col": "unique_jobs", "title": "Unique Jobs by Location"},
+    # Bảng cube theo ngày/tháng (dateGrain trong config.xml): lọc theo khoảng ngày bằng cột date_bucket
+    {"name": "agg_job_by_location_daily", "group_col": "location", "value_col": "total_jobs", "title": "Jobs by Location (date range)", "date_col": "date_bucket"},
+    {"name": "agg_job_by_company_monthly", "group_col": "company_name", "value_col": "total_jobs", "title": "Jobs by Company (months in range)", "date_col": "date_bucket"}
 ]
 
-@app.route("/")
-def dashboard():
-    # Kết nối Data Mart
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="khanh",
-        password="khanh123!",
-        database="db_datamart"
-    )
+# Khoảng ngày mặc định khi không truyền ?start=&end=
+DEFAULT_RANGE_DAYS = 30
 
-    plots = []
+AGG_BY_NAME = {table['name']: table for table in AGG_TABLES}
 
-    for table in AGG_TABLES:
-        try:
-            query = f"SELECT {table['group_col']}, {table['value_col']} FROM {table['name']}"
-            df = pd.read_sql(query, conn)
+# Số nhóm mặc định trên mỗi biểu đồ (top-N đọc từ index trên cột metric) và giới hạn của API
+TOP_N = 20
+API_MAX_TOP = 500
+
+# ?sort= của API: sắp theo metric (index idx_<metric>) hoặc theo nhóm (khóa chính)
+SORT_COLUMNS = {'value': 'value_col', 'group': 'group_col'}
 
-            # Nếu bảng trống, bỏ qua
-            if df.empty:
-                continue
+# Cache response đã build: mỗi fragment gắn với lần load_to_dm thành công gần nhất của bảng,
+# nên chỉ build lại khi datamart được refresh. Phiên bản được đọc lại tối đa mỗi VERSION_TTL giây.
+VERSION_TTL = 5
+MAX_CACHED_FRAGMENTS = 256
 
-            # Vẽ biểu đồ
-            fig = px.bar(df, x=table['group_col'], y=table['value_col'], title=table['title'])
-            plot_div = pio.to_html(fig, full_html=False)
-            plots.append((table['title'], plot_div))
+versions_lock = threading.Lock()
+versions_state = {'checked_at': None, 'versions': {}}
 
+cache_lock = threading.Lock()
+fragment_cache = OrderedDict()   # key -> (version, fragment)
+build_locks = {}                 # key -> lock, để mỗi fragment chỉ được build 1 lần khi nhiều request cùng miss
+
+def table_versions():
+    # Giữ lock trong lúc query để khi hết TTL chỉ 1 request đọc db_control, các request khác chờ kết quả
+    with versions_lock:
+        checked_at = versions_state['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < VERSION_TTL:
+            return versions_state['versions']
+
+        names = [table['name'] for table in AGG_TABLES]
+        try:
+            with pooled_connection(control_pool) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""
+                    SELECT table_name, MAX(created_at) FROM load_to_dm_log
+                    WHERE status = 'Success' AND table_name IN ({", ".join(["%s"] * len(names))})
+                    GROUP BY table_name
+                    """,
+                    names
+                )
+                versions_state['versions'] = dict(cursor.fetchall())
+                cursor.close()
+            versions_state['checked_at'] = time.monotonic()
         except Exception as e:
-            print(f"Error loading {table['name']}: {e}")
+            # db_control không truy cập được: tiếp tục dùng phiên bản đã biết, thử lại ở request sau
+            print(f"Error reading load_to_dm_log: {e}")
+        return versions_state['versions']
+
+def cached_fragment(key, version, build):
+    with cache_lock:
+        entry = fragment_cache.get(key)
+        if entry is not None and entry[0] == version:
+            fragment_cache.move_to_end(key)
+            return entry[1]
+        build_lock = build_locks.setdefault(key, threading.Lock())
+
+    with build_lock:
+        # Request khác có thể vừa build xong trong lúc chờ lock
+        with cache_lock:
+            entry = fragment_cache.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
 
-    conn.close()
-    return render_template_string(HTML_TEMPLATE, plots=plots)
+        fragment = build()
+
+        with cache_lock:
+            fragment_cache[key] = (version, fragment)
+            fragment_cache.move_to_end(key)
+            while len(fragment_cache) > MAX_CACHED_FRAGMENTS:
+                evicted, _ = fragment_cache.popitem(last=False)
+                build_locks.pop(evicted, None)
+        return fragment
+
+def query_table(table, start, end, top, offset, sort, order):
+    sort_col = table[SORT_COLUMNS[sort]]
+    # Sắp thêm theo nhóm để phân trang ổn định khi nhiều nhóm có cùng giá trị
+    order_sql = f"{sort_col} {order}" if sort == 'group' else f"{sort_col} {order}, {table['group_col']} {order}"
+    with pooled_connection(datamart_pool) as conn:
+        cursor = conn.cursor()
+        if "date_col" in table:
+            # Cộng các bucket đã tổng hợp sẵn trong khoảng ngày (range scan trên khóa chính)
+            cursor.execute(
+                f"SELECT /*+ MAX_EXECUTION_TIME({QUERY_TIMEOUT_MS}) */ "
+                f"{table['group_col']}, SUM({table['value_col']}) AS {table['value_col']} "
+                f"FROM {table['name']} WHERE {table['date_col']} BETWEEN %s AND %s "
+                f"GROUP BY {table['group_col']} ORDER BY {order_sql} LIMIT %s OFFSET %s",
+                (start, end, top, offset)
+            )
+        else:
+            cursor.execute(
+                f"SELECT /*+ MAX_EXECUTION_TIME({QUERY_TIMEOUT_MS}) */ "
+                f"{table['group_col']}, {table['value_col']} FROM {table['name']} "
+                f"ORDER BY {order_sql} LIMIT %s OFFSET %s",
+                (top, offset)
+            )
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+def json_value(value):
+    # SUM trả về Decimal; giữ số nguyên là int để JSON gọn
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+def build_payload(table, start, end, top, offset, sort, order):
+    rows = query_table(table, start, end, top, offset, sort, order)
+    body = json.dumps(
+        {
+            "name": table['name'],
+            "group_col": table['group_col'],
+            "value_col": table['value_col'],
+            "offset": offset,
+            "top": top,
+            "x": [r[0] for r in rows],
+            "y": [json_value(r[1]) for r in rows]
+        },
+        separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+    # Nén 1 lần khi build, các request sau dùng lại bản nén trong cache
+    return body, gzip.compress(body)
+
+def int_arg(name, default, low, high):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        value = default
+    return max(low, min(high, value))
+
+def parse_date(value, default):
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return default
+
+def date_range():
+    # Khoảng ngày cho các bảng cube; mỗi bucket được tính nếu ngày bắt đầu của nó nằm trong khoảng
+    end = parse_date(request.args.get("end"), date.today())
+    start = parse_date(request.args.get("start"), end - timedelta(days=DEFAULT_RANGE_DAYS - 1))
+    return start, end
+
+def request_params(table):
+    top = int_arg("top", TOP_N, 1, API_MAX_TOP)
+    offset = int_arg("offset", 0, 0, 10 ** 9)
+    sort = request.args.get("sort", "value")
+    if sort not in SORT_COLUMNS:
+        sort = "value"
+    order = "ASC" if request.args.get("order", "desc").lower() == "asc" else "DESC"
+    start, end = date_range() if "date_col" in table else (None, None)
+    return (start, end, top, offset, sort, order)
+
+def table_payload(table, params, version):
+    return cached_fragment(("api", table['name']) + params, version, lambda: build_payload(table, *params))
+
+@app.route("/api/agg/<name>")
+def api_agg(name):
+    table = AGG_BY_NAME.get(name)
+    if table is None:
+        abort(404)
+    params = request_params(table)
+
+    # ETag theo phiên bản dữ liệu của bảng: trình duyệt revalidate mà không cần query datamart
+    use_gzip = "gzip" in request.accept_encodings
+    version = table_versions().get(name)
+    etag = hashlib.sha1(repr((name, version) + params).encode("utf-8")).hexdigest() + ("-gz" if use_gzip else "")
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body, gz_body = table_payload(table, params, version)
+        response = Response(gz_body if use_gzip else body, mimetype="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/aggs")
+def api_aggs():
+    # Tải nhiều bảng trong 1 request (mặc định tất cả): các query chạy song song trên query_executor,
+    # bảng nào quá QUERY_TIMEOUT_MS hoặc lỗi thì trả {"error": ...} riêng cho bảng đó
+    names = request.args.get("names")
+    tables = [AGG_BY_NAME[n] for n in names.split(",") if n in AGG_BY_NAME] if names else AGG_TABLES
+    versions = table_versions()
+    deadline = time.monotonic() + REQUEST_TIMEOUT_MS / 1000
+    started = {}
+
+    def timed_payload(table, params, version):
+        started[table['name']] = time.monotonic()
+        return table_payload(table, params, version)
+
+    futures = {
+        table['name']: query_executor.submit(timed_payload, table, request_params(table), versions.get(table['name']))
+        for table in tables
+    }
+    for name, future in futures.items():
+        while not future.done():
+            # Chưa chạy: chờ tới hạn của request; đang chạy: QUERY_TIMEOUT_MS kể từ lúc bắt đầu
+            limit = deadline if name not in started else min(deadline, started[name] + QUERY_TIMEOUT_MS / 1000)
+            remaining = limit - time.monotonic()
+            if remaining <= 0:
+                break
+            wait([future], timeout=min(remaining, QUERY_TIMEOUT_MS / 1000))
+
+    parts = []
+    for name, future in futures.items():
+        if not future.done():
+            # Query còn trong hàng đợi thì hủy luôn để không chiếm kết nối của request khác
+            future.cancel()
+            print(f"Timeout loading {name}")
+            part = b'{"error":"timeout"}'
+        elif future.exception() is not None:
+            print(f"Error loading {name}: {future.exception()}")
+            part = b'{"error":"query failed"}'
+        else:
+            part = future.result()[0]
+        parts.append(json.dumps(name).encode("utf-8") + b":" + part)
+    body = b"{" + b",".join(parts) + b"}"
+
+    # Kết quả có thể thiếu bảng (timeout) nên không gắn ETag, chỉ nén
+    response = Response(body, mimetype="application/json")
+    if "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/")
+def dashboard():
+    start, end = date_range()
+    return render_template_string(HTML_TEMPLATE, tables=AGG_TABLES, top=TOP_N,
+                                  start=start.isoformat(), end=end.isoformat())
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Chỉ dùng khi phát triển; production chạy qua gunicorn (run_dashboard.sh)
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("DASHBOARD_DEBUG") == "1")
@@ -0,0 +1,25 @@
+# Cấu hình gunicorn cho dashboard datamart (đọc số worker/thread từ config.xml)
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+CONFIG_FILE = "/opt/dw/staging/config.xml"
+config_root = ET.parse(CONFIG_FILE).getroot()
+
+bind = "0.0.0.0:5000"
+
+# Nhiều process để dùng hết CPU; trong mỗi process, số thread bằng kích thước pool kết nối
+# nên request không phải chờ kết nối ngoài semaphore của app
+workers = int(config_root.findtext('./settings/dashboardWorkers', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = "gthread"
+threads = int(config_root.findtext('./settings/dashboardPoolSize', '8'))
+
+# Mỗi worker tự mở pool sau khi fork (kết nối MySQL không dùng chung được giữa các process)
+preload_app = False
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "/opt/dw/staging/datamart/logs/dashboard_access.log"
+errorlog = "/opt/dw/staging/datamart/logs/dashboard_error.log"
+loglevel = "info"
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Load generator for the datamart dashboard.
+
+Runs a fixed number of concurrent clients against the dashboard for a fixed
+duration and reports requests/sec and p50/p99 latency per path.
+
+With --seed, first fills a local MySQL stand-in (the datamart and control DBs
+of the given config.xml) with synthetic aggregate tables shaped like the ones
+load_to_dm.py builds, so the dashboard can be tested without the warehouse.
+
+    python3 load_test.py --seed --groups 5000
+    gunicorn -c gunicorn.conf.py wsgi:application
+    python3 load_test.py --url http://127.0.0.1:5000 --concurrency 64 --duration 30
+"""
+
+import mysql.connector
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+import argparse
+import gzip
+import random
+import sys
+import time
+
+DEFAULT_PATHS = "/,/api/aggs,/api/agg/agg_job_by_company,/api/agg/agg_job_by_company?offset=20"
+
+def load_db(root, path):
+    node = root.find(path)
+    return {
+        'host': node.find('host').text,
+        'port': int(node.find('port').text),
+        'user': node.find('user').text,
+        'password': node.find('password').text,
+        'database': node.find('database').text
+    }
+
+def seed(config_file, groups, days):
+    root = ET.parse(config_file).getroot()
+    datamart_config = load_db(root, './database/datamart')
+    control_config = load_db(root, './database/control')
+
+    conn = mysql.connector.connect(**datamart_config)
+    cursor = conn.cursor()
+    today = date.today()
+    names = []
+    for table in root.findall('.//aggregates/table'):
+        name = table.find('name').text
+        group_by = table.find('groupBy').text
+        dated = table.find('dateGrain') is not None
+        metric_names = [m.text.split(" AS ")[-1] for m in table.find('metrics').findall('metric')]
+        names.append(name)
+
+        # Same key and index layout as the tables generated by load_to_dm.py
+        key_cols = (["date_bucket"] if dated else []) + [group_by]
+        columns = (["date_bucket DATE NOT NULL"] if dated else []) + [f"{group_by} VARCHAR(255) NOT NULL"]
+        columns += [f"{m} BIGINT" for m in metric_names]
+        indexes = [f"KEY idx_{group_by}_date_bucket ({group_by}, date_bucket)"] if dated else \
+            [f"KEY idx_{m} ({m})" for m in metric_names]
+        cursor.execute(f"DROP TABLE IF EXISTS {name}")
+        definitions = ", ".join(columns + ["PRIMARY KEY (" + ", ".join(key_cols) + ")"] + indexes)
+        cursor.execute(
+            f"CREATE TABLE {name} ({definitions}) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+        )
+
+        buckets = [today - timedelta(days=d) for d in range(days)] if dated else [None]
+        rows = [
+            tuple(([bucket] if dated else []) + [f"{group_by} {g}"] + [random.randint(1, 500) for _ in metric_names])
+            for bucket in buckets for g in range(groups)
+        ]
+        placeholder = ", ".join(["%s"] * len(rows[0]))
+        for i in range(0, len(rows), 5000):
+            cursor.executemany(f"INSERT INTO {name} VALUES ({placeholder})", rows[i:i + 5000])
+        conn.commit()
+        print(f"Seeded {name}: {len(rows)} rows")
+    cursor.close()
+    conn.close()
+
+    # The dashboard keys its cache on the latest Success per table in load_to_dm_log
+    conn = mysql.connector.connect(**control_config)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS load_to_dm_log (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            table_name VARCHAR(100),
+            status VARCHAR(20),
+            created_at DATETIME
+        )
+        """
+    )
+    cursor.executemany(
+        "INSERT INTO load_to_dm_log (table_name, status, created_at) VALUES (%s, 'Success', NOW())",
+        [(name,) for name in names]
+    )
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+def client(base_url, paths, deadline, use_gzip):
+    # Each client cycles through the paths from a random start so paths are hit evenly
+    results = []
+    headers = {"Accept-Encoding": "gzip"} if use_gzip else {}
+    i = random.randrange(len(paths))
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            with urlopen(Request(base_url + path, headers=headers), timeout=30) as resp:
+                body = resp.read()
+                if resp.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                # /api/aggs answers 200 with {"error": ...} for the tables that timed out or failed
+                ok = resp.status < 400 and b'{"error":' not in body
+        except HTTPError as e:
+            ok = e.code == 304
+        except OSError:
+            ok = False
+        results.append((path, time.perf_counter() - started, ok))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the datamart dashboard')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Dashboard base URL')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='Comma-separated request paths')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+    parser.add_argument('--no-gzip', action='store_true', help='Do not send Accept-Encoding: gzip')
+    parser.add_argument('--seed', action='store_true', help='Seed the MySQL stand-in and exit')
+    parser.add_argument('--config', default='/opt/dw/staging/config.xml', help='config.xml used by --seed')
+    parser.add_argument('--groups', type=int, default=5000, help='Groups per seeded table (per day for cubes)')
+    parser.add_argument('--days', type=int, default=90, help='Days of buckets per seeded cube')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.config, args.groups, args.days)
+        return 0
+
+    paths = [p for p in args.paths.split(",") if p]
+    deadline = time.monotonic() + args.duration
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(client, args.url.rstrip("/"), paths, deadline, not args.no_gzip)
+                   for _ in range(args.concurrency)]
+        results = [r for f in futures for r in f.result()]
+    elapsed = time.monotonic() - started
+
+    print(f"{'path':<50} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for path in paths + [None]:
+        selected = [r for r in results if path is None or r[0] == path]
+        latencies = sorted(r[1] * 1000 for r in selected)
+        errors = sum(1 for r in selected if not r[2])
+        print(f"{path or 'TOTAL':<50} {len(selected):>9} {errors:>7} {len(selected) / elapsed:>9.1f} "
+              f"{percentile(latencies, 50):>9.1f} {percentile(latencies, 99):>9.1f}")
+    return 1 if any(not r[2] for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,32 @@
 #!/usr/bin/env python3
 
 import mysql.connector
+from mysql.connector import pooling
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import argparse
 import logging
 import os
+import re
 import sys
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-LOG_FILE = "/opt/dw/staging/datamart/logs/datamart.log"
+
+# dw_metrics.py lives in the base directory, next to config.xml
+sys.path.insert(0, BASE_DIR)
+from dw_metrics import Metrics
+
+parser = argparse.ArgumentParser(description='Load aggregates from warehouse to datamart')
+parser.add_argument('--full-rebuild', action='store_true', help='Rebuild every aggregate from scratch')
+parser.add_argument('--rollback', nargs='*', metavar='TABLE',
+                    help='Swap the previous version of the given tables (default: all) back in and exit')
+parser.add_argument('--config', default='/opt/dw/staging/config.xml', help='Path to config.xml')
+parser.add_argument('--log-file', default='/opt/dw/staging/datamart/logs/datamart.log', help='Path to the job log')
+args = parser.parse_args()
+
+LOG_FILE = args.log_file
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -29,7 +47,7 @@ logger.info("=== START LOAD TO DATAMART JOB ===")
 # =========================
 # 1. Load config XML
 # =========================
-CONFIG_FILE = "/opt/dw/staging/config.xml"
+CONFIG_FILE = args.config
 
 try:
     tree = ET.parse(CONFIG_FILE)
@@ -61,10 +79,66 @@ CONTROL_DB_CONFIG = load_db(root, './database/control')
 # Read truncate flag
 truncate_before_insert = (root.find('./settings/truncateBeforeInsert').text.lower() == 'true')
 
+# Read refresh mode: incremental applies deltas, a full rebuild still runs every N days for verification
+incremental_mode = (root.findtext('./settings/datamartMode', 'full').lower() == 'incremental')
+full_rebuild_days = int(root.findtext('./settings/datamartFullRebuildDays', '7'))
+
+# Number of aggregate scans/writes run concurrently; also the size of each connection pool
+datamart_workers = int(root.findtext('./settings/datamartWorkers', '4'))
+
 # Read tables to process
 tables = root.findall('.//aggregates/table')
 logging.info("Tables found in config: %d", len(tables))
 
+# Incremental maintenance relies on SCD2: a row enters the current set when inserted
+# and leaves it when expired, so only additive metrics over current rows qualify
+CURRENT_ROW_FILTER = "expired = '9999-12-31'"
+# Rows expired since the watermark are found by updated_at, which needs sub-second precision:
+# at whole seconds a row expired in the snapshot's last second but committed after it is never counted
+UPDATED_AT_PRECISION = 6
+ADDITIVE_METRIC = re.compile(r"^\s*(COUNT\(\s*\*\s*\)|SUM\(.+\))\s+AS\s+\w+\s*$", re.IGNORECASE)
+COUNT_METRIC = re.compile(r"^\s*COUNT\(\s*\*\s*\)\s+AS\s+\w+\s*$", re.IGNORECASE)
+
+# Rows fetched per round trip while streaming a shared aggregate scan,
+# and rows per multi-row INSERT when writing them to the datamart
+SCAN_BATCH_SIZE = 5000
+INSERT_BATCH_SIZE = 5000
+
+# Warehouse and datamart on the same MySQL server: aggregate with INSERT ... SELECT on the server
+co_located = all(WAREHOUSE_DB_CONFIG[k] == DATAMART_DB_CONFIG[k] for k in ('host', 'port', 'user'))
+
+# Result of a server-side scan: the datamart table holding it and each aggregate's metric columns
+ServerScan = namedtuple('ServerScan', ['table', 'metric_index'])
+
+# Cube aggregates (<dateGrain>) also group by the first day of each row's date bucket,
+# taken from the warehouse date_dim through job.date_id
+DATE_DIM_TABLE = "date_dim"
+DATE_BUCKET_COLUMN = "date_bucket"
+DATE_BUCKETS = {
+    'day': "d.full_date",
+    'week': "DATE_SUB(d.full_date, INTERVAL WEEKDAY(d.full_date) DAY)",
+    'month': "DATE_SUB(d.full_date, INTERVAL DAYOFMONTH(d.full_date) - 1 DAY)"
+}
+
+# Column types of the generated datamart tables are inferred from the warehouse source
+# columns (information_schema) unless declared with type="..." in the config
+TYPE_ALIASES = {'integer': 'int', 'bool': 'tinyint(1)', 'boolean': 'tinyint(1)'}
+TYPE_FAMILIES = {
+    'char': 'char', 'varchar': 'char', 'tinytext': 'text', 'text': 'text', 'mediumtext': 'text', 'longtext': 'text',
+    'tinyint': 'integer', 'smallint': 'integer', 'mediumint': 'integer', 'int': 'integer', 'bigint': 'integer',
+    'decimal': 'numeric', 'float': 'numeric', 'double': 'numeric',
+    'date': 'temporal', 'datetime': 'temporal', 'timestamp': 'temporal', 'time': 'temporal', 'year': 'temporal'
+}
+INTEGER_WIDTHS = ['tinyint', 'smallint', 'mediumint', 'int', 'bigint']
+# Integer display widths (bigint(20), int(11)) are reported by MariaDB and MySQL < 8.0.19 only;
+# they do not change the type, so they are dropped except for the boolean tinyint(1)
+DISPLAY_WIDTH = re.compile(r"\b(?!tinyint\(1\))(tinyint|smallint|mediumint|int|bigint)\(\d+\)")
+METRIC_FUNCTION = re.compile(r"^\s*(\w+)\(\s*(?:DISTINCT\s+)?(\*|\w+)\s*\)\s*$", re.IGNORECASE)
+
+# Full rebuilds go into <name>__next and are swapped in; the replaced table is kept as <name>__prev
+SHADOW_SUFFIX = "__next"
+PREVIOUS_SUFFIX = "__prev"
+
 def log_config(cursor, config_file, status):
     cursor.execute(
         """
@@ -74,103 +148,768 @@ def log_config(cursor, config_file, status):
         (config_file, status, datetime.now())
     )
 
-def log_table(cursor, table_name, status):
-    cursor.execute(
+def log_tables(cursor, entries):
+    # entries: list of (table_name, status, created_at), written in one round trip
+    if not entries:
+        return
+    cursor.executemany(
         """
         INSERT INTO load_to_dm_log (table_name, status, created_at)
         VALUES (%s, %s, %s)
         """,
-        (table_name, status, datetime.now())
+        entries
     )
 
-# 4. Connect to control DB
-control_conn = mysql.connector.connect(**CONTROL_DB_CONFIG)
-control_cursor = control_conn.cursor()
+def ensure_watermark_table(cursor):
+    # Kept in the datamart so deltas and watermark commit in one transaction
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS load_to_dm_watermark (
+            table_name VARCHAR(100) PRIMARY KEY,
+            last_job_sk BIGINT NOT NULL,
+            last_updated_at DATETIME(6) NOT NULL,
+            last_full_rebuild DATETIME NOT NULL
+        )
+        """
+    )
+    # Watermark tables created before updated_at had microseconds store whole seconds
+    cursor.execute(
+        """
+        SELECT DATETIME_PRECISION FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'load_to_dm_watermark' AND COLUMN_NAME = 'last_updated_at'
+        """
+    )
+    if cursor.fetchone()[0] != UPDATED_AT_PRECISION:
+        cursor.execute(
+            f"ALTER TABLE load_to_dm_watermark MODIFY last_updated_at DATETIME({UPDATED_AT_PRECISION}) NOT NULL"
+        )
+
+def load_watermarks(cursor):
+    cursor.execute("SELECT table_name, last_job_sk, last_updated_at, last_full_rebuild FROM load_to_dm_watermark")
+    return {r[0]: tuple(r[1:]) for r in cursor.fetchall()}
+
+def save_watermark(cursor, table_name, job_sk, updated_at, full_rebuild):
+    if full_rebuild:
+        cursor.execute(
+            """
+            INSERT INTO load_to_dm_watermark (table_name, last_job_sk, last_updated_at, last_full_rebuild)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                last_job_sk = VALUES(last_job_sk),
+                last_updated_at = VALUES(last_updated_at),
+                last_full_rebuild = VALUES(last_full_rebuild)
+            """,
+            (table_name, job_sk, updated_at)
+        )
+    else:
+        cursor.execute(
+            "UPDATE load_to_dm_watermark SET last_job_sk = %s, last_updated_at = %s WHERE table_name = %s",
+            (job_sk, updated_at, table_name)
+        )
+
+def reset_watermark(cursor, table_name):
+    # Without a watermark the next run rebuilds the table instead of applying deltas to it
+    cursor.execute("DELETE FROM load_to_dm_watermark WHERE table_name = %s", (table_name,))
+
+def parse_table(table):
+    metric_nodes = table.find('metrics').findall('metric')
+    metrics = [m.text for m in metric_nodes]
+    # Optional filter, e.g. expired = '9999-12-31' to prune to the current partition
+    filter_node = table.find('filter')
+    # Optional date grain (day | week | month) turning the aggregate into a date-bucketed cube
+    date_grain = table.findtext('dateGrain')
+    if date_grain is not None and date_grain.lower() not in DATE_BUCKETS:
+        raise ValueError(f"Unknown dateGrain '{date_grain}' for table {table.find('name').text}")
+    # Optional secondary indexes, one comma-separated column list per <index>
+    index_nodes = table.findall('indexes/index')
+    return {
+        'name': table.find('name').text,
+        'source': table.find('source').text,
+        'group_by': table.find('groupBy').text,
+        'group_type': table.find('groupBy').get('type'),
+        'metrics': metrics,
+        'metric_types': [m.get('type') for m in metric_nodes],
+        'index_columns': [[c.strip() for c in i.text.split(',')] for i in index_nodes] if index_nodes else None,
+        'metric_exprs': [m.split(" AS ")[0] for m in metrics],
+        'metric_names': [m.split(" AS ")[-1] for m in metrics],
+        'filter': filter_node.text if filter_node is not None else None,
+        'date_grain': date_grain.lower() if date_grain is not None else None
+    }
 
-try:
-    # 5. Log Start status into control DB
-    log_config(control_cursor, CONFIG_FILE, "Start")
-    control_conn.commit()
-    logging.info("Config load logged to DB")
+def normalize_type(column_type):
+    column_type = re.sub(r"\s*([(),])\s*", r"\1", " ".join(column_type.lower().split()))
+    column_type = DISPLAY_WIDTH.sub(r"\1", column_type)
+    return TYPE_ALIASES.get(column_type, column_type)
 
-    # 6. Connect to warehouse and datamart DB
-    warehouse_conn = mysql.connector.connect(**WAREHOUSE_DB_CONFIG)
-    warehouse_cursor = warehouse_conn.cursor(dictionary=True)
+def base_type(column_type):
+    return re.match(r"[a-z]+", column_type).group(0)
 
-    datamart_conn = mysql.connector.connect(**DATAMART_DB_CONFIG)
-    datamart_cursor = datamart_conn.cursor()
+def type_family(column_type):
+    return TYPE_FAMILIES.get(base_type(column_type), base_type(column_type))
 
-    # 7. For each table in config
-    for table in tables:
-        table_name = table.find('name').text
-        source = table.find('source').text
-        group_by = table.find('groupBy').text
-        metrics = [m.text for m in table.find('metrics').findall('metric')]
-        metrics_sql = ", ".join(metrics)
+def char_length(column_type):
+    match = re.search(r"\((\d+)\)", column_type)
+    return int(match.group(1)) if match else None
 
-        # 8. Log Start status into log table in control DB
-        logging.info("Start processing table: %s", table_name)
-        log_table(control_cursor, table_name, "Start")
-        control_conn.commit()
+def load_source_columns(cursor, source):
+    cursor.execute(
+        """
+        SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, NUMERIC_SCALE
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """,
+        (source,)
+    )
+    return {
+        name: {'type': normalize_type(column_type), 'nullable': nullable == 'YES', 'scale': scale}
+        for name, column_type, nullable, scale in cursor.fetchall()
+    }
 
-        try:
-            # 9. Query data from warehouse
-            query_sql = f"""
-                SELECT {group_by}, {metrics_sql}
-                FROM {source}
-                GROUP BY {group_by}
-            """
-            warehouse_cursor.execute(query_sql)
-            rows = warehouse_cursor.fetchall()
+def group_column_type(spec, columns):
+    name = spec['group_by']
+    if name not in columns:
+        raise ValueError(f"group column {name} not found in warehouse table {spec['source']}")
+    source = columns[name]
+    family = type_family(source['type'])
+
+    # NULL groups are stored as '' in the primary key, which only a character column can hold
+    if family not in ('char', 'text') and source['nullable']:
+        raise ValueError(f"group column {name} is a nullable {source['type']}")
+
+    if spec['group_type'] is None:
+        if family == 'text':
+            raise ValueError(f"group column {name} is {source['type']}, declare a VARCHAR type for the key")
+        return source['type']
+
+    declared = normalize_type(spec['group_type'])
+    if family in ('char', 'text'):
+        if type_family(declared) != 'char':
+            raise ValueError(f"group column {name} is {source['type']}, declared {declared}")
+        if family == 'char' and char_length(declared) < char_length(source['type']):
+            raise ValueError(f"declared {declared} would truncate group column {name} ({source['type']})")
+    elif type_family(declared) != family:
+        raise ValueError(f"group column {name} is {source['type']}, declared {declared}")
+    elif family == 'integer' and (INTEGER_WIDTHS.index(base_type(declared))
+                                  < INTEGER_WIDTHS.index(base_type(source['type']))):
+        raise ValueError(f"declared {declared} is narrower than group column {name} ({source['type']})")
+    return declared
+
+def metric_column_type(spec, i, columns):
+    name, declared = spec['metric_names'][i], spec['metric_types'][i]
+    match = METRIC_FUNCTION.match(spec['metric_exprs'][i])
+    func, arg = (match.group(1).upper(), match.group(2)) if match else (None, None)
+    if arg not in (None, '*') and arg not in columns:
+        raise ValueError(f"metric {name} uses column {arg} not found in warehouse table {spec['source']}")
+    source = columns.get(arg)
+
+    if func in ('SUM', 'AVG') and source and type_family(source['type']) not in ('integer', 'numeric'):
+        raise ValueError(f"metric {name} applies {func} to {arg} ({source['type']})")
+    if func == 'COUNT':
+        inferred = 'bigint'
+    elif func == 'SUM' and source:
+        family = type_family(source['type'])
+        if family == 'integer':
+            inferred = 'bigint'
+        elif base_type(source['type']) == 'decimal':
+            inferred = f"decimal(65,{source['scale']})"
+        else:
+            inferred = 'double'
+    elif func == 'AVG':
+        inferred = 'double'
+    elif func in ('MIN', 'MAX') and source:
+        inferred = source['type']
+    else:
+        inferred = None
+
+    if declared is None:
+        if inferred is None:
+            raise ValueError(f"cannot infer the type of metric {name}, declare it with type=\"...\"")
+        return inferred
+
+    declared = normalize_type(declared)
+    # A declared type may widen an integer metric to a decimal one, but must not change its kind
+    if inferred is not None and type_family(declared) != type_family(inferred) and not (
+            type_family(inferred) == 'integer' and type_family(declared) == 'numeric'):
+        raise ValueError(f"metric {name} is {inferred}, declared {declared}")
+    return declared
+
+def build_schema(spec, columns):
+    """Derive the typed columns and secondary indexes of an aggregate table.
+
+    Types come from the warehouse source columns unless declared in the config,
+    and declared types are checked against them. Sets spec['columns'] as
+    (name, type) pairs in table order, spec['indexes'] as {name: columns} and
+    spec['nullable_group'] when NULL groups must be folded into ''.
+    """
+    if not columns:
+        raise ValueError(f"warehouse table {spec['source']} not found")
+    spec['columns'] = (
+        ([(DATE_BUCKET_COLUMN, 'date')] if spec['date_grain'] else [])
+        + [(spec['group_by'], group_column_type(spec, columns))]
+        + [(name, metric_column_type(spec, i, columns)) for i, name in enumerate(spec['metric_names'])]
+    )
+    spec['nullable_group'] = columns[spec['group_by']]['nullable']
+
+    # By default index every metric for top-N; cubes index the dimension for lookups over time instead
+    index_columns = spec['index_columns']
+    if index_columns is None:
+        if spec['date_grain']:
+            index_columns = [[spec['group_by'], DATE_BUCKET_COLUMN]]
+        else:
+            index_columns = [[name] for name in spec['metric_names']]
+    table_columns = {name for name, _ in spec['columns']}
+    for cols in index_columns:
+        unknown = [c for c in cols if c not in table_columns]
+        if unknown:
+            raise ValueError(f"index on unknown column(s) {', '.join(unknown)}")
+    spec['indexes'] = {("idx_" + "_".join(cols))[:64]: cols for cols in index_columns}
+
+def schema_matches(cursor, spec):
+    cursor.execute(
+        """
+        SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY ORDINAL_POSITION
+        """,
+        (spec['name'],)
+    )
+    live_columns = [(name, normalize_type(column_type)) for name, column_type in cursor.fetchall()]
+    cursor.execute(
+        """
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY'
+        """,
+        (spec['name'],)
+    )
+    live_indexes = {r[0] for r in cursor.fetchall()}
+    return live_columns == spec['columns'] and live_indexes == set(spec['indexes'])
 
-            # 10. Drop and recreate datamart table
-            datamart_cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+def where_clause(spec):
+    return f"WHERE {spec['filter']}" if spec['filter'] else ""
 
-            metric_columns = "\n".join(
-                [f"    {m.split(' AS ')[-1]} INT," for m in metrics]
-            ).rstrip(',')
+def is_additive(spec):
+    return all(ADDITIVE_METRIC.match(m) for m in spec['metrics'])
 
-            create_sql = f"""
-                CREATE TABLE {table_name} (
-                    {group_by} VARCHAR(255),
-                    {metric_columns}
-                )
-            """
-            datamart_cursor.execute(create_sql)
+def is_current_filter(spec):
+    return " ".join((spec['filter'] or "").split()) == CURRENT_ROW_FILTER
 
-            # 11. Insert data into datamart
-            metric_names = [m.split(" AS ")[-1] for m in metrics]
-            insert_cols = ", ".join([group_by] + metric_names)
-            placeholder = ", ".join(["%s"] * (1 + len(metric_names)))
+def has_precise_updated_at(columns):
+    return columns.get('updated_at', {}).get('type') in (
+        f"timestamp({UPDATED_AT_PRECISION})", f"datetime({UPDATED_AT_PRECISION})")
 
-            insert_sql = f"""
-                INSERT INTO {table_name} ({insert_cols})
-                VALUES ({placeholder})
-            """
+def supports_increment(spec):
+    return is_current_filter(spec) and is_additive(spec)
+
+def use_increment(spec, watermark):
+    return (
+        incremental_mode and not args.full_rebuild and watermark is not None
+        and supports_increment(spec)
+        and datetime.now() - watermark[2] < timedelta(days=full_rebuild_days)
+    )
+
+def group_key(value):
+    # Group column is the primary key, so NULL groups are stored as ''
+    return '' if value is None else value
+
+def key_columns(spec):
+    # Primary key of the aggregate table: (date bucket, group) for cubes, the group otherwise
+    return ([DATE_BUCKET_COLUMN] if spec['date_grain'] else []) + [spec['group_by']]
+
+def row_key(spec, row):
+    value = group_key(row[spec['group_by']])
+    return (row[DATE_BUCKET_COLUMN], value) if spec['date_grain'] else value
+
+def scan_columns(specs):
+    group_cols = list(dict.fromkeys(s['group_by'] for s in specs))
+    exprs = list(dict.fromkeys(e for s in specs for e in s['metric_exprs']))
+    metric_index = {s['name']: [exprs.index(e) for e in s['metric_exprs']] for s in specs}
+    return group_cols, exprs, metric_index
+
+def scan_query(source, specs, group_cols, exprs, parts, schema=None):
+    qualify = (lambda t: f"{schema}.{t}") if schema else (lambda t: t)
+    date_grain = specs[0]['date_grain']
+    from_sql = qualify(source)
+    # NULL and '' are one group in the datamart; fold them in the scan itself, since
+    # non-additive metrics (COUNT(DISTINCT ...)) cannot be summed across the two
+    nullable = {s['group_by'] for s in specs if s['nullable_group']}
+    group_by_cols = [f"IFNULL({c}, '')" if c in nullable else c for c in group_cols]
+    select_cols = [f"IFNULL({c}, '') AS {c}" if c in nullable else c for c in group_cols]
+    if date_grain:
+        # Jobs without a dated date_dim row cannot be bucketed and are left out of cubes
+        from_sql = (f"{from_sql} j JOIN {qualify(DATE_DIM_TABLE)} d"
+                    f" ON d.date_sk = j.date_id AND d.full_date IS NOT NULL")
+        select_cols.append(f"{DATE_BUCKETS[date_grain]} AS {DATE_BUCKET_COLUMN}")
+        group_by_cols.append(DATE_BUCKET_COLUMN)
+    select_sql = ", ".join(select_cols + [f"{e} AS m{i}" for i, e in enumerate(exprs)])
+    group_sql = ", ".join(group_by_cols)
+    query_sql = " UNION ALL ".join(
+        f"SELECT {select_sql}, {sign} AS delta_sign FROM {from_sql} {where_sql} GROUP BY {group_sql}"
+        for where_sql, _, sign in parts
+    )
+    params = tuple(p for _, part_params, _ in parts for p in part_params)
+    return query_sql, params
+
+def scan_aggregates(cursor, source, specs, parts):
+    """Compute several aggregates over one source in a single pass.
+
+    The source is grouped once by the union of all group columns; every part in
+    `parts` is a (where_sql, params, sign) slice of that scan. The fine-grained rows
+    are streamed and rolled up in memory into one {group: [metrics]} dict per table
+    (keyed by (date bucket, group) for cubes).
+    """
+    group_cols, exprs, metric_index = scan_columns(specs)
+    query_sql, params = scan_query(source, specs, group_cols, exprs, parts)
+    cursor.execute(query_sql, params)
+
+    results = {s['name']: {} for s in specs}
+    while True:
+        rows = cursor.fetchmany(SCAN_BATCH_SIZE)
+        if not rows:
+            break
+        for r in rows:
+            sign = r['delta_sign']
+            for s in specs:
+                acc = results[s['name']].setdefault(row_key(s, r), [0] * len(s['metric_names']))
+                for i, idx in enumerate(metric_index[s['name']]):
+                    acc[i] += sign * (r[f"m{idx}"] or 0)
+    return results
+
+def materialize_scan(cursor, source, specs, parts, scan_name):
+    """Server-side variant of scan_aggregates for co-located warehouse and datamart.
+
+    The fine-grained scan is written straight into a datamart table with one
+    CREATE TABLE ... SELECT; each aggregate is later filled from it by load_rows.
+    """
+    group_cols, exprs, metric_index = scan_columns(specs)
+    query_sql, params = scan_query(source, specs, group_cols, exprs, parts,
+                                   schema=WAREHOUSE_DB_CONFIG['database'])
+    scan_table = f"{DATAMART_DB_CONFIG['database']}.{scan_name}"
+    cursor.execute(f"DROP TABLE IF EXISTS {scan_table}")
+    cursor.execute(f"CREATE TABLE {scan_table} AS {query_sql}", params)
+    scan = ServerScan(scan_table, metric_index)
+    return {s['name']: scan for s in specs}
+
+def load_rows(cursor, target, spec, data):
+    # Rows are added onto existing groups: deltas for incremental runs, and for rebuilds
+    # groups rolled up case-sensitively that collide under the key collation
+    group_by = spec['group_by']
+    metric_names = spec['metric_names']
+    insert_cols = ", ".join(key_columns(spec) + metric_names)
+    update_sql = ", ".join([f"{name} = {name} + VALUES({name})" for name in metric_names])
+
+    if isinstance(data, ServerScan):
+        # Derived columns get their own aliases so the UPDATE clause only sees target columns
+        metric_sql = ", ".join(
+            f"SUM(delta_sign * m{idx}) AS v{i}"
+            for i, idx in enumerate(data.metric_index[spec['name']])
+        )
+        key_exprs = ([DATE_BUCKET_COLUMN] if spec['date_grain'] else []) + [f"IFNULL({group_by}, '')"]
+        key_sql = ", ".join(f"{e} AS k{i}" for i, e in enumerate(key_exprs))
+        cursor.execute(f"""
+            INSERT INTO {target} ({insert_cols})
+            SELECT * FROM (
+                SELECT {key_sql}, {metric_sql}
+                FROM {data.table}
+                GROUP BY {", ".join(key_exprs)}
+            ) AS agg
+            ON DUPLICATE KEY UPDATE {update_sql}
+        """)
+        return cursor.rowcount
+
+    placeholder = ", ".join(["%s"] * (len(key_columns(spec)) + len(metric_names)))
+    insert_sql = f"""
+        INSERT INTO {target} ({insert_cols})
+        VALUES ({placeholder})
+        ON DUPLICATE KEY UPDATE {update_sql}
+    """
+    rows = [(k if isinstance(k, tuple) else (k,)) + tuple(v) for k, v in data.items()]
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        cursor.executemany(insert_sql, rows[i:i + INSERT_BATCH_SIZE])
+    return len(rows)
+
+def count_drift(cursor, spec, live_name, rebuilt_name):
+    group_by = spec['group_by']
+    join_sql = " AND ".join(f"a.{c} = b.{c}" for c in key_columns(spec))
+    differs = " OR ".join(f"NOT (a.{n} <=> b.{n})" for n in spec['metric_names'])
+    cursor.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM {live_name} a LEFT JOIN {rebuilt_name} b ON {join_sql}
+             WHERE b.{group_by} IS NULL OR {differs})
+          + (SELECT COUNT(*) FROM {rebuilt_name} a LEFT JOIN {live_name} b ON {join_sql}
+             WHERE b.{group_by} IS NULL)
+    """)
+    return cursor.fetchone()[0]
+
+def table_exists(cursor, table_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,)
+    )
+    return cursor.fetchone() is not None
 
-            insert_data = []
-            for r in rows:
-                row_values = [r[group_by]] + [r[name] for name in metric_names]
-                insert_data.append(tuple(row_values))
+def rollback_table(conn, cursor, table_name):
+    previous_name = f"{table_name}{PREVIOUS_SUFFIX}"
+    if not table_exists(cursor, previous_name):
+        raise RuntimeError(f"No previous version of {table_name} to roll back to")
 
-            datamart_cursor.executemany(insert_sql, insert_data)
-            datamart_conn.commit()
+    # The restored version will not match the watermark: drop it first, in its own commit,
+    # so the next run fully rebuilds the table even if the swap below is the last thing done
+    reset_watermark(cursor, table_name)
+    conn.commit()
 
-            # 12. Log Success status
-            log_table(control_cursor, table_name, "Success")
-            control_conn.commit()
-            logging.info("Success table %s (%d rows)", table_name, len(rows))
+    # Swap live and previous versions atomically, so a second rollback undoes the first
+    swap_name = f"{table_name}__swap"
+    cursor.execute(
+        f"RENAME TABLE {table_name} TO {swap_name}, {previous_name} TO {table_name}, {swap_name} TO {previous_name}"
+    )
 
+def replace_table(datamart_conn, datamart_cursor, spec, data, pending):
+    table_name = spec['name']
+
+    # 10. Build the new version in a shadow table; the live table stays readable meanwhile
+    shadow_name = f"{table_name}{SHADOW_SUFFIX}"
+    datamart_cursor.execute(f"DROP TABLE IF EXISTS {shadow_name}")
+
+    # Typed columns from build_schema; cubes lead with the date bucket so a date range
+    # is one contiguous primary key range
+    keys = key_columns(spec)
+    column_defs = [
+        f"{name} {column_type}" + (" NOT NULL" if name in keys else "")
+        for name, column_type in spec['columns']
+    ]
+    index_defs = [f"KEY {name} ({', '.join(cols)})" for name, cols in spec['indexes'].items()]
+    definitions = ",\n            ".join(column_defs + [f"PRIMARY KEY ({', '.join(keys)})"] + index_defs)
+
+    create_sql = f"""
+        CREATE TABLE {shadow_name} (
+            {definitions}
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+    """
+    datamart_cursor.execute(create_sql)
+
+    # 11. Insert data into datamart
+    changed = load_rows(datamart_cursor, shadow_name, spec, data)
+
+    # Periodic rebuild doubles as verification of the incrementally maintained table. The live
+    # table is still at its watermark: apply the deltas up to the snapshot first (committed with
+    # the watermark reset below), so loads since the last run are not reported as drift
+    if pending is not None and table_exists(datamart_cursor, table_name):
+        upsert_deltas(datamart_cursor, spec, pending)
+        drift = count_drift(datamart_cursor, spec, table_name, shadow_name)
+        if drift:
+            logging.warning("Table %s drifted from warehouse in %d groups, rebuilt", table_name, drift)
+
+    # RENAME commits on its own, before save_watermark runs: drop the old watermark first,
+    # in its own commit, so a crash after the swap forces a rebuild rather than deltas
+    # applied from the replaced version's watermark
+    reset_watermark(datamart_cursor, table_name)
+    datamart_conn.commit()
+
+    # Swap it in with one atomic RENAME, keeping the replaced version for rollback
+    previous_name = f"{table_name}{PREVIOUS_SUFFIX}"
+    datamart_cursor.execute(f"DROP TABLE IF EXISTS {previous_name}")
+    if table_exists(datamart_cursor, table_name):
+        datamart_cursor.execute(
+            f"RENAME TABLE {table_name} TO {previous_name}, {shadow_name} TO {table_name}"
+        )
+    else:
+        datamart_cursor.execute(f"RENAME TABLE {shadow_name} TO {table_name}")
+    return changed
+
+def upsert_deltas(datamart_cursor, spec, deltas):
+    table_name = spec['name']
+
+    # 11. Upsert deltas into the existing aggregate
+    changed = load_rows(datamart_cursor, table_name, spec, deltas)
+
+    # Groups whose row count dropped to zero no longer exist in the warehouse
+    count_columns = [m.split(" AS ")[-1] for m in spec['metrics'] if COUNT_METRIC.match(m)]
+    if count_columns:
+        datamart_cursor.execute(
+            f"DELETE FROM {table_name} WHERE " + " OR ".join(f"{c} <= 0" for c in count_columns)
+        )
+    return changed
+
+def current_as_of(job_sk_sql, params, snapshot, additive):
+    """Scan parts selecting the rows in `job_sk_sql` that were current at the snapshot.
+
+    Server-side scans are CREATE TABLE ... SELECT, which commits implicitly and reads the
+    live table rather than the snapshot. Rows expired after the snapshot are therefore
+    added back from the history partitions, so rebuilds and deltas both stay as of the
+    snapshot that the watermark records. Additive metrics take them as a second part
+    (the current part still prunes to p_current); the parts are summed, so any other
+    metric reads both in one part.
+    """
+    if not co_located:
+        return [(f"WHERE {job_sk_sql} AND {CURRENT_ROW_FILTER}", params, 1)]
+    expired_after = f"updated_at > %s AND NOT ({CURRENT_ROW_FILTER})"
+    if not additive:
+        return [(f"WHERE {job_sk_sql} AND ({CURRENT_ROW_FILTER} OR ({expired_after}))",
+                 params + (snapshot['snapshot_at'],), 1)]
+    return [
+        (f"WHERE {job_sk_sql} AND {CURRENT_ROW_FILTER}", params, 1),
+        (f"WHERE {job_sk_sql} AND {expired_after}", params + (snapshot['snapshot_at'],), 1)
+    ]
+
+def compute_batch(warehouse_cursor, batch, incremental, verified, watermarks, snapshot, scan_prefix):
+    source = batch[0]['source']
+    scans = []
+
+    # 9. Query data from warehouse: one scan for every table rebuilt from scratch
+    rebuild = [s for s in batch if s not in incremental]
+    if rebuild:
+        if is_current_filter(rebuild[0]):
+            # A batch is either all additive or a single non-additive table
+            scans.append((rebuild, current_as_of("job_sk <= %s", (snapshot['max_job_sk'],), snapshot,
+                                                 additive=is_additive(rebuild[0])), False))
+        else:
+            filter_sql = f"({rebuild[0]['filter']}) AND " if rebuild[0]['filter'] else ""
+            scans.append((rebuild, [(f"WHERE {filter_sql}job_sk <= %s", (snapshot['max_job_sk'],), 1)], False))
+
+    # 9. Query deltas: newly inserted current rows count +1, rows expired since the watermark count -1.
+    # Expiries are windowed by (watermark, snapshot], both taken from committed updated_at values.
+    # Tables sharing a watermark share one delta scan; verified rebuilds get theirs as pending deltas.
+    by_watermark = {}
+    for s in incremental + verified:
+        by_watermark.setdefault((tuple(watermarks[s['name']][:2]), s in verified), []).append(s)
+    for ((last_job_sk, last_updated_at), is_pending), specs in by_watermark.items():
+        scans.append((specs, current_as_of("job_sk > %s AND job_sk <= %s",
+                                           (last_job_sk, snapshot['max_job_sk']), snapshot, additive=True) + [
+            (f"WHERE job_sk <= %s AND updated_at > %s AND updated_at <= %s AND NOT ({CURRENT_ROW_FILTER})",
+             (last_job_sk, last_updated_at, snapshot['snapshot_at']), -1)
+        ], is_pending))
+
+    # The job_sk and updated_at bounds above (not the snapshot) keep server-side scans
+    # consistent with the watermark
+    results, pending = {}, {}
+    for i, (specs, parts, is_pending) in enumerate(scans):
+        if co_located:
+            scanned = materialize_scan(warehouse_cursor, source, specs, parts, f"{scan_prefix}_{i}")
+        else:
+            scanned = scan_aggregates(warehouse_cursor, source, specs, parts)
+        (pending if is_pending else results).update(scanned)
+    return results, pending
+
+def scan_batch(batch, watermarks, scan_prefix):
+    # Each worker borrows its own warehouse connection from the bounded pool
+    conn = warehouse_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        incremental = [s for s in batch if use_increment(s, watermarks.get(s['name']))]
+        # Rebuilds of incrementally maintainable tables are compared with the live table
+        verified = [s for s in batch
+                    if s not in incremental and s['name'] in watermarks and supports_increment(s)]
+
+        # Read aggregates and watermark from one consistent warehouse snapshot. Its updated_at bound
+        # is the latest committed stamp, not NOW(): updated_at is set when a merge statement starts,
+        # so a merge still running at NOW() could commit rows stamped before it
+        with metrics.span('scan'):
+            conn.start_transaction(consistent_snapshot=True, readonly=not co_located)
+            cursor.execute(
+                f"SELECT COALESCE(MAX(job_sk), 0) AS max_job_sk,"
+                f" COALESCE(MAX(updated_at), NOW({UPDATED_AT_PRECISION})) AS snapshot_at"
+                f" FROM {batch[0]['source']}"
+            )
+            snapshot = cursor.fetchall()[0]
+            results, pending = compute_batch(cursor, batch, incremental, verified, watermarks, snapshot,
+                                             scan_prefix)
+            conn.commit()
+        return snapshot, results, pending, incremental
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def write_table(spec, data, incremental, pending, snapshot):
+    # Each table is written on its own datamart connection so a failure stays isolated
+    conn = datamart_pool.get_connection()
+    cursor = conn.cursor(buffered=True)
+    try:
+        with metrics.span('aggregate_build') as span:
+            if incremental:
+                changed = upsert_deltas(cursor, spec, data)
+            else:
+                changed = replace_table(conn, cursor, spec, data, pending)
+
+            save_watermark(cursor, spec['name'], snapshot['max_job_sk'], snapshot['snapshot_at'],
+                           full_rebuild=not incremental)
+            conn.commit()
+            span.rows = changed
+        return changed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def drop_scan_tables(results):
+    scan_tables = {data.table for data in results.values() if isinstance(data, ServerScan)}
+    if not scan_tables:
+        return
+    conn = datamart_pool.get_connection()
+    cursor = conn.cursor()
+    try:
+        for scan_table in scan_tables:
+            cursor.execute(f"DROP TABLE IF EXISTS {scan_table}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# 3. Rollback mode: swap previous versions back in and exit
+if args.rollback is not None:
+    rollback_names = args.rollback or [t.find('name').text for t in tables]
+    rollback_conn = mysql.connector.connect(**DATAMART_DB_CONFIG)
+    rollback_cursor = rollback_conn.cursor(buffered=True)
+    # A datamart that was never loaded incrementally has no watermark table yet
+    ensure_watermark_table(rollback_cursor)
+    failed = False
+    for name in rollback_names:
+        try:
+            rollback_table(rollback_conn, rollback_cursor, name)
+            rollback_conn.commit()
+            logging.info("Rolled back table %s", name)
         except Exception as e:
-            # 12.1. Log Fail status
-            logging.error("Fail table %s: %s", table_name, str(e))
-            log_table(control_cursor, table_name, "Fail")
-            control_conn.commit()
+            failed = True
+            logging.error("Fail rollback table %s: %s", name, str(e))
+    rollback_cursor.close()
+    rollback_conn.close()
+    logging.info("=== END LOAD TO DATAMART JOB ===")
+    sys.exit(1 if failed else 0)
+
+# 4. Connect to control DB
+control_conn = mysql.connector.connect(**CONTROL_DB_CONFIG)
+control_cursor = control_conn.cursor()
+# Timing spans of this run (scan, aggregate_build per table), flushed to db_control at the end
+metrics = Metrics('datamart', CONFIG_FILE)
+run_status = 'Failed'
+
+try:
+    # 5. Log Start status into control DB
+    log_config(control_cursor, CONFIG_FILE, "Start")
+    control_conn.commit()
+    logging.info("Config load logged to DB")
+
+    # 6. Create bounded connection pools for warehouse and datamart DB (one connection per worker)
+    warehouse_pool = pooling.MySQLConnectionPool(pool_name="dm_warehouse", pool_size=datamart_workers,
+                                                 **WAREHOUSE_DB_CONFIG)
+    datamart_pool = pooling.MySQLConnectionPool(pool_name="dm_datamart", pool_size=datamart_workers,
+                                                **DATAMART_DB_CONFIG)
+
+    # 7. Log Start status for all tables into log table in control DB in one round trip
+    specs = [parse_table(table) for table in tables]
+    for spec in specs:
+        logging.info("Start processing table: %s", spec['name'])
+    log_tables(control_cursor, [(spec['name'], "Start", datetime.now()) for spec in specs])
+    control_conn.commit()
+
+    # 7.1. Derive typed columns and indexes from the warehouse source columns; an aggregate
+    # whose config does not fit its source fails on its own
+    end_logs = []
+    warehouse_conn = warehouse_pool.get_connection()
+    warehouse_cursor = warehouse_conn.cursor()
+    with metrics.span('schema'):
+        source_columns = {
+            source: load_source_columns(warehouse_cursor, source)
+            for source in dict.fromkeys(spec['source'] for spec in specs)
+        }
+    warehouse_cursor.close()
+    warehouse_conn.close()
+
+    valid_specs = []
+    for spec in specs:
+        try:
+            build_schema(spec, source_columns[spec['source']])
+            valid_specs.append(spec)
+        except ValueError as e:
+            logging.error("Fail table %s: invalid aggregate config: %s", spec['name'], str(e))
+            end_logs.append((spec['name'], "Fail", datetime.now()))
+
+    datamart_conn = datamart_pool.get_connection()
+    datamart_cursor = datamart_conn.cursor(buffered=True)
+    ensure_watermark_table(datamart_cursor)
+    watermarks = load_watermarks(datamart_cursor)
+    # A table whose live schema differs from the generated one is rebuilt before it takes deltas again
+    for spec in valid_specs:
+        if spec['name'] in watermarks and not schema_matches(datamart_cursor, spec):
+            logging.warning("Table %s schema changed, forcing full rebuild", spec['name'])
+            del watermarks[spec['name']]
+        elif spec['name'] in watermarks and not has_precise_updated_at(source_columns[spec['source']]):
+            logging.warning("Table %s: %s.updated_at has no microseconds (see create_warehouse_db.sql), "
+                            "forcing full rebuild", spec['name'], spec['source'])
+            del watermarks[spec['name']]
+    datamart_conn.commit()
+    datamart_cursor.close()
+    datamart_conn.close()
+
+    # 7.2. Group additive aggregates by source, filter and date grain so each group costs one warehouse scan
+    batches = {}
+    for spec in valid_specs:
+        key = (spec['source'], spec['filter'], spec['date_grain'])
+        if not is_additive(spec):
+            key += (spec['name'],)
+        batches.setdefault(key, []).append(spec)
+
+    # Scan table names carry the run id so overlapping runs never drop each other's scans
+    with ThreadPoolExecutor(max_workers=datamart_workers) as executor:
+        scans = {
+            executor.submit(scan_batch, batch, watermarks,
+                            f"{batch[0]['source']}__scan{i}_{metrics.run_id[:8]}"): batch
+            for i, batch in enumerate(batches.values())
+        }
+        scan_results = []
+        writes = {}
+
+        # Fan each finished scan out to per-table writes while other scans are still running
+        for future in as_completed(scans):
+            batch = scans[future]
+            try:
+                snapshot, results, pending, incremental = future.result()
+                scan_results.extend([results, pending])
+            except Exception as e:
+                # 12.1. Log Fail status for every table of the failed scan
+                logging.error("Fail scan for tables %s: %s", ", ".join(s['name'] for s in batch), str(e))
+                end_logs.extend((s['name'], "Fail", datetime.now()) for s in batch)
+                continue
+
+            for spec in batch:
+                future_write = executor.submit(
+                    write_table, spec, results[spec['name']], spec in incremental,
+                    pending.get(spec['name']), snapshot
+                )
+                writes[future_write] = (spec, spec in incremental)
+
+        for future in as_completed(writes):
+            spec, incremental = writes[future]
+            try:
+                changed = future.result()
+                metrics.rows += changed
+                # 12. Log Success status
+                end_logs.append((spec['name'], "Success", datetime.now()))
+                logging.info("Success table %s (%s, %d rows)", spec['name'],
+                             "incremental" if incremental else "full rebuild", changed)
+            except Exception as e:
+                # 12.1. Log Fail status
+                logging.error("Fail table %s: %s", spec['name'], str(e))
+                end_logs.append((spec['name'], "Fail", datetime.now()))
+
+    # Server-side scan tables are only needed until every write of their batch is done
+    for results in scan_results:
+        try:
+            drop_scan_tables(results)
+        except Exception as e:
+            logging.warning("Cannot drop scan tables: %s", str(e))
+
+    log_tables(control_cursor, end_logs)
+    control_conn.commit()
 
     # 13. Log Success status into config log
     log_config(control_cursor, CONFIG_FILE, "Success")
     control_conn.commit()
     logging.info("Config finished successfully")
+    run_status = 'Failed' if any(status == "Fail" for _, status, _ in end_logs) else 'Success'
 
 except Exception as e:
     # 13.1. Log Fail status into config log
@@ -180,17 +919,12 @@ except Exception as e:
     logging.error("Job FAILED: %s", str(e))
 
 finally:
-    # 14. Close all DB connections
-    try:
-        warehouse_cursor.close()
-        warehouse_conn.close()
-        datamart_cursor.close()
-        datamart_conn.close()
-    except:
-        pass
-
+    # 14. Flush run metrics, close control DB connection (pooled connections are returned by each worker)
+    metrics.close(run_status, control_conn)
     control_cursor.close()
     control_conn.close()
 
 # 15 End log
-logging.info("=== END LOAD TO DATAMART JOB ===")
\ No newline at end of file
+logging.info("=== END LOAD TO DATAMART JOB ===")
+# Exit code 1 if any table or the job failed, so the scheduler retries the run
+sys.exit(0 if run_status == 'Success' else 1)
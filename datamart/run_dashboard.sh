@@ -0,0 +1,11 @@
+#!/bin/bash
+# Chạy dashboard datamart ở chế độ production (gunicorn, nhiều worker)
+
+BASE_DIR="/opt/dw/staging/datamart"
+VENV="/opt/dw/staging/extract/venv/bin/activate"
+
+source $VENV
+mkdir -p "$BASE_DIR/logs"
+cd "$BASE_DIR" || exit 1
+
+exec gunicorn -c "$BASE_DIR/gunicorn.conf.py" wsgi:application
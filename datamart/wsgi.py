@@ -0,0 +1,3 @@
+# Entry point WSGI cho production: gunicorn -c gunicorn.conf.py wsgi:application
+# Không dùng preload_app, để mỗi worker import app sau khi fork và tự tạo pool kết nối, executor riêng.
+from app import app as application
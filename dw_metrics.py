@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Timing and throughput instrumentation shared by the pipeline stages.
+
+A stage creates one Metrics per run and wraps its steps in nested spans:
+
+    metrics = Metrics('staging_load', config_path, source_id='topcv_jobs', data_date=run_date)
+    with metrics.span('file_load') as span:
+        with metrics.span('insert'):
+            ...
+        span.rows = len(data)
+    metrics.close('Success', conn)
+
+Spans are aggregated in memory by path (calls, total and max time, rows), so a
+span inside a hot loop costs two perf_counter() calls and a dict update. close()
+writes every span of the run to db_control.pipeline_metrics in one executemany
+and, if <metrics><textfileDir> is set, rewrites the stage's Prometheus textfile.
+Metrics errors are printed and never fail the stage.
+"""
+
+import mysql.connector
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import sys
+import threading
+import time
+import uuid
+
+ROOT_SPAN = "run"
+
+
+class Span:
+    __slots__ = ("rows",)
+
+    def __init__(self, rows=0):
+        self.rows = rows
+
+
+class Metrics:
+    def __init__(self, stage, config_path, source_id=None, data_date=None):
+        root = ET.parse(config_path).getroot()
+        db = root.find('.//database/control')
+        self.db_config = {
+            'host': db.find('host').text, 'port': int(db.find('port').text),
+            'user': db.find('user').text, 'password': db.find('password').text,
+            'database': db.find('database').text
+        }
+        node = root.find('./metrics')
+        self.enabled = node is None or node.findtext('enabled', 'true').lower() == 'true'
+        self.textfile_dir = node.findtext('textfileDir') if node is not None else None
+
+        self.stage = stage
+        self.source_id = source_id
+        self.data_date = str(data_date) if data_date else None
+        self.run_id = uuid.uuid4().hex
+        self.rows = 0
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        # path -> [first start, calls, seconds, max seconds, rows, errors]
+        self._spans = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    @contextmanager
+    def span(self, name, rows=0):
+        """Time a step; nested spans (in the same thread) get the enclosing span's path as prefix.
+        Spans opened in worker threads hang under the run span"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = [ROOT_SPAN]
+        stack.append(name)
+        path = "/".join(stack)
+        span = Span(rows)
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield span
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            self._record(path, started, elapsed, span.rows, failed)
+
+    def _record(self, path, started, elapsed, rows, failed):
+        with self._lock:
+            entry = self._spans.get(path)
+            if entry is None:
+                self._spans[path] = [started, 1, elapsed, elapsed, rows, int(failed)]
+            else:
+                entry[1] += 1
+                entry[2] += elapsed
+                entry[3] = max(entry[3], elapsed)
+                entry[4] += rows
+                entry[5] += failed
+
+    def close(self, status='Success', conn=None):
+        """Record the run span and flush everything: one round trip to db_control, one textfile write.
+        conn: an open connection to reuse (a new one is opened and closed otherwise)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._record(ROOT_SPAN, self._started, time.perf_counter() - self._started, self.rows, status != 'Success')
+        if not self.enabled:
+            return
+        rows = self.rows_for_db(status)
+        try:
+            self.write_db(rows, conn)
+        except Exception as e:
+            print(f"Cannot write metrics: {e}", file=sys.stderr)
+        if self.textfile_dir:
+            try:
+                self.write_textfile(status)
+            except Exception as e:
+                print(f"Cannot write metrics textfile: {e}", file=sys.stderr)
+
+    def rows_for_db(self, status):
+        rows = []
+        for path, (started, calls, seconds, max_seconds, count, errors) in sorted(self._spans.items()):
+            parent = path.rsplit("/", 1)[0] if "/" in path else None
+            rows.append((
+                self.run_id, self.stage, self.source_id, self.data_date, path, parent, path.count("/"),
+                self.started_at + timedelta(seconds=started - self._started), calls,
+                round(seconds * 1000, 3), round(max_seconds * 1000, 3), count,
+                round(count / seconds, 1) if count and seconds else None,
+                status if path == ROOT_SPAN else ('Failed' if errors else 'Success')
+            ))
+        return rows
+
+    def write_db(self, rows, conn=None):
+        own = conn is None
+        if own:
+            conn = mysql.connector.connect(**self.db_config)
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(
+                f"""
+                INSERT INTO {self.db_config['database']}.pipeline_metrics
+                    (run_id, stage, source_id, data_date, span_path, parent_path, depth, started_at,
+                     calls, duration_ms, max_duration_ms, row_count, rows_per_sec, status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                rows
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+            if own:
+                conn.close()
+
+    def write_textfile(self, status):
+        labels = f'stage="{self.stage}"' + (f',source="{self.source_id}"' if self.source_id else "")
+        lines = [
+            "# HELP dw_last_run_timestamp_seconds End time of the stage's last run",
+            "# TYPE dw_last_run_timestamp_seconds gauge",
+            f"dw_last_run_timestamp_seconds{{{labels}}} {time.time():.3f}",
+            "# HELP dw_last_run_success 1 if the stage's last run succeeded",
+            "# TYPE dw_last_run_success gauge",
+            f"dw_last_run_success{{{labels}}} {int(status == 'Success')}",
+        ]
+        series = (
+            ("dw_span_duration_seconds", "Total time spent in the span during the last run", 2, "{:.6f}"),
+            ("dw_span_calls", "Times the span ran during the last run", 1, "{}"),
+            ("dw_span_rows", "Rows processed in the span during the last run", 4, "{}"),
+        )
+        for name, help_text, index, fmt in series:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f'{name}{{{labels},span="{path}"}} {fmt.format(entry[index])}'
+                      for path, entry in sorted(self._spans.items())]
+        lines += ["# HELP dw_span_rows_per_second Throughput of the span during the last run",
+                  "# TYPE dw_span_rows_per_second gauge"]
+        lines += [f'dw_span_rows_per_second{{{labels},span="{path}"}} {entry[4] / entry[2]:.1f}'
+                  for path, entry in sorted(self._spans.items()) if entry[4] and entry[2]]
+
+        # Written to a temp file and renamed so the collector never reads a partial file
+        name = f"dw_{self.stage}" + (f"_{self.source_id}" if self.source_id else "") + ".prom"
+        path = os.path.join(self.textfile_dir, name)
+        with open(path + ".tmp", 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
@@ -90,6 +90,57 @@ CREATE TABLE process_log (
     INDEX idx_execution_date (execution_date)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- =========================================================
+-- METRICS (all stages)
+-- =========================================================
+
+-- Table: pipeline_metrics (timing spans per stage run, written by dw_metrics.py and LoadToWH)
+-- One row per span path per run; a span that ran many times (e.g. per page) is aggregated in 'calls'
+CREATE TABLE pipeline_metrics (
+    metric_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    run_id VARCHAR(32) NOT NULL,
+    stage VARCHAR(50) NOT NULL,
+    source_id VARCHAR(50) NULL,
+    data_date DATE NULL,
+    span_path VARCHAR(255) NOT NULL,
+    parent_path VARCHAR(255) NULL,
+    depth TINYINT NOT NULL,
+    started_at DATETIME(3) NOT NULL,
+    calls INT NOT NULL DEFAULT 1,
+    duration_ms DECIMAL(14,3) NOT NULL,
+    max_duration_ms DECIMAL(14,3) NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    rows_per_sec DECIMAL(14,1) NULL,
+    status ENUM('Success', 'Failed') NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_run (run_id),
+    INDEX idx_stage_date (stage, data_date),
+    INDEX idx_span_started (span_path, started_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =========================================================
+-- SCHEDULER (scheduler/pipeline_scheduler.py)
+-- =========================================================
+
+-- Table: pipeline_task (one row per DAG task: stage + source + data date)
+-- source_id is '' for per-date stages (load_to_wh, datamart) so the unique key holds
+CREATE TABLE pipeline_task (
+    task_id INT AUTO_INCREMENT PRIMARY KEY,
+    stage VARCHAR(50) NOT NULL,
+    source_id VARCHAR(50) NOT NULL DEFAULT '',
+    data_date DATE NOT NULL,
+    status ENUM('Pending', 'Running', 'Success', 'Failed', 'Skipped') DEFAULT 'Pending',
+    attempts INT DEFAULT 0,
+    next_attempt_at TIMESTAMP NULL,
+    start_time TIMESTAMP NULL,
+    end_time TIMESTAMP NULL,
+    duration_seconds INT AS (TIMESTAMPDIFF(SECOND, start_time, end_time)) STORED,
+    error_message TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_task (stage, source_id, data_date),
+    INDEX idx_date_status (data_date, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- =========================================================
 -- VIEWS FOR MONITORING
 -- =========================================================
@@ -160,6 +211,22 @@ FROM extract_log el
 GROUP BY el.date
 ORDER BY el.date DESC;
 
+-- View: v_stage_throughput (daily time and throughput per stage and span)
+CREATE VIEW v_stage_throughput AS
+SELECT
+    DATE(started_at) AS run_date,
+    stage,
+    span_path,
+    COUNT(DISTINCT run_id) AS runs,
+    SUM(calls) AS calls,
+    ROUND(SUM(duration_ms) / 1000, 1) AS total_seconds,
+    MAX(max_duration_ms) AS max_duration_ms,
+    SUM(row_count) AS row_count,
+    ROUND(SUM(row_count) / NULLIF(SUM(duration_ms) / 1000, 0), 1) AS rows_per_sec
+FROM pipeline_metrics
+GROUP BY DATE(started_at), stage, span_path
+ORDER BY run_date DESC, stage, span_path;
+
 -- =========================================================
 -- SEED DATA (Initial Configuration)
 -- =========================================================
@@ -10,6 +10,7 @@ import pandas as pd
 from datetime import datetime
 import time
 import os
+import sys
 import hashlib
 import mysql.connector
 import logging
@@ -22,6 +23,7 @@ from selenium.webdriver.edge.options import Options as EdgeOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from dw_metrics import Metrics
 
 # ==============================================================================
 # HÀM HỖ TRỢ (HELPER FUNCTIONS)
@@ -58,7 +60,57 @@ def setup_driver(path, headless):
 # ==============================================================================
 # CORE LOGIC: TRÍCH XUẤT ĐA TRANG - [BƯỚC 6]
 # ==============================================================================
-def scrape_jobsgo_pagination(driver, logger, base_url, source_id, extract_date):
+# Thẻ job trên trang danh sách
+CARD_SELECTOR = '.job-card'
+
+def parse_cards(cards, source_id, extract_date):
+    """[BƯỚC 6.3] Bóc tách danh sách thẻ job (WebElement) của 1 trang thành các dòng dữ liệu"""
+    jobs = []
+    for card in cards:
+        try:
+            j_id = card.get_attribute("data-id")
+            try: j_title = card.find_element(By.CSS_SELECTOR, '.job-title').text.strip()
+            except: j_title = ""
+            try: j_comp = card.find_element(By.CSS_SELECTOR, '.company-title').text.strip()
+            except: j_comp = ""
+            
+            # Lương & Địa điểm (Chung div .text-primary)
+            j_sal = "Thỏa thuận"; j_loc = ""
+            try:
+                spans = card.find_element(By.CSS_SELECTOR, '.text-primary.d-flex').find_elements(By.TAG_NAME, 'span')
+                if len(spans) >= 1: j_sal = spans[0].text.strip()
+                if len(spans) >= 3: j_loc = spans[2].text.strip()
+            except: pass
+            
+            # Badges (Kinh nghiệm, Loại hình, Ngày đăng)
+            j_exp = "Không yêu cầu"; j_type = ""; j_posted = ""
+            try:
+                badges = card.find_elements(By.CSS_SELECTOR, '.badge')
+                for b in badges:
+                    t = b.get_attribute("title"); v = b.text.strip()
+                    if t == "Yêu cầu kinh nghiệm": j_exp = v
+                    elif t == "Loại hình": j_type = v
+                    elif t == "Thời gian cập nhật": j_posted = v
+            except: pass
+            
+            try: j_url = card.find_element(By.TAG_NAME, 'a').get_attribute("href")
+            except: j_url = ""
+            try: j_logo = card.find_element(By.CSS_SELECTOR, '.image-wrapper img').get_attribute("src")
+            except: j_logo = ""
+
+            if j_id and j_title:
+                jobs.append({
+                    'source_id': source_id, 'job_id': j_id, 'job_title': j_title, 
+                    'company_name': j_comp, 'salary': j_sal, 'location': j_loc, 
+                    'experience_required': j_exp, 'job_type': j_type, 
+                    'posted_time': j_posted, 'job_url': j_url, 'company_logo': j_logo,
+                    'extracted_date': extract_date, 
+                    'extracted_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+        except: continue
+    return jobs
+
+def scrape_jobsgo_pagination(driver, logger, base_url, source_id, extract_date, metrics):
     all_jobs = []
     current_page = 1
     MAX_PAGES = 50 # JobsGO IT có nhiều trang, set 50-100 tùy nhu cầu
@@ -73,16 +125,17 @@ def scrape_jobsgo_pagination(driver, logger, base_url, source_id, extract_date):
         logger.info(f"--- Đang quét Trang {current_page}/{MAX_PAGES} ---")
         
         try:
-            # 6.1: Truy cập URL
-            driver.get(page_url)
-            time.sleep(4) # Chờ load
+            with metrics.span('page_fetch'):
+                # 6.1: Truy cập URL
+                driver.get(page_url)
+                time.sleep(4) # Chờ load
             
-            # 6.2: Tìm thẻ Job Card (.job-card)
-            try:
-                WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.job-card')))
-                cards = driver.find_elements(By.CSS_SELECTOR, '.job-card')
-            except:
-                cards = []
+                # 6.2: Tìm thẻ Job Card (.job-card)
+                try:
+                    WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, CARD_SELECTOR)))
+                    cards = driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR)
+                except:
+                    cards = []
             
             if not cards:
                 logger.info(f"-> Trang {current_page} trống. Dừng quét.")
@@ -91,50 +144,11 @@ def scrape_jobsgo_pagination(driver, logger, base_url, source_id, extract_date):
             logger.info(f"-> Tìm thấy {len(cards)} tin trên trang {current_page}")
             
             # 6.3: Bóc tách dữ liệu (Parsing)
-            count_ok = 0
-            for card in cards:
-                try:
-                    j_id = card.get_attribute("data-id")
-                    try: j_title = card.find_element(By.CSS_SELECTOR, '.job-title').text.strip()
-                    except: j_title = ""
-                    try: j_comp = card.find_element(By.CSS_SELECTOR, '.company-title').text.strip()
-                    except: j_comp = ""
-                    
-                    # Lương & Địa điểm (Chung div .text-primary)
-                    j_sal = "Thỏa thuận"; j_loc = ""
-                    try:
-                        spans = card.find_element(By.CSS_SELECTOR, '.text-primary.d-flex').find_elements(By.TAG_NAME, 'span')
-                        if len(spans) >= 1: j_sal = spans[0].text.strip()
-                        if len(spans) >= 3: j_loc = spans[2].text.strip()
-                    except: pass
-                    
-                    # Badges (Kinh nghiệm, Loại hình, Ngày đăng)
-                    j_exp = "Không yêu cầu"; j_type = ""; j_posted = ""
-                    try:
-                        badges = card.find_elements(By.CSS_SELECTOR, '.badge')
-                        for b in badges:
-                            t = b.get_attribute("title"); v = b.text.strip()
-                            if t == "Yêu cầu kinh nghiệm": j_exp = v
-                            elif t == "Loại hình": j_type = v
-                            elif t == "Thời gian cập nhật": j_posted = v
-                    except: pass
-                    
-                    try: j_url = card.find_element(By.TAG_NAME, 'a').get_attribute("href")
-                    except: j_url = ""
-                    try: j_logo = card.find_element(By.CSS_SELECTOR, '.image-wrapper img').get_attribute("src")
-                    except: j_logo = ""
-
-                    if j_id and j_title:
-                        all_jobs.append({
-                            'source_id': source_id, 'job_id': j_id, 'job_title': j_title, 
-                            'company_name': j_comp, 'salary': j_sal, 'location': j_loc, 
-                            'experience_required': j_exp, 'job_type': j_type, 
-                            'posted_time': j_posted, 'job_url': j_url, 'company_logo': j_logo,
-                            'extracted_date': extract_date, 
-                            'extracted_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        })
-                        count_ok += 1
-                except: continue
+            with metrics.span('parse') as span:
+                jobs = parse_cards(cards, source_id, extract_date)
+                span.rows = len(jobs)
+            all_jobs.extend(jobs)
+            count_ok = len(jobs)
             
             logger.info(f"-> Lấy được {count_ok} jobs. Tổng cộng: {len(all_jobs)}")
             current_page += 1
@@ -155,12 +169,13 @@ def main():
     args = parser.parse_args()
     ext_date = args.date or datetime.now().strftime('%Y-%m-%d')
     
-    conn = None; driver = None; log_id = None
+    conn = None; driver = None; log_id = None; metrics = None; status = 'Failed'
     try:
         # [BƯỚC 1] Load Config
         print(">>> [BƯỚC 1] Load Config...")
         db_cfg, ext_cfg = parse_config_xml(args.config)
         logger = setup_logger(ext_cfg['log_path'], args.source_id)
+        metrics = Metrics('extract', args.config, args.source_id, ext_date)
         
         # [BƯỚC 2] Kết nối DB
         logger.info(">>> [BƯỚC 2] Kết nối DB Control...")
@@ -184,7 +199,7 @@ def main():
         driver = setup_driver(ext_cfg['driver_path'], ext_cfg['headless'])
         
         # [BƯỚC 6] Cào dữ liệu (Loop Pagination)
-        data = scrape_jobsgo_pagination(driver, logger, src_conf['src_url'], args.source_id, ext_date)
+        data = scrape_jobsgo_pagination(driver, logger, src_conf['src_url'], args.source_id, ext_date, metrics)
         
         # [BƯỚC 7] Lưu file CSV
         if data:
@@ -194,10 +209,11 @@ def main():
             f_name = f"{args.source_id}_{datetime.now().strftime('%H%M%S')}.csv"
             f_path = os.path.join(out_dir, f_name)
             
-            df = pd.DataFrame(data)
-            cols = ['source_id', 'job_id', 'job_title', 'company_name', 'salary', 'location', 'experience_required', 'job_type', 'posted_time', 'job_url', 'company_logo', 'extracted_date', 'extracted_timestamp']
-            df = df[[c for c in cols if c in df.columns]]
-            df.to_csv(f_path, index=False, encoding='utf-8-sig')
+            with metrics.span('write_csv', rows=len(data)):
+                df = pd.DataFrame(data)
+                cols = ['source_id', 'job_id', 'job_title', 'company_name', 'salary', 'location', 'experience_required', 'job_type', 'posted_time', 'job_url', 'company_logo', 'extracted_date', 'extracted_timestamp']
+                df = df[[c for c in cols if c in df.columns]]
+                df.to_csv(f_path, index=False, encoding='utf-8-sig')
             logger.info(f"✓ File saved: {f_path}")
             
             # [BƯỚC 8] Update DB Success
@@ -205,6 +221,7 @@ def main():
             cur = conn.cursor()
             cur.execute("UPDATE extract_log SET status='Success', rows_extracted=%s, file_path=%s, file_size=%s, end_time=NOW() WHERE log_id=%s", (len(data), f_path, os.path.getsize(f_path), log_id))
             conn.commit()
+            metrics.rows = len(data); status = 'Success'
             logger.info(f"✅ HOÀN THÀNH. Tổng: {len(data)} jobs.")
         else:
             logger.warning(">>> [BƯỚC 7] Không có dữ liệu.")
@@ -220,7 +237,10 @@ def main():
             conn.commit()
     finally:
         if driver: driver.quit()
+        if metrics: metrics.close(status, conn if conn and conn.is_connected() else None)
         if conn: conn.close()
+    return status == 'Success'
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Exit code 1 khi extract không thành công (lỗi, không có dữ liệu, nguồn bị tắt): pipeline_scheduler.py retry theo exit code
+    sys.exit(0 if main() else 1)
\ No newline at end of file
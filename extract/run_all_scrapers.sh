@@ -17,6 +17,8 @@ log "INFO" "=========================================="
 
 cd $BASE_DIR || exit 1
 source venv/bin/activate
+# dw_metrics.py (dùng chung cho mọi stage) nằm ở /opt/dw/staging, cạnh config.xml
+export PYTHONPATH="/opt/dw/staging${PYTHONPATH:+:$PYTHONPATH}"
 
 # Get sources grouped by website
 topcv_sources=$(mysql -h $DB_HOST -u $DB_USER -p"$DB_PASS" $DB_NAME -sN -e \
@@ -60,6 +60,8 @@ echo "[$(date)] [JobsGO] STARTING ATTEMPT $NEXT_ATTEMPT..." >> "${LOG_DIR}/cron.
 
 # 4. THUC THI PYTHON (Dung tee de vua ghi log vua hien ra man hinh)
 source "${VENV_DIR}/bin/activate"
+# dw_metrics.py (dùng chung cho mọi stage) nằm ở /opt/dw/staging, cạnh config.xml
+export PYTHONPATH="/opt/dw/staging${PYTHONPATH:+:$PYTHONPATH}"
 
 python3 "${SCRIPT_DIR}/${SCRIPT_NAME}" \
     --config "${CONFIG_FILE}" \
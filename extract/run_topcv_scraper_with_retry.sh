@@ -170,6 +170,8 @@ cd "${BASE_DIR}"
 
 log_message "INFO" "Activating virtual environment..."
 source venv/bin/activate
+# dw_metrics.py (dùng chung cho mọi stage) nằm ở /opt/dw/staging, cạnh config.xml
+export PYTHONPATH="/opt/dw/staging${PYTHONPATH:+:$PYTHONPATH}"
 
 log_message "INFO" "Executing scraper script..."
 python3 "${SCRIPT_PATH}" \
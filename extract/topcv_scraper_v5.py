@@ -10,6 +10,7 @@ import pandas as pd
 from datetime import datetime
 import time
 import os
+import sys
 import hashlib
 import mysql.connector
 import logging
@@ -22,6 +23,7 @@ from selenium.webdriver.edge.options import Options as EdgeOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from dw_metrics import Metrics
 
 # ==============================================================================
 # KHU VỰC HÀM HỖ TRỢ (HELPER FUNCTIONS)
@@ -58,7 +60,51 @@ def setup_driver(path, headless):
 # ==============================================================================
 # CORE LOGIC: HÀM TRÍCH XUẤT DỮ LIỆU (PAGINATION) - [BƯỚC 6]
 # ==============================================================================
-def scrape_with_pagination(driver, logger, base_url, source_id, extract_date):
+# Thẻ job trên trang danh sách
+CARD_SELECTOR = '.job-item-search-result'
+
+def parse_cards(cards, source_id, extract_date):
+    """[BƯỚC 6.3] Bóc tách danh sách thẻ job (WebElement) của 1 trang thành các dòng dữ liệu"""
+    jobs = []
+    for card in cards:
+        try:
+            j_id = card.get_attribute("data-job-id")
+            try: j_title = card.find_element(By.CSS_SELECTOR, '.title a span').text.strip()
+            except: j_title = ""
+            try: j_comp = card.find_element(By.CSS_SELECTOR, '.company .company-name').text.strip()
+            except: j_comp = ""
+            try: j_sal = card.find_element(By.CSS_SELECTOR, '.title-salary').text.strip()
+            except: j_sal = "Thỏa thuận"
+            try: j_loc = card.find_element(By.CSS_SELECTOR, '.address .city-text').text.strip()
+            except: j_loc = ""
+            try: j_exp = card.find_element(By.CSS_SELECTOR, 'label.exp').text.strip()
+            except: j_exp = "Không yêu cầu"
+            try: 
+                raw_time = card.find_element(By.CSS_SELECTOR, '.label-update').text.strip()
+                j_time = raw_time.replace("Đăng", "").strip()
+            except: j_time = ""
+            try: j_url = card.find_element(By.CSS_SELECTOR, '.title a').get_attribute("href")
+            except: j_url = ""
+            try: 
+                tags = [t.text.strip() for t in card.find_elements(By.CSS_SELECTOR, '.tag .item-tag, .tag a') if t.text.strip()]
+                j_tags = ", ".join(tags)
+            except: j_tags = ""
+            try: j_logo = card.find_element(By.CSS_SELECTOR, '.avatar img').get_attribute("src")
+            except: j_logo = ""
+
+            if j_id and j_title:
+                jobs.append({
+                    'source_id': source_id, 'job_id': j_id, 'job_title': j_title, 
+                    'company_name': j_comp, 'salary': j_sal, 'location': j_loc, 
+                    'experience_required': j_exp, 'posted_time': j_time, 
+                    'tags': j_tags, 'job_url': j_url, 'company_logo': j_logo,
+                    'extracted_date': extract_date, 
+                    'extracted_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+        except: continue
+    return jobs
+
+def scrape_with_pagination(driver, logger, base_url, source_id, extract_date, metrics):
     all_jobs = []
     current_page = 1
     # Đặt giới hạn số trang (TopCV IT thường có khoảng 40-50 trang)
@@ -74,16 +120,17 @@ def scrape_with_pagination(driver, logger, base_url, source_id, extract_date):
         logger.info(f"--- Đang quét Trang {current_page}/{MAX_PAGES} ---")
         
         try:
-            # 6.1: Truy cập URL trang hiện tại
-            driver.get(page_url)
-            time.sleep(4) # Chờ load trang
+            with metrics.span('page_fetch'):
+                # 6.1: Truy cập URL trang hiện tại
+                driver.get(page_url)
+                time.sleep(4) # Chờ load trang
             
-            # 6.2: Tìm các thẻ Job Card
-            try:
-                WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.job-item-search-result')))
-                cards = driver.find_elements(By.CSS_SELECTOR, '.job-item-search-result')
-            except:
-                cards = []
+                # 6.2: Tìm các thẻ Job Card
+                try:
+                    WebDriverWait(driver, 5).until(EC.presence_of_element_located((By.CSS_SELECTOR, CARD_SELECTOR)))
+                    cards = driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR)
+                except:
+                    cards = []
             
             # Điều kiện dừng: Nếu trang không có job nào -> Đã hết dữ liệu
             if not cards:
@@ -93,44 +140,11 @@ def scrape_with_pagination(driver, logger, base_url, source_id, extract_date):
             logger.info(f"-> Tìm thấy {len(cards)} tin trên trang {current_page}")
             
             # 6.3: Bóc tách từng thẻ (Parsing)
-            count_ok = 0
-            for card in cards:
-                try:
-                    j_id = card.get_attribute("data-job-id")
-                    try: j_title = card.find_element(By.CSS_SELECTOR, '.title a span').text.strip()
-                    except: j_title = ""
-                    try: j_comp = card.find_element(By.CSS_SELECTOR, '.company .company-name').text.strip()
-                    except: j_comp = ""
-                    try: j_sal = card.find_element(By.CSS_SELECTOR, '.title-salary').text.strip()
-                    except: j_sal = "Thỏa thuận"
-                    try: j_loc = card.find_element(By.CSS_SELECTOR, '.address .city-text').text.strip()
-                    except: j_loc = ""
-                    try: j_exp = card.find_element(By.CSS_SELECTOR, 'label.exp').text.strip()
-                    except: j_exp = "Không yêu cầu"
-                    try: 
-                        raw_time = card.find_element(By.CSS_SELECTOR, '.label-update').text.strip()
-                        j_time = raw_time.replace("Đăng", "").strip()
-                    except: j_time = ""
-                    try: j_url = card.find_element(By.CSS_SELECTOR, '.title a').get_attribute("href")
-                    except: j_url = ""
-                    try: 
-                        tags = [t.text.strip() for t in card.find_elements(By.CSS_SELECTOR, '.tag .item-tag, .tag a') if t.text.strip()]
-                        j_tags = ", ".join(tags)
-                    except: j_tags = ""
-                    try: j_logo = card.find_element(By.CSS_SELECTOR, '.avatar img').get_attribute("src")
-                    except: j_logo = ""
-
-                    if j_id and j_title:
-                        all_jobs.append({
-                            'source_id': source_id, 'job_id': j_id, 'job_title': j_title, 
-                            'company_name': j_comp, 'salary': j_sal, 'location': j_loc, 
-                            'experience_required': j_exp, 'posted_time': j_time, 
-                            'tags': j_tags, 'job_url': j_url, 'company_logo': j_logo,
-                            'extracted_date': extract_date, 
-                            'extracted_timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        })
-                        count_ok += 1
-                except: continue
+            with metrics.span('parse') as span:
+                jobs = parse_cards(cards, source_id, extract_date)
+                span.rows = len(jobs)
+            all_jobs.extend(jobs)
+            count_ok = len(jobs)
             
             logger.info(f"-> Đã lấy được {count_ok} jobs. Tổng cộng: {len(all_jobs)}")
             current_page += 1 # Chuyển sang trang tiếp theo
@@ -153,13 +167,14 @@ def main():
     args = parser.parse_args()
     ext_date = args.date or datetime.now().strftime('%Y-%m-%d')
     
-    conn = None; driver = None; log_id = None
+    conn = None; driver = None; log_id = None; metrics = None; status = 'Failed'
     
     try:
         # [BƯỚC 1] Load file config
         print(">>> [BƯỚC 1] Load Config...")
         db_cfg, ext_cfg = parse_config_xml(args.config)
         logger = setup_logger(ext_cfg['log_path'], args.source_id)
+        metrics = Metrics('extract', args.config, args.source_id, ext_date)
         
         # [BƯỚC 2] Kết nối DB Control
         logger.info(">>> [BƯỚC 2] Kết nối DB Control...")
@@ -190,7 +205,7 @@ def main():
         driver = setup_driver(ext_cfg['driver_path'], ext_cfg['headless'])
         
         # [BƯỚC 6] Tiến hành trích xuất (Gọi hàm có vòng lặp trang)
-        data = scrape_with_pagination(driver, logger, src_conf['src_url'], args.source_id, ext_date)
+        data = scrape_with_pagination(driver, logger, src_conf['src_url'], args.source_id, ext_date, metrics)
         
         # [BƯỚC 7] Lưu thông tin vào file CSV (Staging)
         if data:
@@ -202,10 +217,11 @@ def main():
             f_path = os.path.join(out_dir, f_name)
             
             # Lưu file
-            df = pd.DataFrame(data)
-            cols = ['source_id', 'job_id', 'job_title', 'company_name', 'salary', 'location', 'experience_required', 'posted_time', 'tags', 'job_url', 'company_logo', 'extracted_date', 'extracted_timestamp']
-            df = df[[c for c in cols if c in df.columns]]
-            df.to_csv(f_path, index=False, encoding='utf-8-sig')
+            with metrics.span('write_csv', rows=len(data)):
+                df = pd.DataFrame(data)
+                cols = ['source_id', 'job_id', 'job_title', 'company_name', 'salary', 'location', 'experience_required', 'posted_time', 'tags', 'job_url', 'company_logo', 'extracted_date', 'extracted_timestamp']
+                df = df[[c for c in cols if c in df.columns]]
+                df.to_csv(f_path, index=False, encoding='utf-8-sig')
             logger.info(f"✓ File saved: {f_path}")
             
             # [BƯỚC 8] Xuất kết quả & Update DB Success
@@ -213,6 +229,7 @@ def main():
             cur = conn.cursor()
             cur.execute("UPDATE extract_log SET status='Success', rows_extracted=%s, file_path=%s, file_size=%s, end_time=NOW() WHERE log_id=%s", (len(data), f_path, os.path.getsize(f_path), log_id))
             conn.commit()
+            metrics.rows = len(data); status = 'Success'
             logger.info(f"✅ HOÀN THÀNH QUY TRÌNH. Tổng số job: {len(data)}")
             
         else:
@@ -232,7 +249,10 @@ def main():
     finally:
         # Dọn dẹp
         if driver: driver.quit()
+        if metrics: metrics.close(status, conn if conn and conn.is_connected() else None)
         if conn: conn.close()
+    return status == 'Success'
 
 if __name__ == '__main__':
-    main()
+    # Exit code 1 khi extract không thành công (lỗi, không có dữ liệu, nguồn bị tắt): pipeline_scheduler.py retry theo exit code
+    sys.exit(0 if main() else 1)
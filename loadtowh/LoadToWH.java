@@ -12,7 +12,7 @@ public class LoadToWH {
         TimeZone.setDefault(TimeZone.getTimeZone("Asia/Ho_Chi_Minh"));
 
         if (args.length < 1) {
-            System.out.println("Usage: java LoadToWH <config.xml> [dateParam]");
+            System.out.println("Usage: java LoadToWH <config.xml> [dateParam | fromDate toDate]");
             return;
         }
 
@@ -21,6 +21,10 @@ public class LoadToWH {
                 ? args[1]
                 : new SimpleDateFormat("yyyy-MM-dd").format(new java.util.Date());
 
+        // Chế độ catch-up: truyền fromDate toDate để load nhiều ngày trong 1 lần
+        boolean rangeMode = args.length >= 3;
+        String toDateParam = rangeMode ? args[2] : dateParam;
+
         // =========================
         // 1. Load file config để lấy thông tin kết nối với db_control, db_staging, db_warehouse đồng thời lấy đường dẫn thư mục nơi xuất file dữ liệu cần chuyển (file dump).
         // =========================
@@ -35,9 +39,14 @@ public class LoadToWH {
 
         String dumpFolder="";
         String loadScriptPath="";
+        String batchScriptPath="";
         String sshUser="";
         String targetPath="";
 
+        // Metrics: timing spans của lần chạy ghi vào db_control.pipeline_metrics (và file Prometheus nếu có textfileDir)
+        boolean metricsEnabled = true;
+        String metricsTextfileDir = null;
+
         try {
             DocumentBuilderFactory dbFactory = DocumentBuilderFactory.newInstance();
             DocumentBuilder dBuilder = dbFactory.newDocumentBuilder();
@@ -73,7 +82,22 @@ public class LoadToWH {
             dumpFolder = loadtowhElement.getElementsByTagName("dump_path").item(0).getTextContent();
             if (!dumpFolder.startsWith("/")) dumpFolder = "/" + dumpFolder;
 
-            loadScriptPath = "/opt/dw/staging/loadtowh/scripts/load_to_wh_with_retry.sh";
+            Element metricsElement = (Element) doc.getElementsByTagName("metrics").item(0);
+            if (metricsElement != null) {
+                NodeList enabledNodes = metricsElement.getElementsByTagName("enabled");
+                if (enabledNodes.getLength() > 0)
+                    metricsEnabled = Boolean.parseBoolean(enabledNodes.item(0).getTextContent().trim());
+                NodeList textfileNodes = metricsElement.getElementsByTagName("textfileDir");
+                if (textfileNodes.getLength() > 0) metricsTextfileDir = textfileNodes.item(0).getTextContent().trim();
+            }
+
+            // merge_script: load_to_wh.sh khi chạy dưới pipeline_scheduler.py (scheduler tự retry),
+            // mặc định load_to_wh_with_retry.sh (retry bằng cron tạm) khi chạy bằng cron
+            NodeList mergeScriptNodes = loadtowhElement.getElementsByTagName("merge_script");
+            loadScriptPath = mergeScriptNodes.getLength() > 0
+                    ? mergeScriptNodes.item(0).getTextContent().trim()
+                    : "/opt/dw/staging/loadtowh/scripts/load_to_wh_with_retry.sh";
+            batchScriptPath = "/opt/dw/staging/loadtowh/scripts/load_to_wh_batch.sh";
 
         } catch (Exception e) {
             System.err.println("Khong doc duoc config.xml");
@@ -101,7 +125,9 @@ public class LoadToWH {
         }
 
         long startTime = System.currentTimeMillis();
+        Metrics metrics = new Metrics(dateParam);
         String dumpFile = null;
+        List<String> readyDates = new ArrayList<>();
 
         try {
             // =========================
@@ -124,50 +150,93 @@ public class LoadToWH {
                 }
             }
 
-            // =========================
-            // Bước 4: Gọi procedure is_process_done_procedure để kiểm tra dữ liệu trên db_staging đã có hay chưa và gán vào biến result.
-            // =========================
-            int result = 0;
-
-            try (CallableStatement cs = controlConn.prepareCall("{CALL is_process_done_procedure(?)}")) {
-               cs.setDate(1, java.sql.Date.valueOf(dateParam));
-               try (ResultSet rs = cs.executeQuery()) {
-                  if (rs.next()) {
-                  result = rs.getInt("is_done");
-                  }
-               }
-            } catch (SQLException e) {
-              String msg = "Khong the goi procedure"; 
-              System.err.println(msg);
-              insertLog(controlConn, dateParam, "Failed", 0, startTime, System.currentTimeMillis(), msg);
-              return;  
-            }
+            if (rangeMode) {
+                // =========================
+                // Bước 4 (catch-up): Gọi is_process_done_range_procedure 1 lần cho cả khoảng ngày.
+                // Ngày đã load thành công thì bỏ qua, ngày chưa có dữ liệu thì ghi log Failed riêng cho ngày đó.
+                // =========================
+                try (CallableStatement cs = controlConn.prepareCall("{CALL is_process_done_range_procedure(?, ?)}")) {
+                    cs.setDate(1, java.sql.Date.valueOf(dateParam));
+                    cs.setDate(2, java.sql.Date.valueOf(toDateParam));
+                    try (ResultSet rs = cs.executeQuery()) {
+                        while (rs.next()) {
+                            String day = rs.getDate("data_date").toString();
+                            if (rs.getInt("is_loaded") == 1) continue;
+                            if (rs.getInt("is_done") == 1) {
+                                readyDates.add(day);
+                            } else {
+                                insertLog(controlConn, day, "Failed", 0, startTime, System.currentTimeMillis(),
+                                        "Chua co du lieu de load vao warehouse");
+                            }
+                        }
+                    }
+                } catch (SQLException e) {
+                    String msg = "Khong the goi procedure";
+                    System.err.println(msg);
+                    insertLog(controlConn, dateParam, "Failed", 0, startTime, System.currentTimeMillis(), msg);
+                    return;
+                }
 
-            if (result != 1) {
-               String msg = "Chua co du lieu de load vao warehouse";
-               insertLog(controlConn, dateParam, "Failed", 0, startTime, System.currentTimeMillis(), msg);
-               return;
+                if (readyDates.isEmpty()) {
+                    System.out.println("Khong co ngay nao can load vao warehouse");
+                    return;
+                }
+            } else {
+                // =========================
+                // Bước 4: Gọi procedure is_process_done_procedure để kiểm tra dữ liệu trên db_staging đã có hay chưa và gán vào biến result.
+                // =========================
+                int result = 0;
+
+                try (CallableStatement cs = controlConn.prepareCall("{CALL is_process_done_procedure(?)}")) {
+                   cs.setDate(1, java.sql.Date.valueOf(dateParam));
+                   try (ResultSet rs = cs.executeQuery()) {
+                      if (rs.next()) {
+                      result = rs.getInt("is_done");
+                      }
+                   }
+                } catch (SQLException e) {
+                  String msg = "Khong the goi procedure"; 
+                  System.err.println(msg);
+                  insertLog(controlConn, dateParam, "Failed", 0, startTime, System.currentTimeMillis(), msg);
+                  return;  
+                }
+
+                if (result != 1) {
+                   String msg = "Chua co du lieu de load vao warehouse";
+                   insertLog(controlConn, dateParam, "Failed", 0, startTime, System.currentTimeMillis(), msg);
+                   return;
+                }
+                readyDates.add(dateParam);
             }
 
             // =========================
             // Bước 5: Dump dữ liệu từ table staging_topcv_jobs trên db_staging thành file staging_<date>.sql
+            // (catch-up: 1 file staging_<fromDate>_<toDate>.sql chứa tất cả các ngày đã sẵn sàng)
+            // Dump mọi job thấy từ ngày đầu trở đi: job thấy lại ở ngày sau đã có last_seen_date mới hơn,
+            // nếu chỉ lấy đúng ngày thì khi load/chạy lại ngày cũ job đó sẽ bị coi là đã gỡ khỏi nguồn
             // =========================
             new File(dumpFolder).mkdirs();
-            dumpFile = dumpFolder + "/staging_" + dateParam + ".sql";
+            dumpFile = rangeMode
+                    ? dumpFolder + "/staging_" + dateParam + "_" + toDateParam + ".sql"
+                    : dumpFolder + "/staging_" + dateParam + ".sql";
 
             String dumpCmd = String.format(
                     "mysqldump -h%s -P%d -u%s -p%s %s staging_topcv_jobs " +
-                    "--where=\"DATE(extracted_date)='%s'\" --no-create-info --insert-ignore " +
+                    "--where=\"last_seen_date >= '%s'\" --no-create-info --insert-ignore --complete-insert " +
                     "| sed 's/`staging_topcv_jobs`/`job_temp`/g' > %s",
                     stagingHost, stagingPort, stagingUser, stagingPass,
-                    stagingDB, dateParam, dumpFile
+                    stagingDB, readyDates.get(0), dumpFile
             );
 
+            long dumpStart = System.currentTimeMillis();
             runCommand(dumpCmd);
+            metrics.add("run/dump", dumpStart, System.currentTimeMillis(), 0, "Success");
 
         } catch (Exception e) {
             long endTime = System.currentTimeMillis();
             insertLog(controlConn, dateParam, "Failed", 0, startTime, endTime, e.getMessage());
+            metrics.add("run", startTime, endTime, 0, "Failed");
+            if (metricsEnabled) metrics.write(controlConn, metricsTextfileDir);
             throw e;
 
         } finally {
@@ -176,11 +245,12 @@ public class LoadToWH {
 
         // =========================
         // Bước 6: Chuẩn bị danh sách tham số để gọi script shell (load_to_wh_with_retry.sh).
+        // Catch-up: gọi load_to_wh_batch.sh với danh sách ngày theo thứ tự tăng dần, cách nhau bởi dấu phẩy.
         // =========================
         List<String> cmd = Arrays.asList(
-                "bash", loadScriptPath,
+                "bash", rangeMode ? batchScriptPath : loadScriptPath,
                 configFile,
-                dateParam,
+                rangeMode ? String.join(",", readyDates) : dateParam,
                 warehouseDB,
                 warehouseUser,
                 warehousePass,
@@ -198,7 +268,127 @@ public class LoadToWH {
                 String.valueOf(startTime)
         );
 
-        runCommand(cmd);
+        // Bước 7: Ghi metrics (dump, merge và tổng thời gian) trong 1 lần batch insert
+        long mergeStart = System.currentTimeMillis();
+        String runStatus = "Failed";
+        long mergedRows = 0;
+        try {
+            mergedRows = totalProcessed(runCommand(cmd));
+            runStatus = "Success";
+        } finally {
+            long endTime = System.currentTimeMillis();
+            metrics.add("run/merge", mergeStart, endTime, mergedRows, runStatus);
+            metrics.add("run", startTime, endTime, mergedRows, runStatus);
+            if (metricsEnabled) {
+                try (Connection conn = DriverManager.getConnection(String.format(
+                        "jdbc:mysql://%s:%d/%s?serverTimezone=Asia/Ho_Chi_Minh&rewriteBatchedStatements=true",
+                        controlHost, controlPort, controlDB), controlUser, controlPass)) {
+                    metrics.write(conn, metricsTextfileDir);
+                } catch (SQLException e) {
+                    System.err.println("Failed to write metrics: " + e.getMessage());
+                }
+            }
+        }
+    }
+
+    // Tổng số dòng đã xử lý theo output của load_to_wh.sh / load_to_wh_batch.sh ("... Total processed: N")
+    private static long totalProcessed(List<String> output) {
+        long total = 0;
+        for (String line : output) {
+            int i = line.indexOf("Total processed: ");
+            if (i >= 0) {
+                try {
+                    total += Long.parseLong(line.substring(i + "Total processed: ".length()).trim());
+                } catch (NumberFormatException ignored) { }
+            }
+        }
+        return total;
+    }
+
+    // Timing spans của 1 lần chạy, cùng định dạng với dw_metrics.py (bảng pipeline_metrics, file .prom)
+    private static class Metrics {
+        private static final String STAGE = "load_to_wh";
+        private final String runId = UUID.randomUUID().toString().replace("-", "");
+        private final String dataDate;
+        private final List<Object[]> spans = new ArrayList<>();
+
+        Metrics(String dataDate) {
+            this.dataDate = dataDate;
+        }
+
+        void add(String path, long startMillis, long endMillis, long rows, String status) {
+            spans.add(new Object[]{path, startMillis, endMillis - startMillis, rows, status});
+        }
+
+        void write(Connection conn, String textfileDir) {
+            try (PreparedStatement ps = conn.prepareStatement(
+                    "INSERT INTO pipeline_metrics(run_id,stage,source_id,data_date,span_path,parent_path,depth,started_at," +
+                    "calls,duration_ms,max_duration_ms,row_count,rows_per_sec,status) VALUES(?,?,NULL,?,?,?,?,?,1,?,?,?,?,?)")) {
+                for (Object[] span : spans) {
+                    String path = (String) span[0];
+                    long durationMs = (Long) span[2];
+                    long rows = (Long) span[3];
+                    int slash = path.lastIndexOf('/');
+                    ps.setString(1, runId);
+                    ps.setString(2, STAGE);
+                    ps.setString(3, dataDate);
+                    ps.setString(4, path);
+                    ps.setString(5, slash < 0 ? null : path.substring(0, slash));
+                    ps.setInt(6, path.length() - path.replace("/", "").length());
+                    ps.setTimestamp(7, new Timestamp((Long) span[1]));
+                    ps.setLong(8, durationMs);
+                    ps.setLong(9, durationMs);
+                    ps.setLong(10, rows);
+                    if (rows > 0 && durationMs > 0) ps.setDouble(11, rows * 1000.0 / durationMs);
+                    else ps.setNull(11, Types.DECIMAL);
+                    ps.setString(12, (String) span[4]);
+                    ps.addBatch();
+                }
+                ps.executeBatch();
+            } catch (Exception e) {
+                System.err.println("Failed to write metrics: " + e.getMessage());
+            }
+
+            if (textfileDir == null || textfileDir.isEmpty()) return;
+            String labels = "stage=\"" + STAGE + "\"";
+            StringBuilder sb = new StringBuilder();
+            boolean success = spans.stream().anyMatch(s -> "run".equals(s[0]) && "Success".equals(s[4]));
+            sb.append("# HELP dw_last_run_timestamp_seconds End time of the stage's last run\n")
+              .append("# TYPE dw_last_run_timestamp_seconds gauge\n")
+              .append(String.format(Locale.ROOT, "dw_last_run_timestamp_seconds{%s} %.3f%n", labels, System.currentTimeMillis() / 1000.0))
+              .append("# HELP dw_last_run_success 1 if the stage's last run succeeded\n")
+              .append("# TYPE dw_last_run_success gauge\n")
+              .append(String.format("dw_last_run_success{%s} %d%n", labels, success ? 1 : 0))
+              .append("# HELP dw_span_duration_seconds Total time spent in the span during the last run\n")
+              .append("# TYPE dw_span_duration_seconds gauge\n");
+            for (Object[] span : spans)
+                sb.append(String.format(Locale.ROOT, "dw_span_duration_seconds{%s,span=\"%s\"} %.6f%n", labels, span[0], (Long) span[2] / 1000.0));
+            sb.append("# HELP dw_span_calls Times the span ran during the last run\n")
+              .append("# TYPE dw_span_calls gauge\n");
+            for (Object[] span : spans)
+                sb.append(String.format("dw_span_calls{%s,span=\"%s\"} 1%n", labels, span[0]));
+            sb.append("# HELP dw_span_rows Rows processed in the span during the last run\n")
+              .append("# TYPE dw_span_rows gauge\n");
+            for (Object[] span : spans)
+                sb.append(String.format("dw_span_rows{%s,span=\"%s\"} %d%n", labels, span[0], (Long) span[3]));
+            sb.append("# HELP dw_span_rows_per_second Throughput of the span during the last run\n")
+              .append("# TYPE dw_span_rows_per_second gauge\n");
+            for (Object[] span : spans)
+                if ((Long) span[3] > 0 && (Long) span[2] > 0)
+                    sb.append(String.format(Locale.ROOT, "dw_span_rows_per_second{%s,span=\"%s\"} %.1f%n",
+                            labels, span[0], (Long) span[3] * 1000.0 / (Long) span[2]));
+
+            // Ghi ra file tạm rồi rename để collector không đọc phải file ghi dở
+            File target = new File(textfileDir, "dw_" + STAGE + ".prom");
+            File tmp = new File(textfileDir, "dw_" + STAGE + ".prom.tmp");
+            try (Writer w = new OutputStreamWriter(new FileOutputStream(tmp), "UTF-8")) {
+                w.write(sb.toString());
+            } catch (IOException e) {
+                System.err.println("Failed to write metrics textfile: " + e.getMessage());
+                return;
+            }
+            if (!tmp.renameTo(target)) System.err.println("Failed to write metrics textfile: cannot rename " + tmp);
+        }
     }
 
     // Hàm insert log (timestamp đã tự theo +7)
@@ -224,21 +414,26 @@ public class LoadToWH {
         }
     }
 
-    private static void runCommand(List<String> command) throws Exception {
+    private static List<String> runCommand(List<String> command) throws Exception {
         ProcessBuilder pb = new ProcessBuilder(command);
         pb.redirectErrorStream(true);
         Process p = pb.start();
 
+        List<String> output = new ArrayList<>();
         try (BufferedReader br = new BufferedReader(new InputStreamReader(p.getInputStream()))) {
-            br.lines().forEach(System.out::println);
+            br.lines().forEach(line -> {
+                System.out.println(line);
+                output.add(line);
+            });
         }
 
         int exitCode = p.waitFor();
         if (exitCode != 0) throw new RuntimeException("Command failed with exit code " + exitCode);
+        return output;
     }
 
-    private static void runCommand(String cmd) throws Exception {
-        runCommand(Arrays.asList("/bin/sh", "-c", cmd));
+    private static List<String> runCommand(String cmd) throws Exception {
+        return runCommand(Arrays.asList("/bin/sh", "-c", cmd));
     }
 }
 
@@ -51,19 +51,57 @@ INSERT INTO process_log (
     1, '2025-11-13', 'Success', 1500, '2025-11-13 00:03:00', '2025-11-13 00:05:30', NULL
 );
 
-/* Procedure: is_process_done_procedure */
+/* Procedure: is_process_done_procedure
+   Không tính process Staging_Dedup_Jobs (staging_dedup.py): dedup chạy xong một mình
+   không có nghĩa là dữ liệu staging của ngày đã được load/transform.
+   DROP + CREATE để cài lại cũng cập nhật được procedure cũ */
+DROP PROCEDURE IF EXISTS is_process_done_procedure;
 DELIMITER $$
-CREATE PROCEDURE IF NOT EXISTS is_process_done_procedure(IN p_day DATE)
+CREATE PROCEDURE is_process_done_procedure(IN p_day DATE)
 BEGIN
     SELECT EXISTS (
         SELECT 1
         FROM process_log pl
+        JOIN process_config pc ON pc.process_id = pl.process_id
         WHERE LOWER(pl.status) = 'success'
           AND pl.execution_date = p_day
+          AND pc.process_name <> 'Staging_Dedup_Jobs'
     ) AS is_done;
 END$$
 DELIMITER ;
 
+/* Procedure: is_process_done_range_procedure
+   Kiểm tra một lần cho cả khoảng ngày (chế độ catch-up của LoadToWH):
+   mỗi ngày trả về is_done (staging đã xong) và is_loaded (đã load warehouse thành công) */
+DROP PROCEDURE IF EXISTS is_process_done_range_procedure;
+DELIMITER $$
+CREATE PROCEDURE is_process_done_range_procedure(IN p_from DATE, IN p_to DATE)
+BEGIN
+    WITH RECURSIVE days AS (
+        SELECT p_from AS data_date
+        UNION ALL
+        SELECT data_date + INTERVAL 1 DAY FROM days WHERE data_date < p_to
+    )
+    SELECT d.data_date,
+           EXISTS (
+               SELECT 1
+               FROM process_log pl
+               JOIN process_config pc ON pc.process_id = pl.process_id
+               WHERE LOWER(pl.status) = 'success'
+                 AND pl.execution_date = d.data_date
+                 AND pc.process_name <> 'Staging_Dedup_Jobs'
+           ) AS is_done,
+           EXISTS (
+               SELECT 1
+               FROM load_to_wh_log wl
+               WHERE wl.status = 'Success'
+                 AND wl.data_date = d.data_date
+           ) AS is_loaded
+    FROM days d
+    ORDER BY d.data_date;
+END$$
+DELIMITER ;
+
 /* load_to_wh_config */
 CREATE TABLE IF NOT EXISTS load_to_wh_config (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -89,14 +127,27 @@ CREATE TABLE IF NOT EXISTS load_to_wh_log (
     data_date DATE DEFAULT NULL,
     status ENUM('Success','Failed','Running') DEFAULT 'Running',
     rows_processed INT DEFAULT 0,
+    rows_deleted INT DEFAULT 0,
     start_time TIMESTAMP NULL,
     end_time TIMESTAMP NULL,
     duration_seconds INT AS (TIMESTAMPDIFF(SECOND,start_time,end_time)) STORED,
     message TEXT,
     INDEX idx_status (status),
-    INDEX idx_execution_date (execution_date)
+    INDEX idx_execution_date (execution_date),
+    INDEX idx_data_date (data_date)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+/* Cài đặt cũ: load_to_wh_log tạo trước khi có rows_deleted (CREATE TABLE IF NOT EXISTS ở trên bỏ qua).
+   Kiểm tra information_schema thay cho ADD COLUMN IF NOT EXISTS (MySQL không hỗ trợ, chỉ MariaDB) */
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = 'db_control' AND TABLE_NAME = 'load_to_wh_log'
+                 AND COLUMN_NAME = 'rows_deleted') = 0,
+              'ALTER TABLE load_to_wh_log ADD COLUMN rows_deleted INT DEFAULT 0 AFTER rows_processed',
+              'DO 0');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
 SET FOREIGN_KEY_CHECKS = 1;
 
 /* --------------------------
@@ -104,12 +155,24 @@ SET FOREIGN_KEY_CHECKS = 1;
 --------------------------- */
 USE db_staging;
 
+/* Cài đặt cũ: staging_topcv_jobs chưa có last_seen_date (LoadToWH dump theo cột này).
+   Thêm cột + index nếu chưa có, rồi lấy extracted_date làm giá trị ban đầu */
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = 'db_staging' AND TABLE_NAME = 'staging_topcv_jobs'
+                 AND COLUMN_NAME = 'last_seen_date') = 0,
+              'ALTER TABLE staging_topcv_jobs ADD COLUMN last_seen_date DATE NULL DEFAULT NULL, ADD INDEX idx_last_seen_date (last_seen_date)',
+              'DO 0');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+UPDATE staging_topcv_jobs SET last_seen_date = extracted_date WHERE last_seen_date IS NULL;
+
 /* Thêm 1 record vào staging_topcv_jobs */
 INSERT INTO staging_topcv_jobs (
     job_id, job_title, company_name, salary, location,
-    experience_required, posted_time, job_url, extracted_date, date_id
+    experience_required, posted_time, job_url, extracted_date, date_id, last_seen_date
 ) VALUES (
     'TOPCV_002', 'Backend Developer', 'XYZ Corp', '1200-1800 USD', 'Ho Chi Minh',
     '2 years', '2025-11-12', 'https://topcv.vn/job/backend-developer/xyz',
-    '2025-11-13', 1
+    '2025-11-13', 1, '2025-11-13'
 );
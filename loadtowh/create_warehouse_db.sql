@@ -7731,15 +7731,112 @@ CREATE TABLE `job`  (
   `job_url` varchar(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NULL DEFAULT NULL,
   `extracted_date` date NULL DEFAULT NULL,
   `date_id` int NULL DEFAULT NULL,
-  `expired` date NULL DEFAULT '9999-12-31',
+  `cluster_id` varchar(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NULL DEFAULT NULL COMMENT 'Cụm tin trùng giữa các nguồn (staging_dedup.py)',
+  `expired` date NOT NULL DEFAULT '9999-12-31',
   `is_deleted` tinyint(1) NULL DEFAULT 0,
-  PRIMARY KEY (`job_sk`) USING BTREE,
+  `updated_at` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+  PRIMARY KEY (`job_sk`, `expired`) USING BTREE,
   INDEX `fk_date_id`(`date_id` ASC) USING BTREE,
-  CONSTRAINT `fk_date_id` FOREIGN KEY (`date_id`) REFERENCES `date_dim` (`date_sk`) ON DELETE CASCADE ON UPDATE CASCADE
-) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci ROW_FORMAT = Dynamic;
+  INDEX `idx_merge_key`(`job_title` ASC, `company_name` ASC) USING BTREE,
+  INDEX `idx_updated_at`(`updated_at` ASC) USING BTREE,
+  INDEX `idx_cluster_id`(`cluster_id` ASC) USING BTREE
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci ROW_FORMAT = Dynamic
+-- Partition theo expired (SCD2):
+--   p_current     : các dòng hiện hành (expired = '9999-12-31') -> merge và datamart chỉ quét partition này
+--   p_hist_YYYY_MM: các dòng đã hết hạn trong tháng đó -> archive/drop theo tháng trong thời gian hằng số
+--   p_hist_future : partition đệm, ensure_job_history_partition() tách ra partition tháng mới khi cần
+-- updated_at lưu tới micro giây: load_to_dm.py dùng nó làm watermark cho các dòng hết hạn, ở độ phân giải giây
+-- các dòng hết hạn cùng giây với snapshot sẽ bị mất. Warehouse cũ nâng cấp bằng:
+--   ALTER TABLE job MODIFY `updated_at` timestamp(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6);
+-- Bảng partition không hỗ trợ FOREIGN KEY nên bỏ fk_date_id (giữ lại index), PRIMARY KEY phải chứa expired.
+PARTITION BY RANGE COLUMNS (`expired`) (
+  PARTITION `p_hist_2025_11` VALUES LESS THAN ('2025-12-01'),
+  PARTITION `p_hist_2025_12` VALUES LESS THAN ('2026-01-01'),
+  PARTITION `p_hist_future` VALUES LESS THAN ('9999-12-31'),
+  PARTITION `p_current` VALUES LESS THAN (MAXVALUE)
+);
 
 -- ----------------------------
 -- Records of job
 -- ----------------------------
 
+-- ----------------------------
+-- Procedure: ensure_job_history_partition
+-- Tạo partition lịch sử theo tháng (tách từ p_hist_future) cho mọi tháng còn thiếu tới hết tháng chứa p_day,
+-- để các partition tháng luôn liền nhau: loader nghỉ nhiều tháng hay backfill không theo thứ tự
+-- cũng không để tháng nào nằm lại trong p_hist_future.
+-- Gọi trước khi merge để các dòng bị expire trong ngày rơi vào partition tháng riêng.
+-- ----------------------------
+DROP PROCEDURE IF EXISTS `ensure_job_history_partition`;
+DELIMITER $$
+CREATE PROCEDURE `ensure_job_history_partition`(IN p_day DATE)
+BEGIN
+    DECLARE v_month_start DATE DEFAULT DATE_FORMAT(p_day, '%Y-%m-01');
+    DECLARE v_next_month DATE DEFAULT DATE_ADD(DATE_FORMAT(p_day, '%Y-%m-01'), INTERVAL 1 MONTH);
+    DECLARE v_from DATE;
+    DECLARE v_parts TEXT DEFAULT '';
+
+    -- Tháng đầu tiên còn nằm trong p_hist_future: ngay sau partition tháng cuối cùng
+    SELECT MAX(CAST(TRIM(BOTH '''' FROM PARTITION_DESCRIPTION) AS DATE)) INTO v_from
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = 'job'
+      AND PARTITION_NAME NOT IN ('p_hist_future', 'p_current');
+
+    -- Chưa có partition tháng nào: bắt đầu từ tháng của dòng hết hạn sớm nhất đang nằm trong p_hist_future
+    IF v_from IS NULL THEN
+        SELECT DATE_FORMAT(MIN(expired), '%Y-%m-01') INTO v_from FROM job PARTITION (p_hist_future);
+        SET v_from = LEAST(COALESCE(v_from, v_month_start), v_month_start);
+    END IF;
+
+    WHILE v_from < v_next_month DO
+        SET v_parts = CONCAT(v_parts,
+            'PARTITION p_hist_', DATE_FORMAT(v_from, '%Y_%m'),
+            ' VALUES LESS THAN (''', DATE_ADD(v_from, INTERVAL 1 MONTH), '''), ');
+        SET v_from = DATE_ADD(v_from, INTERVAL 1 MONTH);
+    END WHILE;
+
+    IF v_parts <> '' THEN
+        SET @ddl = CONCAT(
+            'ALTER TABLE job REORGANIZE PARTITION p_hist_future INTO (', v_parts,
+            'PARTITION p_hist_future VALUES LESS THAN (''9999-12-31''))'
+        );
+        PREPARE stmt FROM @ddl;
+        EXECUTE stmt;
+        DEALLOCATE PREPARE stmt;
+    END IF;
+END$$
+DELIMITER ;
+
+-- ----------------------------
+-- Procedure: archive_job_history_partition
+-- Chuyển partition lịch sử của tháng p_month sang bảng job_archive_YYYY_MM bằng EXCHANGE PARTITION
+-- (chỉ đổi metadata, không copy dữ liệu) rồi DROP partition. p_keep_archive = 0 thì xóa luôn bảng archive.
+-- ----------------------------
+DROP PROCEDURE IF EXISTS `archive_job_history_partition`;
+DELIMITER $$
+CREATE PROCEDURE `archive_job_history_partition`(IN p_month DATE, IN p_keep_archive TINYINT)
+BEGIN
+    DECLARE v_partition VARCHAR(64) DEFAULT CONCAT('p_hist_', DATE_FORMAT(p_month, '%Y_%m'));
+    DECLARE v_archive VARCHAR(64) DEFAULT CONCAT('job_archive_', DATE_FORMAT(p_month, '%Y_%m'));
+
+    SET @ddl = CONCAT('CREATE TABLE ', v_archive, ' LIKE job');
+    PREPARE stmt FROM @ddl; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+    SET @ddl = CONCAT('ALTER TABLE ', v_archive, ' REMOVE PARTITIONING');
+    PREPARE stmt FROM @ddl; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+    SET @ddl = CONCAT('ALTER TABLE job EXCHANGE PARTITION ', v_partition, ' WITH TABLE ', v_archive);
+    PREPARE stmt FROM @ddl; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+    SET @ddl = CONCAT('ALTER TABLE job DROP PARTITION ', v_partition);
+    PREPARE stmt FROM @ddl; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+
+    IF p_keep_archive = 0 THEN
+        SET @ddl = CONCAT('DROP TABLE ', v_archive);
+        PREPARE stmt FROM @ddl; EXECUTE stmt; DEALLOCATE PREPARE stmt;
+    END IF;
+END$$
+DELIMITER ;
+
 SET FOREIGN_KEY_CHECKS = 1;
@@ -23,11 +23,35 @@ CONTROL_PORT="${15}"
 DUMP_FILE="${16}"
 START_TIME="${17}"
 
+# Warehouse trên cùng máy (vd. benchmark với MySQL cục bộ): copy và chạy trực tiếp, không qua scp/ssh
+WH_CONN=""
+if [ "$WH_IP" = "127.0.0.1" ] || [ "$WH_IP" = "localhost" ]; then
+    WH_LOCAL=1
+    WH_CONN="-h${WH_IP} -P${WH_PORT}"
+fi
+
+copy_to_warehouse() {
+    if [ -n "$WH_LOCAL" ]; then
+        mkdir -p "$(dirname "$2")" && cp "$1" "$2"
+    else
+        scp "$1" "${WH_SSH_USER}@${WH_IP}:$2"
+    fi
+}
+
+run_on_warehouse() {
+    if [ -n "$WH_LOCAL" ]; then
+        bash -c "$1"
+    else
+        ssh -o "SetEnv HISTIGNORE=*" "${WH_SSH_USER}@${WH_IP}" "$1"
+    fi
+}
+
+# Mật khẩu MySQL truyền qua MYSQL_PWD: mật khẩu rỗng không biến thành -p trần (mysql sẽ hỏi mật khẩu và treo)
 # Hàm log vào db_control
 log_to_control() {
-    local status="$1" message="$2" rows="$3"
-    mysql -h"$CONTROL_IP" -P"$CONTROL_PORT" -u"$CONTROL_USER" -p"$CONTROL_PASS" -D"$CONTROL_DB" \
-        -e "INSERT INTO load_to_wh_log(execution_date,data_date,status,rows_processed,start_time,end_time,message) VALUES(CURDATE(),'$DATE_PARAM','$status',$rows,FROM_UNIXTIME($START_TIME/1000),NOW(),'$message');" 2>/dev/null || true
+    local status="$1" message="$2" rows="$3" deleted="${4:-0}"
+    MYSQL_PWD="$CONTROL_PASS" mysql -h"$CONTROL_IP" -P"$CONTROL_PORT" -u"$CONTROL_USER" -D"$CONTROL_DB" \
+        -e "INSERT INTO load_to_wh_log(execution_date,data_date,status,rows_processed,rows_deleted,start_time,end_time,message) VALUES(CURDATE(),'$DATE_PARAM','$status',$rows,$deleted,FROM_UNIXTIME($START_TIME/1000),NOW(),'$message');" 2>/dev/null || true
 }
 
 # Kiểm tra dump file
@@ -39,11 +63,11 @@ fi
 
 # Bước 9. SCP file staging_<date>.sql từ server staging sang server warehouse
 echo "Copying $DUMP_FILE → ${WH_SSH_USER}@${WH_IP}:${REMOTE_PATH}/staging_${DATE_PARAM}.sql"
-scp "$DUMP_FILE" "${WH_SSH_USER}@${WH_IP}:${REMOTE_PATH}/staging_${DATE_PARAM}.sql" || { log_to_control "Failed" "khong the copy file staging_<date>.sql tu staging sang warehouse" 0; exit 1; }
+copy_to_warehouse "$DUMP_FILE" "${REMOTE_PATH}/staging_${DATE_PARAM}.sql" || { log_to_control "Failed" "khong the copy file staging_<date>.sql tu staging sang warehouse" 0; exit 1; }
 
 # Bước 10. SSH vào warehouse và load dữ liệu từ file staging_<date>.sql vào table job_temp trên db_warehouse
-RESULT=$(ssh -o "SetEnv HISTIGNORE=*" "${WH_SSH_USER}@${WH_IP}" "
-mysql -u\"${WH_USER}\" -p\"${WH_PASS}\" -D\"${WH_DB}\" -sse \"
+RESULT=$(run_on_warehouse "
+MYSQL_PWD=\"${WH_PASS}\" mysql ${WH_CONN} -u\"${WH_USER}\" -D\"${WH_DB}\" -sse \"
 DROP TABLE IF EXISTS job_temp;
 CREATE TABLE job_temp (
     job_id varchar(50) NULL,
@@ -55,11 +79,18 @@ CREATE TABLE job_temp (
     posted_time varchar(50) NULL,
     job_url varchar(500) NULL,
     extracted_date date NULL,
-    date_id bigint NULL
+    date_id bigint NULL,
+    cluster_id varchar(50) NULL,
+    last_seen_date date NULL,
+    INDEX idx_merge_key (job_title, company_name)
 );
 SOURCE ${REMOTE_PATH}/staging_${DATE_PARAM}.sql;
 
+# Đảm bảo partition lịch sử của tháng hiện tại đã tồn tại trước khi expire dòng cũ
+CALL ensure_job_history_partition(CURDATE());
+
 # Bước 11. update và insert dữ liệu từ bảng job_temp sang bảng job
+# Điều kiện expired = '9999-12-31' giúp MySQL chỉ quét partition p_current
 # Update
 UPDATE job w
 JOIN job_temp t
@@ -75,16 +106,48 @@ WHERE w.expired = '9999-12-31'
 SELECT ROW_COUNT();
 
 # Insert
-INSERT INTO job (job_title, company_name, salary, location, experience_required, posted_time, job_url, extracted_date, date_id, expired, is_deleted)
-SELECT t.job_title, t.company_name, t.salary, t.location, t.experience_required, t.posted_time, t.job_url, t.extracted_date, t.date_id, '9999-12-31', FALSE
+INSERT INTO job (job_title, company_name, salary, location, experience_required, posted_time, job_url, extracted_date, date_id, cluster_id, expired, is_deleted)
+SELECT t.job_title, t.company_name, t.salary, t.location, t.experience_required, t.posted_time, t.job_url, t.extracted_date, t.date_id, t.cluster_id, '9999-12-31', FALSE
 FROM job_temp t
 WHERE NOT EXISTS (
-    SELECT 1 FROM job w
+    SELECT 1 FROM job PARTITION (p_current) w
     WHERE w.job_title = t.job_title
       AND w.company_name = t.company_name
       AND w.expired = '9999-12-31'
 );
 SELECT ROW_COUNT();
+
+# Đồng bộ cluster_id (stage dedup) cho các dòng hiện hành: dòng chưa có (load trước khi có dedup)
+# và dòng mang cụm cũ sau khi staging_dedup.py --rebuild đánh lại toàn bộ cụm
+UPDATE job w
+JOIN job_temp t
+  ON w.job_title = t.job_title
+ AND w.company_name = t.company_name
+SET w.cluster_id = t.cluster_id
+WHERE w.expired = '9999-12-31'
+  AND t.cluster_id IS NOT NULL
+  AND NOT (w.cluster_id <=> t.cluster_id);
+
+# Bước 11.1. Phát hiện job đã bị gỡ khỏi nguồn: anti-join các dòng hiện hành với các job còn thấy
+# từ ngày này trở đi (job_temp được dump theo last_seen_date >= ngày nên có cả job thấy lần đầu từ các
+# ngày trước, và job đã thấy lại ở ngày sau khi load/chạy lại ngày cũ), đánh dấu is_deleted và đóng dòng
+# trong 1 câu lệnh.
+# Chỉ xét nguồn (host của job_url) có extract trong ngày: nguồn bị lỗi/không chạy không bị xóa,
+# và job_temp rỗng thì không xóa gì.
+UPDATE job w
+LEFT JOIN job_temp t
+  ON w.job_title = t.job_title
+ AND w.company_name = t.company_name
+ AND t.last_seen_date >= '${DATE_PARAM}'
+SET w.is_deleted = TRUE,
+    w.expired = CURDATE()
+WHERE w.expired = '9999-12-31'
+  AND t.job_title IS NULL
+  AND SUBSTRING_INDEX(SUBSTRING_INDEX(w.job_url, '/', 3), '/', -1) IN (
+      SELECT SUBSTRING_INDEX(SUBSTRING_INDEX(s.job_url, '/', 3), '/', -1)
+      FROM job_temp s
+      WHERE s.last_seen_date >= '${DATE_PARAM}');
+SELECT ROW_COUNT();
 \" 
 ")
 
@@ -94,13 +157,14 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
-# Lấy số dòng UPDATE và INSERT
+# Lấy số dòng UPDATE, INSERT và số job bị đánh dấu xóa
 UPDATED=$(echo "$RESULT" | sed -n '1p')
 INSERTED=$(echo "$RESULT" | sed -n '2p')
+DELETED=$(echo "$RESULT" | sed -n '3p')
 TOTAL=$((UPDATED + INSERTED))
 
 # Bước 12: Ghi log vào bảng load_to_wh_log
-log_to_control "Success" "load du lieu vao warehouse thanh cong" $TOTAL
+log_to_control "Success" "load du lieu vao warehouse thanh cong" $TOTAL $DELETED
 echo "load du lieu vao warehouse thanh cong"
-echo "Updated rows: $UPDATED, Inserted rows: $INSERTED, Total processed: $TOTAL"
+echo "Updated rows: $UPDATED, Inserted rows: $INSERTED, Deleted rows: $DELETED, Total processed: $TOTAL"
 
@@ -0,0 +1,197 @@
+#!/bin/bash
+# Chế độ catch-up: load nhiều ngày trong 1 lần scp + 1 phiên mysql trên warehouse.
+# <date_list> là danh sách ngày đã sẵn sàng, cách nhau bởi dấu phẩy, theo thứ tự tăng dần (LoadToWH truyền vào).
+
+if [ $# -ne 17 ]; then
+    echo "Usage: $0 <config.xml> <date_list> <wh_db> <wh_user> <wh_pass> <wh_ip> <wh_port> <wh_ssh_user> <remote_path> <dump_folder> <control_db> <control_user> <control_pass> <control_ip> <control_port> <dump_file> <start_time>"
+    exit 1
+fi
+
+CONFIG_XML="$1"
+DATE_LIST="$2"
+WH_DB="$3"
+WH_USER="$4"
+WH_PASS="$5"
+WH_IP="$6"
+WH_PORT="$7"
+WH_SSH_USER="$8"
+REMOTE_PATH="$9"
+DUMP_FOLDER="${10}"
+CONTROL_DB="${11}"
+CONTROL_USER="${12}"
+CONTROL_PASS="${13}"
+CONTROL_IP="${14}"
+CONTROL_PORT="${15}"
+DUMP_FILE="${16}"
+START_TIME="${17}"
+
+IFS=',' read -r -a DATES <<< "$DATE_LIST"
+REMOTE_FILE="${REMOTE_PATH}/$(basename "$DUMP_FILE")"
+
+# Warehouse trên cùng máy (vd. benchmark với MySQL cục bộ): copy và chạy trực tiếp, không qua scp/ssh
+WH_CONN=""
+if [ "$WH_IP" = "127.0.0.1" ] || [ "$WH_IP" = "localhost" ]; then
+    WH_LOCAL=1
+    WH_CONN="-h${WH_IP} -P${WH_PORT}"
+fi
+
+copy_to_warehouse() {
+    if [ -n "$WH_LOCAL" ]; then
+        mkdir -p "$(dirname "$2")" && cp "$1" "$2"
+    else
+        scp "$1" "${WH_SSH_USER}@${WH_IP}:$2"
+    fi
+}
+
+run_on_warehouse() {
+    if [ -n "$WH_LOCAL" ]; then
+        bash -c "$1"
+    else
+        ssh -o "SetEnv HISTIGNORE=*" "${WH_SSH_USER}@${WH_IP}" "$1"
+    fi
+}
+
+# Mật khẩu MySQL truyền qua MYSQL_PWD: mật khẩu rỗng không biến thành -p trần (mysql sẽ hỏi mật khẩu và treo)
+# Hàm log vào db_control (1 dòng cho mỗi ngày)
+log_to_control() {
+    local day="$1" status="$2" message="$3" rows="$4" deleted="${5:-0}"
+    MYSQL_PWD="$CONTROL_PASS" mysql -h"$CONTROL_IP" -P"$CONTROL_PORT" -u"$CONTROL_USER" -D"$CONTROL_DB" \
+        -e "INSERT INTO load_to_wh_log(execution_date,data_date,status,rows_processed,rows_deleted,start_time,end_time,message) VALUES(CURDATE(),'$day','$status',$rows,$deleted,FROM_UNIXTIME($START_TIME/1000),NOW(),'$message');" 2>/dev/null || true
+}
+
+log_all_failed() {
+    local message="$1"
+    for DAY in "${DATES[@]}"; do
+        log_to_control "$DAY" "Failed" "$message" 0
+    done
+}
+
+# Kiểm tra dump file
+if [ ! -f "$DUMP_FILE" ]; then
+    echo "khong the dump du lieu tu table staging_topcv_jobs"
+    log_all_failed "khong the dump du lieu tu table staging_topcv_jobs"
+    exit 1
+fi
+
+# Bước 9. SCP 1 file dump chứa tất cả các ngày sang server warehouse
+echo "Copying $DUMP_FILE → ${WH_SSH_USER}@${WH_IP}:${REMOTE_FILE}"
+copy_to_warehouse "$DUMP_FILE" "${REMOTE_FILE}" || { log_all_failed "khong the copy file dump tu staging sang warehouse"; exit 1; }
+
+# Bước 11. Sinh câu lệnh merge SCD2 cho từng ngày theo thứ tự thời gian.
+# Dòng cũ được expire bằng chính ngày dữ liệu để lịch sử đúng thứ tự khi catch-up.
+# Mỗi job được merge ở ngày gần nhất còn thấy job (last_seen_date) trong khoảng; job đã thấy lại
+# sau ngày cuối (staging đã chạy cho ngày sau) được merge ở ngày cuối.
+LAST_DAY="${DATES[${#DATES[@]}-1]}"
+MERGE_SQL=""
+for DAY in "${DATES[@]}"; do
+    SEEN_OP="="
+    [ "$DAY" = "$LAST_DAY" ] && SEEN_OP=">="
+    MERGE_SQL+="
+CALL ensure_job_history_partition('${DAY}');
+UPDATE job w
+JOIN job_temp t
+  ON w.job_title = t.job_title
+ AND w.company_name = t.company_name
+SET w.expired = '${DAY}'
+WHERE w.expired = '9999-12-31'
+  AND t.last_seen_date ${SEEN_OP} '${DAY}'
+  AND (w.salary <> t.salary
+       OR w.location <> t.location
+       OR w.experience_required <> t.experience_required
+       OR w.posted_time <> t.posted_time
+       OR w.job_url <> t.job_url);
+SELECT ROW_COUNT();
+INSERT INTO job (job_title, company_name, salary, location, experience_required, posted_time, job_url, extracted_date, date_id, cluster_id, expired, is_deleted)
+SELECT t.job_title, t.company_name, t.salary, t.location, t.experience_required, t.posted_time, t.job_url, t.extracted_date, t.date_id, t.cluster_id, '9999-12-31', FALSE
+FROM job_temp t
+WHERE t.last_seen_date ${SEEN_OP} '${DAY}'
+  AND NOT EXISTS (
+    SELECT 1 FROM job PARTITION (p_current) w
+    WHERE w.job_title = t.job_title
+      AND w.company_name = t.company_name
+      AND w.expired = '9999-12-31'
+);
+SELECT ROW_COUNT();
+"
+done
+
+# Bước 11.0. Đồng bộ cluster_id (stage dedup) cho các dòng hiện hành: dòng chưa có (load trước khi có dedup)
+# và dòng mang cụm cũ sau khi staging_dedup.py --rebuild đánh lại toàn bộ cụm
+MERGE_SQL+="
+UPDATE job w
+JOIN job_temp t
+  ON w.job_title = t.job_title
+ AND w.company_name = t.company_name
+SET w.cluster_id = t.cluster_id
+WHERE w.expired = '9999-12-31'
+  AND t.cluster_id IS NOT NULL
+  AND NOT (w.cluster_id <=> t.cluster_id);
+"
+
+# Bước 11.1. Phát hiện job đã bị gỡ khỏi nguồn: chỉ so với các job còn thấy từ ngày cuối cùng (mới nhất) trở đi.
+# Chỉ xét nguồn (host của job_url) có extract ở ngày cuối: nguồn bị lỗi/không chạy không bị xóa,
+# và snapshot rỗng thì không xóa gì.
+MERGE_SQL+="
+UPDATE job w
+LEFT JOIN job_temp t
+  ON w.job_title = t.job_title
+ AND w.company_name = t.company_name
+ AND t.last_seen_date >= '${LAST_DAY}'
+SET w.is_deleted = TRUE,
+    w.expired = '${LAST_DAY}'
+WHERE w.expired = '9999-12-31'
+  AND t.job_title IS NULL
+  AND SUBSTRING_INDEX(SUBSTRING_INDEX(w.job_url, '/', 3), '/', -1) IN (
+      SELECT SUBSTRING_INDEX(SUBSTRING_INDEX(s.job_url, '/', 3), '/', -1)
+      FROM job_temp s
+      WHERE s.last_seen_date >= '${LAST_DAY}');
+SELECT ROW_COUNT();
+"
+
+# Bước 10. SSH vào warehouse, load file dump vào job_temp và merge tất cả các ngày trong 1 phiên
+RESULT=$(run_on_warehouse "
+MYSQL_PWD=\"${WH_PASS}\" mysql ${WH_CONN} -u\"${WH_USER}\" -D\"${WH_DB}\" -sse \"
+DROP TABLE IF EXISTS job_temp;
+CREATE TABLE job_temp (
+    job_id varchar(50) NULL,
+    job_title varchar(255) NOT NULL,
+    company_name varchar(255) NOT NULL,
+    salary varchar(100) NULL,
+    location varchar(255) NULL,
+    experience_required varchar(100) NULL,
+    posted_time varchar(50) NULL,
+    job_url varchar(500) NULL,
+    extracted_date date NULL,
+    date_id bigint NULL,
+    cluster_id varchar(50) NULL,
+    last_seen_date date NULL,
+    INDEX idx_merge_key (job_title, company_name),
+    INDEX idx_last_seen_date (last_seen_date)
+);
+SOURCE ${REMOTE_FILE};
+${MERGE_SQL}
+\"
+")
+
+if [ $? -ne 0 ]; then
+    echo "khong the insert hay update bang job_temp vao bang job"
+    log_all_failed "khong the insert hay update bang job_temp vao bang job"
+    exit 1
+fi
+
+# Bước 12: Ghi 1 dòng log cho mỗi ngày (mỗi ngày có 2 dòng kết quả: UPDATE rồi INSERT).
+# Dòng kết quả cuối cùng là số job bị đánh dấu xóa, ghi vào log của ngày cuối.
+DELETED=$(echo "$RESULT" | sed -n "$((${#DATES[@]} * 2 + 1))p")
+LINE=1
+for DAY in "${DATES[@]}"; do
+    UPDATED=$(echo "$RESULT" | sed -n "${LINE}p")
+    INSERTED=$(echo "$RESULT" | sed -n "$((LINE + 1))p")
+    TOTAL=$((UPDATED + INSERTED))
+    LINE=$((LINE + 2))
+
+    DAY_DELETED=0
+    [ "$DAY" = "$LAST_DAY" ] && DAY_DELETED=$DELETED
+    log_to_control "$DAY" "Success" "load du lieu vao warehouse thanh cong" $TOTAL $DAY_DELETED
+    echo "[$DAY] Updated rows: $UPDATED, Inserted rows: $INSERTED, Deleted rows: $DAY_DELETED, Total processed: $TOTAL"
+done
+echo "load du lieu vao warehouse thanh cong"
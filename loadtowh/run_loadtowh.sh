@@ -7,5 +7,10 @@ CONFIG="/opt/dw/staging/config.xml"
 # Nếu có tham số thì dùng, nếu không thì lấy ngày hôm nay
 RUN_DATE="${1:-$(date +%F)}"
 
-java -jar "$JAR" "$CONFIG" "$RUN_DATE"
+# Tham số thứ 2 (tùy chọn) là ngày kết thúc -> chế độ catch-up nhiều ngày
+if [ $# -ge 2 ]; then
+    java -jar "$JAR" "$CONFIG" "$RUN_DATE" "$2"
+else
+    java -jar "$JAR" "$CONFIG" "$RUN_DATE"
+fi
 
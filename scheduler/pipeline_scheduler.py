@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""Dependency-aware scheduler for the daily pipeline, driven by db_control.
+
+Replaces the cron chain (run_all_scrapers.sh -> run_staging_pipeline.sh ->
+run_loadtowh.sh -> load_to_dm.py) and the crontab-rewriting retry wrappers.
+Each run plans a DAG of tasks per data date:
+
+    extract(source) -> staging(source) -> dedup(source) --+
+    extract(source) -> staging(source) -> dedup(source) --+--> load_to_wh -> datamart
+
+and starts every task as soon as its inputs are complete, so one source can be
+in staging while another is still being scraped, and the warehouse load starts
+the moment the last source is deduplicated. load_to_wh runs once every source
+is finished and at least one succeeded; a source that failed for good is left
+out rather than holding the warehouse back. Staging for a day waits for the
+previous day's load_to_wh, which reads the staging rows it would overwrite.
+
+Per stage (config.xml <scheduler><stage>): commands, concurrent workers, max
+attempts, retry delay (doubled per attempt, capped) and timeout. Stages that
+share state get workers="1" (staging: the shared temp table). Extracts of one
+website never overlap. Task state is kept in db_control.pipeline_task, so a
+rerun skips what already succeeded; extract and load_to_wh also check
+extract_log / load_to_wh_log, which those stages write themselves.
+
+    python3 pipeline_scheduler.py --config /opt/dw/staging/config.xml
+    python3 pipeline_scheduler.py --date 2025-11-20 --to-date 2025-11-22
+"""
+
+import mysql.connector
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, date, timedelta
+import argparse
+import fcntl
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+STAGES = ('extract', 'staging', 'dedup', 'load_to_wh', 'datamart')
+TERMINAL = ('Success', 'Failed', 'Skipped')
+
+
+class Task:
+    def __init__(self, stage, source, data_date):
+        self.stage = stage
+        self.source = source
+        self.data_date = data_date
+        self.deps = []          # must all succeed
+        self.any_deps = []      # must all finish, at least one successfully
+        self.resources = [stage]
+        self.status = 'Pending'
+        self.attempts = 0
+        self.next_attempt = 0.0
+        self.started = None
+        self.ended = None
+        self.error = None
+
+    @property
+    def name(self):
+        return f"{self.stage}[{self.source + ' ' if self.source else ''}{self.data_date}]"
+
+
+class PipelineScheduler:
+    def __init__(self, config_path):
+        self.config_path = os.path.abspath(config_path)
+        root = ET.parse(config_path).getroot()
+        db = root.find('.//database/control')
+        self.db_config = {
+            'host': db.find('host').text, 'port': int(db.find('port').text),
+            'user': db.find('user').text, 'password': db.find('password').text,
+            'database': db.find('database').text
+        }
+
+        node = root.find('./scheduler')
+        if node is None:
+            raise ValueError("config.xml has no <scheduler> section")
+        self.python = node.findtext('python', sys.executable)
+        # Stage scripts import dw_metrics.py from pythonPath (default: next to config.xml)
+        python_path = node.findtext('pythonPath', os.path.dirname(self.config_path))
+        self.env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            p for p in (python_path, os.environ.get('PYTHONPATH')) if p))
+        self.lock_file = node.findtext('lockFile')
+        self.log_dir = node.findtext('logDir')
+        self.scrapers = [(s.get('prefix'), s.text.strip()) for s in node.findall('./scrapers/scraper')]
+        self.stages = {}
+        for s in node.findall('./stage'):
+            retry_delay = int(s.get('retryDelay', '300'))
+            self.stages[s.get('name')] = {
+                'commands': [c.text.strip() for c in s.findall('command')],
+                'workers': int(s.get('workers', '1')),
+                'max_attempts': int(s.get('maxAttempts', '3')),
+                'retry_delay': retry_delay,
+                'max_retry_delay': int(s.get('maxRetryDelay', str(retry_delay * 4))),
+                'timeout': int(s.get('timeout', '3600')),
+            }
+        missing = [name for name in STAGES if name not in self.stages]
+        if missing:
+            raise ValueError(f"<scheduler> has no <stage> for: {', '.join(missing)}")
+
+        # At most one extract per website at a time, like the old sequential runner
+        self.limits = {name: stage['workers'] for name, stage in self.stages.items()}
+        self.limits.update({f"site:{prefix}": 1 for prefix, _ in self.scrapers})
+        self.in_use = {}
+        self.tasks = []
+        self.running = {}
+        self.procs = {}
+        self.procs_lock = threading.Lock()
+        self.conn = None
+
+    # =========================
+    # db_control
+    # =========================
+    def connect(self):
+        if self.conn is None:
+            self.conn = mysql.connector.connect(**self.db_config, autocommit=True)
+        else:
+            # Stages can run for an hour between two updates
+            self.conn.ping(reconnect=True, attempts=3, delay=5)
+        return self.conn
+
+    def query(self, sql, params=()):
+        c = self.connect().cursor()
+        try:
+            c.execute(sql, params)
+            return c.fetchall() if c.with_rows else None
+        finally:
+            c.close()
+
+    def enabled_sources(self):
+        return [r[0] for r in self.query("SELECT src_id FROM extract_config WHERE enabled=TRUE ORDER BY src_id")]
+
+    def save(self, task):
+        self.query(
+            """
+            INSERT INTO pipeline_task (stage, source_id, data_date, status, attempts, next_attempt_at,
+                                       start_time, end_time, error_message)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE status = VALUES(status), attempts = VALUES(attempts),
+                next_attempt_at = VALUES(next_attempt_at), start_time = VALUES(start_time),
+                end_time = VALUES(end_time), error_message = VALUES(error_message)
+            """,
+            (task.stage, task.source or '', task.data_date, task.status, task.attempts,
+             datetime.fromtimestamp(task.next_attempt) if task.status == 'Pending' and task.next_attempt else None,
+             task.started, task.ended, task.error)
+        )
+
+    def already_done(self, task):
+        """Success recorded by the stage itself (also covers runs started outside the scheduler)"""
+        if task.stage == 'extract':
+            rows = self.query("SELECT 1 FROM extract_log WHERE src_id=%s AND date=%s AND status='Success' LIMIT 1",
+                              (task.source, task.data_date))
+            return bool(rows)
+        if task.stage == 'load_to_wh':
+            return self.last_load_status(task.data_date) == 'Success'
+        return False
+
+    def last_load_status(self, data_date):
+        rows = self.query("SELECT status FROM load_to_wh_log WHERE data_date=%s ORDER BY log_id DESC LIMIT 1",
+                          (data_date,))
+        return rows[0][0] if rows else None
+
+    # =========================
+    # Planning
+    # =========================
+    def scraper_for(self, source):
+        for prefix, script in self.scrapers:
+            if source.startswith(prefix):
+                return prefix, script
+        return None, None
+
+    def plan(self, dates, force=False):
+        sources = []
+        for source in self.enabled_sources():
+            if self.scraper_for(source)[0] is None:
+                logging.warning("No scraper configured for source %s, skipping it", source)
+            else:
+                sources.append(source)
+        if not sources:
+            raise ValueError("No enabled source has a configured scraper")
+
+        previous_load = None
+        for data_date in dates:
+            dedups = []
+            for source in sources:
+                extract = Task('extract', source, data_date)
+                extract.resources.append(f"site:{self.scraper_for(source)[0]}")
+                staging = Task('staging', source, data_date)
+                # Staging overwrites the staging rows and last_seen_date the previous day's load reads,
+                # so it waits for that load (extracts still run ahead)
+                staging.deps = [extract] + ([previous_load] if previous_load else [])
+                dedup = Task('dedup', source, data_date)
+                dedup.deps = [staging]
+                self.tasks += [extract, staging, dedup]
+                dedups.append(dedup)
+
+            # The warehouse history is built day by day, so a day only loads after the previous one
+            load = Task('load_to_wh', None, data_date)
+            load.any_deps = dedups
+            load.deps = [previous_load] if previous_load else []
+            datamart = Task('datamart', None, data_date)
+            datamart.deps = [load]
+            self.tasks += [load, datamart]
+            previous_load = load
+
+        saved = {}
+        if not force:
+            for stage, source, data_date, status in self.query(
+                    "SELECT stage, source_id, data_date, status FROM pipeline_task "
+                    "WHERE data_date BETWEEN %s AND %s", (dates[0], dates[-1])):
+                saved[(stage, source, str(data_date))] = status
+
+        for task in self.tasks:
+            if saved.get((task.stage, task.source or '', task.data_date)) == 'Success' or \
+                    (not force and self.already_done(task)):
+                task.status = 'Success'
+            else:
+                # Failed/Skipped/interrupted tasks of an earlier run start over with fresh attempts
+                self.save(task)
+        logging.info("Planned %d tasks for %s..%s, sources: %s (%d already done)",
+                     len(self.tasks), dates[0], dates[-1], ", ".join(sources),
+                     sum(t.status == 'Success' for t in self.tasks))
+
+    # =========================
+    # Execution
+    # =========================
+    def commands(self, task):
+        values = {'python': self.python, 'config': self.config_path, 'date': task.data_date,
+                  'source': task.source or '', 'scraper': self.scraper_for(task.source)[1] if task.source else ''}
+        return [[arg.format(**values) for arg in shlex.split(template)]
+                for template in self.stages[task.stage]['commands']]
+
+    def execute(self, task):
+        """Worker thread: run the task's commands in order. Returns an error message, None on success"""
+        timeout = self.stages[task.stage]['timeout']
+        deadline = time.monotonic() + timeout
+        log_path = None
+        if self.log_dir:
+            os.makedirs(os.path.join(self.log_dir, task.data_date), exist_ok=True)
+            log_path = os.path.join(self.log_dir, task.data_date,
+                                    f"{task.stage}{'_' + task.source if task.source else ''}.log")
+        with open(log_path or os.devnull, 'a') as log:
+            log.write(f"=== {datetime.now():%Y-%m-%d %H:%M:%S} attempt {task.attempts + 1} ===\n")
+            for cmd in self.commands(task):
+                log.write(f"$ {shlex.join(cmd)}\n")
+                log.flush()
+                proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=self.env,
+                                        start_new_session=True)
+                with self.procs_lock:
+                    self.procs[task] = proc
+                try:
+                    code = proc.wait(timeout=max(deadline - time.monotonic(), 1))
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    return f"Command timed out after {timeout}s: {shlex.join(cmd)}"
+                finally:
+                    with self.procs_lock:
+                        self.procs.pop(task, None)
+                if code != 0:
+                    return f"Command failed with exit code {code}: {shlex.join(cmd)}"
+        return None
+
+    def ready(self, task, now):
+        """Pending task whose inputs are complete; marks it Skipped when they never will be"""
+        if any(d.status in ('Failed', 'Skipped') for d in task.deps):
+            return self.skip(task)
+        if task.any_deps and all(d.status in TERMINAL for d in task.any_deps) \
+                and not any(d.status == 'Success' for d in task.any_deps):
+            return self.skip(task)
+        if any(d.status != 'Success' for d in task.deps) or any(d.status not in TERMINAL for d in task.any_deps):
+            return False
+        return task.next_attempt <= now
+
+    def skip(self, task):
+        task.status = 'Skipped'
+        task.error = "Upstream task failed"
+        self.save(task)
+        logging.warning("%s skipped: upstream task failed", task.name)
+        return False
+
+    def has_capacity(self, task):
+        return all(self.in_use.get(r, 0) < self.limits.get(r, 1) for r in task.resources)
+
+    def start(self, task, executor):
+        for r in task.resources:
+            self.in_use[r] = self.in_use.get(r, 0) + 1
+        task.status = 'Running'
+        task.started = datetime.now()
+        task.ended = None
+        self.save(task)
+        if task.any_deps:
+            left_out = [d.source for d in task.any_deps if d.status != 'Success']
+            if left_out:
+                logging.warning("%s starts without sources: %s", task.name, ", ".join(left_out))
+        logging.info("%s started (attempt %d)", task.name, task.attempts + 1)
+        self.running[executor.submit(self.execute, task)] = task
+
+    def finish(self, task, error):
+        for r in task.resources:
+            self.in_use[r] -= 1
+        task.attempts += 1
+        task.ended = datetime.now()
+        # LoadToWH exits 0 when staging is not ready yet; its load_to_wh_log row is the real outcome
+        if error is None and task.stage == 'load_to_wh' and self.last_load_status(task.data_date) != 'Success':
+            error = "load_to_wh_log has no Success row for this date"
+        # Same for extract: the scraper's extract_log row decides, not only its exit code
+        if error is None and task.stage == 'extract' and not self.already_done(task):
+            error = "extract_log has no Success row for this source and date"
+        seconds = (task.ended - task.started).total_seconds()
+        stage = self.stages[task.stage]
+
+        if error is None:
+            task.status, task.error = 'Success', None
+            logging.info("%s succeeded in %.0fs", task.name, seconds)
+        elif task.attempts < stage['max_attempts']:
+            delay = min(stage['retry_delay'] * 2 ** (task.attempts - 1), stage['max_retry_delay'])
+            task.status, task.error = 'Pending', error
+            task.next_attempt = time.time() + delay
+            logging.warning("%s failed (attempt %d/%d): %s, retry in %ds",
+                            task.name, task.attempts, stage['max_attempts'], error, delay)
+        else:
+            task.status, task.error = 'Failed', error
+            logging.error("%s failed after %d attempts: %s", task.name, task.attempts, error)
+        self.save(task)
+
+    def run(self):
+        executor = ThreadPoolExecutor(max_workers=sum(s['workers'] for s in self.stages.values()))
+        try:
+            while True:
+                now = time.time()
+                waiting = []
+                # Tasks are in dependency (and date) order, so a skip propagates downstream in one pass
+                for task in self.tasks:
+                    if task.status != 'Pending':
+                        continue
+                    if self.ready(task, now):
+                        if self.has_capacity(task):
+                            self.start(task, executor)
+                    elif task.status == 'Pending' and task.next_attempt > now:
+                        waiting.append(task.next_attempt)
+
+                if not self.running:
+                    if not any(t.status == 'Pending' for t in self.tasks):
+                        break
+                    time.sleep(max(min(waiting, default=now + 1) - now, 0.1))
+                    continue
+
+                timeout = max(min(waiting) - now, 0.1) if waiting else None
+                done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = self.running.pop(future)
+                    try:
+                        error = future.result()
+                    except Exception as e:
+                        error = str(e)
+                    self.finish(task, error)
+        finally:
+            self.interrupt()
+            executor.shutdown(wait=True)
+        return all(t.status == 'Success' for t in self.tasks)
+
+    def interrupt(self):
+        """On shutdown: kill running stage processes and leave their tasks Pending for the next run"""
+        with self.procs_lock:
+            for proc in self.procs.values():
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for task in self.running.values():
+            task.status, task.error, task.ended = 'Pending', "Interrupted", datetime.now()
+            try:
+                self.save(task)
+            except Exception as e:
+                logging.error("Cannot save state of %s: %s", task.name, e)
+
+    def summary(self):
+        for task in self.tasks:
+            duration = f"{(task.ended - task.started).total_seconds():.0f}s" if task.started and task.ended else "-"
+            logging.info("  %-40s %-8s attempts=%d duration=%s%s", task.name, task.status, task.attempts, duration,
+                         f" ({task.error})" if task.error and task.status != 'Success' else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dependency-aware pipeline scheduler')
+    parser.add_argument('--config', default='/opt/dw/staging/config.xml', help='Path to config.xml')
+    parser.add_argument('--date', help='Data date YYYY-MM-DD (default: today)')
+    parser.add_argument('--to-date', help='Last data date for a catch-up over several days')
+    parser.add_argument('--force', action='store_true', help='Rerun tasks that already succeeded')
+    args = parser.parse_args()
+
+    try:
+        first = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else date.today()
+        last = datetime.strptime(args.to_date, '%Y-%m-%d').date() if args.to_date else first
+    except ValueError as e:
+        print(f"Error: invalid date ({e}). Use YYYY-MM-DD.")
+        return 1
+    if last < first:
+        print("Error: --to-date is before --date")
+        return 1
+    dates = [str(first + timedelta(days=i)) for i in range((last - first).days + 1)]
+
+    scheduler = PipelineScheduler(args.config)
+
+    handlers = [logging.StreamHandler()]
+    if scheduler.log_dir:
+        os.makedirs(scheduler.log_dir, exist_ok=True)
+        handlers.append(logging.FileHandler(os.path.join(scheduler.log_dir, "scheduler.log")))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", handlers=handlers)
+
+    lock = None
+    if scheduler.lock_file:
+        os.makedirs(os.path.dirname(scheduler.lock_file), exist_ok=True)
+        lock = open(scheduler.lock_file, 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.error("Another scheduler is running (lock %s). Exiting.", scheduler.lock_file)
+            return 1
+
+    # SIGTERM (systemd/kill) shuts down like Ctrl+C: children killed, running tasks back to Pending
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    logging.info("=== START PIPELINE SCHEDULER %s..%s ===", dates[0], dates[-1])
+    started = time.time()
+    ok = False
+    try:
+        scheduler.plan(dates, force=args.force)
+        ok = scheduler.run()
+    except Exception as e:
+        logging.error("Scheduler failed: %s", e)
+    finally:
+        scheduler.summary()
+        logging.info("=== END PIPELINE SCHEDULER (%s, %.0fs) ===", "Success" if ok else "Failed", time.time() - started)
+        if scheduler.conn is not None:
+            scheduler.conn.close()
+        if lock is not None:
+            lock.close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
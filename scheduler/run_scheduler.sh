@@ -0,0 +1,28 @@
+#!/bin/bash
+# =============================================================================
+# PIPELINE SCHEDULER
+# Chạy toàn bộ pipeline (extract -> staging -> dedup -> load_to_wh -> datamart)
+# theo DAG trong db_control.pipeline_task, retry ngay trong tiến trình.
+# Thay cho các dòng crontab cũ (run_all_scrapers.sh, run_staging_pipeline.sh,
+# run_loadtowh.sh, load_to_dm.py) và cron tạm của các retry wrapper:
+#
+#   0 7 * * * /opt/dw/staging/scheduler/run_scheduler.sh >> /opt/dw/staging/scheduler/logs/cron.log 2>&1
+#
+# Tham số (tùy chọn): <date> [<to_date>] để chạy lại / catch-up nhiều ngày
+# =============================================================================
+
+CONFIG="/opt/dw/staging/config.xml"
+SCRIPT="/opt/dw/staging/scheduler/pipeline_scheduler.py"
+VENV="/opt/dw/staging/extract/venv/bin/activate"
+
+source $VENV
+
+ARGS=(--config "$CONFIG")
+[ $# -ge 1 ] && ARGS+=(--date "$1")
+[ $# -ge 2 ] && ARGS+=(--to-date "$2")
+
+python3 "$SCRIPT" "${ARGS[@]}"
+EXIT_CODE=$?
+
+deactivate
+exit $EXIT_CODE
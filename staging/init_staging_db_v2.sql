@@ -64,8 +64,34 @@ CREATE TABLE staging_topcv_jobs (
     job_url VARCHAR(500) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NULL DEFAULT NULL,
     extracted_date DATE NULL DEFAULT NULL,
     date_id BIGINT NULL DEFAULT NULL,
+    -- Cụm tin trùng giữa các nguồn, do staging_dedup.py gán (job_id đại diện của cụm)
+    cluster_id VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NULL DEFAULT NULL,
+    -- Ngày gần nhất job còn xuất hiện trong lần extract của nguồn (transformer cập nhật mỗi lần upsert);
+    -- LoadToWH dump theo cột này để job_temp là snapshot đầy đủ của ngày
+    last_seen_date DATE NULL DEFAULT NULL,
     
     -- Index hỗ trợ tìm kiếm (Optional - nên thêm)
     UNIQUE KEY idx_job_id (job_id),
-    INDEX idx_date (date_id)
-) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci ROW_FORMAT = Dynamic;
\ No newline at end of file
+    INDEX idx_date (date_id),
+    INDEX idx_cluster_id (cluster_id),
+    INDEX idx_last_seen_date (last_seen_date)
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci ROW_FORMAT = Dynamic;
+
+-- Index MinHash/LSH của stage dedup (giữ qua các lần chạy để chỉ index job mới)
+-- Chữ ký MinHash của từng job: numPerm giá trị uint64 (little-endian)
+CREATE TABLE IF NOT EXISTS job_dedup_signature (
+    job_id VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    cluster_id VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    signature VARBINARY(2048) NOT NULL,
+    indexed_at DATETIME NOT NULL,
+    PRIMARY KEY (job_id),
+    INDEX idx_cluster_id (cluster_id)
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci;
+
+-- Bucket LSH: mỗi job có 1 dòng cho mỗi band, tra ứng viên trùng theo (band, bucket)
+CREATE TABLE IF NOT EXISTS job_dedup_lsh (
+    band TINYINT UNSIGNED NOT NULL,
+    bucket BIGINT UNSIGNED NOT NULL,
+    job_id VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    PRIMARY KEY (band, bucket, job_id)
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_unicode_ci;
\ No newline at end of file
@@ -24,6 +24,8 @@ TODAY=$(date +%Y-%m-%d)   # Lấy ngày hiện tại (YYYY-MM-DD)
 # 2. KÍCH HOẠT MÔI TRƯỜNG
 # -----------------------------------------------------------------------------
 source $VENV
+# dw_metrics.py (dùng chung cho mọi stage) nằm ở /opt/dw/staging, cạnh config.xml
+export PYTHONPATH="/opt/dw/staging${PYTHONPATH:+:$PYTHONPATH}"
 
 echo "=================================================="
 echo "   STAGING PIPELINE STARTED: $(date)"
@@ -67,18 +69,39 @@ TRANSFORMER_EXIT_CODE=$?
 
 if [ $TRANSFORMER_EXIT_CODE -eq 0 ]; then
     echo ">> [SUCCESS] Transformer completed successfully."
+else
+    echo ">> [FAILED] Transformer encountered an error (Exit Code: $TRANSFORMER_EXIT_CODE)."
+    echo ">> Pipeline Finished with Errors."
+    deactivate
+    exit 1
+fi
+
+# 5. BƯỚC 3: DEDUP (GÁN CLUSTER_ID CHO TIN TRÙNG GIỮA CÁC NGUỒN)
+# -----------------------------------------------------------------------------
+echo ""
+echo "[STEP 3] Running Staging Dedup..."
+echo "Command: python3 staging_dedup.py"
+
+python3 $BASE_DIR/staging_dedup.py \
+    --config $CONFIG
+
+# Kiểm tra trạng thái kết thúc của Bước 3
+DEDUP_EXIT_CODE=$?
+
+if [ $DEDUP_EXIT_CODE -eq 0 ]; then
+    echo ">> [SUCCESS] Dedup completed successfully."
     echo ""
     echo "=================================================="
     echo "   PIPELINE FINISHED SUCCESSFULLY"
     echo "=================================================="
 else
-    echo ">> [FAILED] Transformer encountered an error (Exit Code: $TRANSFORMER_EXIT_CODE)."
+    echo ">> [FAILED] Dedup encountered an error (Exit Code: $DEDUP_EXIT_CODE)."
     echo ">> Pipeline Finished with Errors."
     deactivate
     exit 1
 fi
 
-# 5. DỌN DẸP & THOÁT
+# 6. DỌN DẸP & THOÁT
 # -----------------------------------------------------------------------------
 deactivate
 exit 0
\ No newline at end of file
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import sys, re, struct, hashlib, random, unicodedata, argparse, mysql.connector
+import xml.etree.ElementTree as ET
+from dw_metrics import Metrics
+
+# Loại hình công ty và từ "quảng cáo" trong tiêu đề (sau khi bỏ dấu): bỏ đi trước khi so khớp,
+# vì cùng một tin đăng thường chỉ khác nhau ở những phần này giữa các nguồn
+COMPANY_NOISE = re.compile(
+    r"\b(cong ty|co phan|cp|tnhh|mtv|mot thanh vien|tap doan|chi nhanh|van phong dai dien"
+    r"|joint stock company|company limited|co ltd|jsc|ltd|llc|inc|corp|corporation|company)\b"
+)
+TITLE_NOISE = re.compile(r"\b(tuyen dung|tuyen gap|can tuyen|gap|urgent|hot|hiring)\b")
+
+# Tham số MinHash cố định: chữ ký đã lưu chỉ so sánh được khi dùng cùng seed và số hoán vị
+MINHASH_SEED = 20251122
+MERSENNE_PRIME = (1 << 61) - 1
+SHINGLE_SIZE = 4
+
+# Số job mỗi lần tra index / ghi index
+LOOKUP_BATCH_SIZE = 500
+
+
+def strip_accents(text):
+    text = text.lower().replace('đ', 'd')
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def normalize(text, noise):
+    """Chuẩn hóa tên: bỏ dấu, bỏ nội dung trong ngoặc, ký tự đặc biệt và các cụm từ nhiễu"""
+    if not text:
+        return ''
+    text = strip_accents(text)
+    text = re.sub(r'[\(\[\{].*?[\)\]\}]', ' ', text)
+    text = ' '.join(re.findall(r'[a-z0-9]+', text))
+    return ' '.join(noise.sub(' ', text).split())
+
+
+def shingles(title, company):
+    """Shingle ký tự của tiêu đề và tên công ty (gắn tiền tố để 2 phần không trộn lẫn)"""
+    result = set()
+    for prefix, text in (('t', title), ('c', company)):
+        padded = f" {text} "
+        if len(padded) <= SHINGLE_SIZE:
+            result.add(f"{prefix}:{padded}")
+        for i in range(len(padded) - SHINGLE_SIZE + 1):
+            result.add(f"{prefix}:{padded[i:i + SHINGLE_SIZE]}")
+    return result
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class StagingDedup:
+    """Gom cụm các tin tuyển dụng trùng giữa các nguồn bằng MinHash/LSH.
+
+    Mỗi job trong staging_topcv_jobs được gán cluster_id (job_id đại diện của cụm).
+    Chữ ký MinHash và bucket LSH được lưu trong db_staging nên mỗi ngày chỉ cần
+    tính và tra cứu các job mới so với index đã có.
+    """
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        tree = ET.parse(config_path)
+        root = tree.getroot()
+        db = root.find('.//database/control')
+        self.config = {
+            'host': db.find('host').text,
+            'user': db.find('user').text,
+            'password': db.find('password').text,
+            'port': int(db.find('port').text)
+        }
+        dedup = root.find('.//dedup')
+        self.num_perm = int(dedup.findtext('numPerm', '64')) if dedup is not None else 64
+        self.bands = int(dedup.findtext('bands', '16')) if dedup is not None else 16
+        self.threshold = float(dedup.findtext('threshold', '0.7')) if dedup is not None else 0.7
+        if self.num_perm % self.bands:
+            print(f"Invalid dedup config: numPerm {self.num_perm} is not a multiple of bands {self.bands}")
+            sys.exit(1)
+        self.rows_per_band = self.num_perm // self.bands
+
+        rng = random.Random(MINHASH_SEED)
+        self.perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                      for _ in range(self.num_perm)]
+        self.conn = None
+        # is_process_done_procedure bỏ qua process này: dedup xong không có nghĩa staging của ngày đã sẵn sàng
+        self.PROCESS_NAME = 'Staging_Dedup_Jobs'
+
+    def connect(self):
+        """Thiết lập kết nối Database"""
+        try:
+            if self.conn is None or not self.conn.is_connected():
+                self.conn = mysql.connector.connect(**self.config, autocommit=True)
+        except Exception as e:
+            print(f"Connection Failed: {e}")
+            sys.exit(1)
+
+    def get_process_id(self):
+        c = self.conn.cursor()
+        try:
+            c.execute("SELECT process_id FROM db_control.process_config WHERE process_name = %s", (self.PROCESS_NAME,))
+            result = c.fetchone()
+            if result:
+                return result[0]
+            print(f"Process '{self.PROCESS_NAME}' not found. Creating...")
+            c.execute("INSERT INTO db_control.process_config (process_name, process_type, description) "
+                      "VALUES (%s, 'transform', 'Cross-source duplicate detection (MinHash/LSH)')", (self.PROCESS_NAME,))
+            return c.lastrowid
+        finally:
+            c.close()
+
+    def signature(self, shingle_set):
+        hashes = [hash64(s) for s in shingle_set]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.perms]
+
+    def band_buckets(self, sig):
+        # Mỗi band được băm thành 1 bucket 64 bit; 2 job cùng bucket ở ít nhất 1 band là ứng viên trùng
+        r = self.rows_per_band
+        return [
+            (band, hash64(','.join(map(str, sig[band * r:(band + 1) * r]))))
+            for band in range(self.bands)
+        ]
+
+    def similarity(self, sig_a, sig_b):
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / self.num_perm
+
+    def pack(self, sig):
+        return struct.pack(f'<{self.num_perm}Q', *sig)
+
+    def unpack(self, blob):
+        if len(blob) != 8 * self.num_perm:
+            raise ValueError("Stored signatures use a different numPerm, run with --rebuild")
+        return list(struct.unpack(f'<{self.num_perm}Q', blob))
+
+    def load_candidates(self, c, buckets):
+        """Tra các bucket trong index đã lưu, trả về {(band, bucket): [job_id]} và {job_id: (cluster_id, sig)}"""
+        by_bucket, indexed = {}, {}
+        pairs = list(buckets)
+        for i in range(0, len(pairs), LOOKUP_BATCH_SIZE * self.bands):
+            chunk = pairs[i:i + LOOKUP_BATCH_SIZE * self.bands]
+            c.execute(
+                "SELECT l.band, l.bucket, s.job_id, s.cluster_id, s.signature "
+                "FROM db_staging.job_dedup_lsh l JOIN db_staging.job_dedup_signature s ON s.job_id = l.job_id "
+                f"WHERE (l.band, l.bucket) IN ({', '.join(['(%s, %s)'] * len(chunk))})",
+                [v for pair in chunk for v in pair]
+            )
+            for band, bucket, job_id, cluster_id, blob in c.fetchall():
+                by_bucket.setdefault((band, bucket), []).append(job_id)
+                if job_id not in indexed:
+                    indexed[job_id] = (cluster_id, self.unpack(bytes(blob)))
+        return by_bucket, indexed
+
+    def rebuild(self, c):
+        # Cụm mới thay cho cụm cũ trong warehouse ở lần load tới: load_to_wh.sh ghi đè cluster_id khác nhau
+        print("Rebuilding dedup index from scratch...")
+        c.execute("TRUNCATE TABLE db_staging.job_dedup_lsh")
+        c.execute("TRUNCATE TABLE db_staging.job_dedup_signature")
+        c.execute("UPDATE db_staging.staging_topcv_jobs SET cluster_id = NULL")
+
+    def run(self, rebuild=False):
+        self.connect()
+        process_id = self.get_process_id()
+
+        c = self.conn.cursor()
+        log_id = None
+        metrics = Metrics('staging_dedup', self.config_path)
+        try:
+            c.execute("INSERT INTO db_control.process_log (process_id, execution_date, status, start_time) "
+                      "VALUES (%s, NOW(), 'Running', NOW())", (process_id,))
+            log_id = c.lastrowid
+        except Exception as e:
+            print(f"Cannot write log start: {e}")
+
+        try:
+            if rebuild:
+                self.rebuild(c)
+
+            # 1. Chỉ lấy job chưa được gán cụm (job mới từ lần transform này)
+            c.execute("SELECT job_id, job_title, company_name FROM db_staging.staging_topcv_jobs "
+                      "WHERE cluster_id IS NULL AND job_id IS NOT NULL ORDER BY extracted_date, job_id")
+            new_jobs = c.fetchall()
+            if not new_jobs:
+                print("No new jobs to deduplicate.")
+                if log_id:
+                    c.execute("UPDATE db_control.process_log SET status='Success', end_time=NOW(), "
+                              "error_message='No new jobs' WHERE log_id=%s", (log_id,))
+                metrics.close('Success', self.conn)
+                return
+
+            # 2. Tính chữ ký MinHash và bucket LSH cho các job mới
+            # Job không còn gì sau chuẩn hóa thì tự lập cụm và không đưa vào bucket (tránh gom nhầm)
+            with metrics.span('signature', rows=len(new_jobs)):
+                prepared = []
+                for job_id, title, company in new_jobs:
+                    title, company = normalize(title, TITLE_NOISE), normalize(company, COMPANY_NOISE)
+                    sig = self.signature(shingles(title, company))
+                    prepared.append((job_id, sig, self.band_buckets(sig) if title or company else []))
+
+            # 3. Tra ứng viên trong index đã lưu (chỉ các bucket của job mới, không quét toàn bộ)
+            with metrics.span('lookup', rows=len(prepared)):
+                by_bucket, indexed = self.load_candidates(c, {b for _, _, buckets in prepared for b in buckets})
+
+            # 4. Gán cụm: cụm của ứng viên giống nhất nếu vượt ngưỡng, ngược lại job tự lập cụm mới.
+            # Job mới cũng được thêm vào index trong bộ nhớ để các job mới trùng nhau gom về cùng cụm.
+            with metrics.span('assign', rows=len(prepared)):
+                assignments, merged = [], 0
+                for job_id, sig, buckets in prepared:
+                    candidates = {other for b in buckets for other in by_bucket.get(b, ())}
+                    best_cluster, best_sim = None, self.threshold
+                    for other in candidates:
+                        cluster_id, other_sig = indexed[other]
+                        sim = self.similarity(sig, other_sig)
+                        if sim >= best_sim:
+                            best_cluster, best_sim = cluster_id, sim
+                    cluster_id = best_cluster or job_id
+                    merged += best_cluster is not None
+
+                    indexed[job_id] = (cluster_id, sig)
+                    for b in buckets:
+                        by_bucket.setdefault(b, []).append(job_id)
+                    assignments.append((job_id, cluster_id, sig, buckets))
+
+            # 5. Lưu index và cập nhật cluster_id vào staging
+            with metrics.span('write_index', rows=len(assignments)):
+                for i in range(0, len(assignments), LOOKUP_BATCH_SIZE):
+                    chunk = assignments[i:i + LOOKUP_BATCH_SIZE]
+                    c.executemany(
+                        "INSERT INTO db_staging.job_dedup_signature (job_id, cluster_id, signature, indexed_at) "
+                        "VALUES (%s, %s, %s, NOW()) "
+                        "ON DUPLICATE KEY UPDATE cluster_id = VALUES(cluster_id), signature = VALUES(signature)",
+                        [(job_id, cluster_id, self.pack(sig)) for job_id, cluster_id, sig, _ in chunk]
+                    )
+                    c.executemany(
+                        "INSERT IGNORE INTO db_staging.job_dedup_lsh (band, bucket, job_id) VALUES (%s, %s, %s)",
+                        [(band, bucket, job_id) for job_id, _, _, buckets in chunk for band, bucket in buckets]
+                    )
+                c.execute("UPDATE db_staging.staging_topcv_jobs s JOIN db_staging.job_dedup_signature d "
+                          "ON d.job_id = s.job_id SET s.cluster_id = d.cluster_id WHERE s.cluster_id IS NULL")
+
+            if log_id:
+                c.execute("UPDATE db_control.process_log SET status='Success', rows_processed=%s, end_time=NOW(), "
+                          "error_message=%s WHERE log_id=%s",
+                          (len(assignments), f"Indexed {len(assignments)} jobs, {merged} matched an existing cluster",
+                           log_id))
+            metrics.rows = len(assignments)
+            metrics.close('Success', self.conn)
+            print(f"Success. Indexed {len(assignments)} jobs, {merged} matched an existing cluster.")
+
+        except Exception as e:
+            if log_id:
+                c.execute("UPDATE db_control.process_log SET status='Failed', end_time=NOW(), error_message=%s "
+                          "WHERE log_id=%s", (str(e), log_id))
+            metrics.close('Failed', self.conn)
+            print(f"Error: {e}")
+            sys.exit(1)
+        finally:
+            c.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cross-source duplicate job detection')
+    parser.add_argument('--config', required=True)
+    parser.add_argument('--rebuild', action='store_true', help='Drop the persisted index and recluster every job')
+    args = parser.parse_args()
+
+    dedup = StagingDedup(args.config)
+    dedup.run(rebuild=args.rebuild)
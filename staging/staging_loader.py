@@ -3,9 +3,11 @@ import os, sys, csv, glob, argparse, mysql.connector
 from datetime import datetime, date
 import xml.etree.ElementTree as ET
 import logging
+from dw_metrics import Metrics
 
 class StagingLoader:
     def __init__(self, config_path):
+        self.config_path = config_path
         self.config = self._parse_config(config_path)
         self.conn = None
         self._setup_logging()
@@ -48,6 +50,8 @@ class StagingLoader:
     def run(self, source_id, run_date):
         self.connect()
         date_str = run_date.strftime('%Y-%m-%d')
+        metrics = Metrics('staging_load', self.config_path, source_id, date_str)
+        failed = 0
         
         # --- CẬP NHẬT PATTERN TẠI ĐÂY ---
         # Cũ: .../date=YYYY-MM-DD/*.csv
@@ -68,28 +72,36 @@ class StagingLoader:
             fname = os.path.basename(f)
             self.log_id = self.log_to_db('RUNNING', fname, f)
             try:
-                with open(f, 'r', encoding='utf-8-sig') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    data = []
-                    for row in reader:
-                        data.append((
-                            row.get('job_id'), row.get('job_title'), row.get('company_name'),
-                            row.get('salary'), row.get('location'), row.get('experience_required'),
-                            row.get('posted_time'), row.get('job_url'), row.get('extracted_date')
-                        ))
+                with metrics.span('file_load') as span, open(f, 'r', encoding='utf-8-sig') as csvfile:
+                    with metrics.span('read_csv'):
+                        reader = csv.DictReader(csvfile)
+                        data = []
+                        for row in reader:
+                            data.append((
+                                row.get('job_id'), row.get('job_title'), row.get('company_name'),
+                                row.get('salary'), row.get('location'), row.get('experience_required'),
+                                row.get('posted_time'), row.get('job_url'), row.get('extracted_date')
+                            ))
                     
                     sql = """INSERT INTO db_staging.staging_topcv_jobs_temp 
                              (job_id, job_title, company_name, salary, location, experience_required, posted_time, job_url, extracted_date) 
                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
                     if data:
-                        cursor.executemany(sql, data)
+                        with metrics.span('insert', rows=len(data)):
+                            cursor.executemany(sql, data)
+                    span.rows = len(data)
                 
+                metrics.rows += len(data)
                 self.log_to_db('SUCCESS', fname, f, len(data), "Loaded to temp")
                 print(f"Loaded {len(data)} rows from {fname}")
             except Exception as e:
+                failed += 1
                 self.log_to_db('FAILED', fname, f, 0, str(e))
                 print(f"Error loading {fname}: {e}")
 
+        metrics.close('Failed' if failed else 'Success', self.conn)
+        return failed
+
 if __name__ == "__main__":    
     # KHỞI TẠO BỘ ĐỌC THAM SỐ
     parser = argparse.ArgumentParser(description='Staging Loader Script')
@@ -115,4 +127,6 @@ if __name__ == "__main__":
     # CHẠY LOADER
     # args.config sẽ chứa đường dẫn file thật (/opt/dm/.../config.xml)
     loader = StagingLoader(args.config)
-    loader.run(args.source_id, run_date)
\ No newline at end of file
+    # Exit code 1 nếu có file lỗi (pipeline_scheduler.py dựa vào exit code để retry)
+    failed = loader.run(args.source_id, run_date)
+    sys.exit(1 if failed else 0)
\ No newline at end of file
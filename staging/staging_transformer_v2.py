@@ -2,9 +2,14 @@
 import sys, re, mysql.connector, argparse
 from datetime import datetime, timedelta, date
 import xml.etree.ElementTree as ET
+from dw_metrics import Metrics
+
+# Số dòng mỗi lần upsert vào staging_topcv_jobs
+UPSERT_BATCH_SIZE = 1000
 
 class StagingTransformer:
     def __init__(self, config_path):
+        self.config_path = config_path
         tree = ET.parse(config_path)
         root = tree.getroot()
         db = root.find('.//database/control')
@@ -95,73 +100,92 @@ class StagingTransformer:
         
         c = self.conn.cursor()
         log_id = None
+        metrics = Metrics('staging_transform', self.config_path)
         
         # Ghi Log Start
         try:
-            c.execute("INSERT INTO db_control.process_log (process_id, execution_date, status) VALUES (%s, NOW(), 'Running')", (process_id,))
+            c.execute("INSERT INTO db_control.process_log (process_id, execution_date, status, start_time) VALUES (%s, NOW(), 'Running', NOW())", (process_id,))
             log_id = c.lastrowid
         except Exception as e:
             print(f"Cannot write log start: {e}")
         
         try:
             # 2. Đọc dữ liệu từ bảng Tạm
-            c.execute("SELECT * FROM db_staging.staging_topcv_jobs_temp")
-            rows = c.fetchall()
+            with metrics.span('read_temp') as span:
+                c.execute("SELECT * FROM db_staging.staging_topcv_jobs_temp")
+                rows = c.fetchall()
+                span.rows = len(rows)
             
             if not rows:
                 print("No data in temp table.")
+                if log_id:
+                    c.execute("UPDATE db_control.process_log SET status='Success', end_time=NOW(), error_message='No data in temp table' WHERE log_id=%s", (log_id,))
+                metrics.close('Success', self.conn)
                 return
 
             cols = [i[0] for i in c.description]
             
+            # Load vào bảng job (của teammate)
+            # Chú ý: Sửa tên bảng 'db_staging.job' nếu thực tế khác
+            # extracted_date giữ ngày thấy job lần đầu; last_seen_date là ngày mới nhất job còn trên nguồn
+            sql = """
+                INSERT INTO db_staging.staging_topcv_jobs
+                (job_id, job_title, company_name, salary, location, 
+                 experience_required, posted_time, job_url, extracted_date, date_id, last_seen_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE 
+                    job_title = VALUES(job_title), 
+                    salary = VALUES(salary),
+                    posted_time = VALUES(posted_time),
+                    date_id = VALUES(date_id),
+                    last_seen_date = GREATEST(COALESCE(last_seen_date, VALUES(last_seen_date)), VALUES(last_seen_date))
+            """
+            
             count = 0
-            for r in rows:
-                row = dict(zip(cols, r))
-                
-                # Transform
-                p_date_obj = self.calc_posted_date(row['posted_time'], row['extracted_date'])
-                posted_time_clean = p_date_obj.strftime('%Y-%m-%d') if p_date_obj else None
-                
-                date_str = row['extracted_date']
-                if date_str in self.date_lookup:
-                    date_id = self.date_lookup[date_str] # Lấy ID chính xác từ DB (ví dụ: 325)
-                else:
-                    date_id = None # Hoặc ID mặc định
-                    print(f"Warning: Date {date_str} not found in date_dim")
+            # Upsert theo lô: 1 round trip cho mỗi UPSERT_BATCH_SIZE dòng thay vì mỗi dòng
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = []
+                with metrics.span('transform') as span:
+                    for r in rows[start:start + UPSERT_BATCH_SIZE]:
+                        row = dict(zip(cols, r))
+                        
+                        # Transform
+                        p_date_obj = self.calc_posted_date(row['posted_time'], row['extracted_date'])
+                        posted_time_clean = p_date_obj.strftime('%Y-%m-%d') if p_date_obj else None
+                        
+                        date_str = row['extracted_date']
+                        if date_str in self.date_lookup:
+                            date_id = self.date_lookup[date_str] # Lấy ID chính xác từ DB (ví dụ: 325)
+                        else:
+                            date_id = None # Hoặc ID mặc định
+                            print(f"Warning: Date {date_str} not found in date_dim")
+
+                        batch.append((
+                            row['job_id'], row['job_title'], row['company_name'], 
+                            row['salary'], row['location'], row['experience_required'],
+                            posted_time_clean, 
+                            row['job_url'], row['extracted_date'], date_id, row['extracted_date']
+                        ))
+                    span.rows = len(batch)
 
-                # Load vào bảng job (của teammate)
-                # Chú ý: Sửa tên bảng 'db_staging.job' nếu thực tế khác
-                sql = """
-                    INSERT INTO db_staging.staging_topcv_jobs
-                    (job_id, job_title, company_name, salary, location, 
-                     experience_required, posted_time, job_url, extracted_date, date_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE 
-                        job_title = VALUES(job_title), 
-                        salary = VALUES(salary),
-                        posted_time = VALUES(posted_time),
-                        date_id = VALUES(date_id)
-                """
-                
-                c.execute(sql, (
-                    row['job_id'], row['job_title'], row['company_name'], 
-                    row['salary'], row['location'], row['experience_required'],
-                    posted_time_clean, 
-                    row['job_url'], row['extracted_date'], date_id
-                ))
-                count += 1
+                with metrics.span('batch_upsert', rows=len(batch)):
+                    c.executemany(sql, batch)
+                count += len(batch)
             
             # Update Log Success
             if log_id:
-                c.execute("UPDATE db_control.process_log SET status='Success', error_message=%s WHERE log_id=%s", 
-                          (f"Loaded {count} rows into 'job'", log_id))
+                c.execute("UPDATE db_control.process_log SET status='Success', rows_processed=%s, end_time=NOW(), error_message=%s WHERE log_id=%s", 
+                          (count, f"Loaded {count} rows into 'job'", log_id))
+            metrics.rows = count
+            metrics.close('Success', self.conn)
             print(f"Success. Loaded {count} rows.")
             
         except Exception as e:
             # Update Log Failed
             if log_id:
-                c.execute("UPDATE db_control.process_log SET status='Failed', error_message=%s WHERE log_id=%s", 
+                c.execute("UPDATE db_control.process_log SET status='Failed', end_time=NOW(), error_message=%s WHERE log_id=%s", 
                           (str(e), log_id))
+            metrics.close('Failed', self.conn)
             print(f"Error: {e}")
             sys.exit(1)
 